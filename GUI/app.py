@@ -1,8 +1,13 @@
 import dash
 import dash_bootstrap_components as dbc
 from dash import dcc, html, Input, Output
+from flask import abort, jsonify, request
 # Importa entrambe le navbar dal tuo modulo
 from components.shared_components import navbar_no_logo, navbar_with_logo
+from thingspeak_live import poller_thingspeak
+from eventi_thingspeak import registra_eventi
+from database import inizializza_database
+from data_loader import avvia_precaricamento
 
 app = dash.Dash(
     __name__,
@@ -13,6 +18,33 @@ app = dash.Dash(
 
 server = app.server
 
+# Schema del database delle segnalazioni creato una volta all'avvio, non a ogni inserimento
+inizializza_database()
+
+# Avviati solo nel processo web: non nei processi del pool di precaricamento,
+# che con "python app.py" importano questo file come __mp_main__
+if __name__ != '__mp_main__':
+    # Un solo poller per tutti i canali ThingSpeak, condiviso da tutti i client (e tra i worker gunicorn)
+    poller_thingspeak.avvia()
+
+    # CSV delle stazioni parsati in background da un pool di processi, con i
+    # sidecar scritti sul filesystem del dyno web
+    avvia_precaricamento()
+
+# I punti nuovi arrivano al browser con Server-Sent Events, senza polling dai client
+registra_eventi(server)
+
+
+@server.route('/metriche/thingspeak')
+def metriche_thingspeak():
+    """Stato del poller e metriche (latenze, errori, circuito) delle richieste a ThingSpeak."""
+    try:
+        snapshot = poller_thingspeak.snapshot(request.args.get('canale'))
+    except KeyError:
+        abort(404)
+    snapshot['punti'] = len(snapshot.pop('df'))
+    return jsonify(snapshot)
+
 app.layout = html.Div(
     [
         dcc.Location(id="url", refresh=False),
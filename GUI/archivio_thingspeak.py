@@ -0,0 +1,369 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import requests
+
+from calibrazioni import funzione_calibrazione, impronta_calibrazioni
+from configurazione import FUSO_ORARIO
+
+# --- Archivio locale dei feed ThingSpeak ---
+#
+# Ogni entry ricevuta dal poller viene salvata in un database SQLite con
+# chiave primaria (canale, istante epoch UTC in secondi, entry_id): la tabella
+# è WITHOUT ROWID, quindi le righe sono memorizzate nell'ordine della chiave e
+# una finestra temporale è una lettura contigua del B-tree. I valori sono
+# salvati grezzi; le calibrazioni vengono applicate in lettura, come per i CSV.
+#
+# Lo storico precedente all'avvio del poller si recupera con un backfill a
+# pagine (dalla più recente alla più vecchia) che salva il punto raggiunto
+# nella stessa transazione di ogni pagina e riprende da lì dopo un errore:
+#   python GUI/archivio_thingspeak.py <canale> [api_key]
+
+# Database dell'archivio: si può spostare su un disco dedicato
+ARCHIVIO_PATH = os.environ.get(
+    'MORE4WATER_ARCHIVIO',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archivio_thingspeak.db'),
+)
+
+# Campi di un canale ThingSpeak
+CAMPI = tuple(f'field{i}' for i in range(1, 9))
+
+# Entry per pagina nel backfill (massimo consentito dall'API dei feed)
+RISULTATI_PER_PAGINA = 8000
+
+# Secondi di attesa tra due pagine del backfill, per non saturare il limite di richieste
+PAUSA_BACKFILL = 1.0
+
+# Prefisso con cui i canali archiviati compaiono tra le sorgenti dei grafici
+PREFISSO_SORGENTE = 'thingspeak:'
+
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS feeds (
+    canale TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL,
+    {', '.join(f'{campo} REAL' for campo in CAMPI)},
+    PRIMARY KEY (canale, ts, entry_id)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS feeds_entry_id ON feeds (canale, entry_id);
+CREATE TABLE IF NOT EXISTS canali (
+    canale TEXT PRIMARY KEY,
+    campi TEXT NOT NULL DEFAULT '',
+    versione INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS backfill (
+    canale TEXT PRIMARY KEY,
+    prossimo_fine INTEGER,
+    limite_entry_id INTEGER NOT NULL DEFAULT 0,
+    completato INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+
+def sorgente_archivio(canale):
+    """Nome con cui un canale archiviato viene passato alle pagine dei grafici."""
+    return f"{PREFISSO_SORGENTE}{canale}"
+
+
+def canale_da_sorgente(sorgente):
+    """Canale di una sorgente 'thingspeak:<canale>', oppure None se la sorgente è un file."""
+    if sorgente.startswith(PREFISSO_SORGENTE):
+        return sorgente[len(PREFISSO_SORGENTE):]
+    return None
+
+
+def stazione_canale(canale):
+    """Nome della stazione di un canale nel registro delle calibrazioni."""
+    return f"thingspeak_{canale}"
+
+
+def secondi_epoch(istanti_utc):
+    """Secondi epoch di una serie di istanti con fuso orario, qualunque sia la risoluzione."""
+    return ((istanti_utc - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)).to_numpy(dtype='int64')
+
+
+def _epoch_utc(istante, ambiguo):
+    """Secondi epoch UTC di un istante naive nel fuso orario locale."""
+    istante = pd.Timestamp(istante)
+    if istante.tzinfo is None:
+        istante = istante.tz_localize(
+            FUSO_ORARIO, ambiguous=ambiguo, nonexistent='shift_forward' if ambiguo else 'shift_backward'
+        )
+    return int(istante.timestamp())
+
+
+class ArchivioThingSpeak:
+    """Archivio SQLite dei feed, scritto dal poller e dal backfill, letto dai grafici."""
+
+    def __init__(self, percorso=ARCHIVIO_PATH):
+        self.percorso = percorso
+        self._schema_pronto = False
+        self._lock = threading.Lock()
+        # Le scritture dei thread del poller si mettono in coda qui invece che
+        # nell'attesa a tentativi di SQLite sul lock del database
+        self._lock_scrittura = threading.Lock()
+
+    def _connetti(self):
+        conn = sqlite3.connect(self.percorso, timeout=30)
+        # In WAL basta sincronizzare ai checkpoint: un crash del processo non perde transazioni
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._schema_pronto:
+            with self._lock:
+                if not self._schema_pronto:
+                    # WAL: le letture dei grafici non bloccano le scritture del poller
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(_SCHEMA)
+                    self._schema_pronto = True
+        return conn
+
+    # --- Scrittura ---
+
+    @staticmethod
+    def _inserisci(conn, canale, ts, entry_id, valori, campi):
+        """Inserisce le righe ignorando le entry già presenti; restituisce quante sono nuove."""
+        campi = list(campi)
+        if any(campo not in CAMPI for campo in campi):
+            raise ValueError(f"Campi non validi: {campi}")
+        valori = np.asarray(valori, dtype='float64')
+        celle = valori.astype(object)
+        celle[np.isnan(valori)] = None
+        righe = [
+            (canale, int(t), int(e), *riga)
+            for t, e, riga in zip(ts, entry_id, celle.tolist())
+        ]
+        prima = conn.total_changes
+        conn.executemany(
+            f"INSERT OR IGNORE INTO feeds (canale, ts, entry_id{''.join(', ' + c for c in campi)}) "
+            f"VALUES (?, ?, ?{', ?' * len(campi)})",
+            righe,
+        )
+        nuove = conn.total_changes - prima
+        riga = conn.execute("SELECT campi FROM canali WHERE canale = ?", (canale,)).fetchone()
+        noti = set(riga[0].split(',')) - {''} if riga else set()
+        tutti = ','.join(sorted(noti | set(campi), key=lambda c: int(c[5:])))
+        conn.execute(
+            "INSERT INTO canali (canale, campi, versione) VALUES (?, ?, ?) "
+            "ON CONFLICT (canale) DO UPDATE SET campi = excluded.campi, versione = versione + ?",
+            (canale, tutti, int(nuove > 0), int(nuove > 0)),
+        )
+        return nuove
+
+    def salva(self, canale, ts, entry_id, valori, campi):
+        """
+        Salva un blocco di entry di un canale in una sola transazione.
+
+        Argomenti:
+            ts: Istanti in secondi epoch UTC.
+            entry_id: entry_id di ThingSpeak.
+            valori: Matrice (righe x campi) dei valori grezzi, NaN se mancanti.
+            campi: Nomi dei campi (fieldN) delle colonne di valori.
+
+        Restituisce:
+            int: Il numero di entry non ancora presenti nell'archivio.
+        """
+        if len(ts) == 0:
+            return 0
+        with self._lock_scrittura, closing(self._connetti()) as conn, conn:
+            return self._inserisci(conn, str(canale), ts, entry_id, valori, campi)
+
+    @staticmethod
+    def _da_feeds(feeds):
+        """Converte una pagina di feed JSON in (ts, entry_id, valori, campi)."""
+        pagina = pd.DataFrame(feeds).drop_duplicates('entry_id', keep='last')
+        campi = [c for c in CAMPI if c in pagina.columns]
+        valori = pagina.reindex(columns=campi).apply(pd.to_numeric, errors='coerce')
+        return (
+            secondi_epoch(pd.to_datetime(pagina['created_at'], utc=True)),
+            pagina['entry_id'].to_numpy(dtype='int64'),
+            valori.to_numpy(dtype='float64'),
+            campi,
+        )
+
+    # --- Backfill dello storico ---
+
+    def _prima_lacuna(self, conn, canale):
+        """
+        Ultimo entry_id prima del primo buco nella sequenza archiviata (0 se
+        l'archivio è vuoto o non parte da 1): il backfill deve arrivare fin lì.
+        """
+        minimo = conn.execute("SELECT MIN(entry_id) FROM feeds WHERE canale = ?", (canale,)).fetchone()[0]
+        if minimo != 1:
+            return 0
+        return conn.execute(
+            "SELECT MIN(f.entry_id) FROM feeds f WHERE f.canale = ? AND NOT EXISTS "
+            "(SELECT 1 FROM feeds g WHERE g.canale = f.canale AND g.entry_id = f.entry_id + 1)",
+            (canale,),
+        ).fetchone()[0]
+
+    def backfill(self, canale, api_key, client, pausa=PAUSA_BACKFILL, max_pagine=None):
+        """
+        Scarica lo storico di un canale a pagine di RISULTATI_PER_PAGINA entry,
+        dalla più recente alla più vecchia.
+
+        Dopo ogni pagina il punto raggiunto viene salvato insieme alle righe:
+        se una richiesta fallisce (o il processo termina) la chiamata successiva
+        riprende da lì. A backfill completato una nuova chiamata recupera solo
+        le entry mancanti, ad esempio quelle perse mentre il poller era fermo.
+
+        Restituisce:
+            dict: 'pagine' scaricate, 'righe_nuove' e 'completato'.
+        """
+        canale = str(canale)
+        report = {'pagine': 0, 'righe_nuove': 0, 'completato': False}
+        with closing(self._connetti()) as conn:
+            stato = conn.execute(
+                "SELECT prossimo_fine, limite_entry_id, completato FROM backfill WHERE canale = ?", (canale,)
+            ).fetchone()
+            if stato is None or stato[2]:
+                fine, limite = None, self._prima_lacuna(conn, canale)
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO backfill (canale, prossimo_fine, limite_entry_id, completato) "
+                        "VALUES (?, NULL, ?, 0)",
+                        (canale, limite),
+                    )
+            else:
+                fine, limite = stato[0], stato[1]
+                print(f"Backfill del canale {canale}: ripresa da {pd.Timestamp(fine, unit='s', tz='UTC')}")
+
+            minimo_precedente = None
+            while max_pagine is None or report['pagine'] < max_pagine:
+                params = {'results': RISULTATI_PER_PAGINA, 'timezone': 'UTC'}
+                if fine is not None:
+                    params['end'] = pd.Timestamp(fine, unit='s').strftime('%Y-%m-%d %H:%M:%S')
+                try:
+                    feeds = client.feeds(canale, api_key, **params).get('feeds', [])
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    print(f"Backfill del canale {canale} interrotto ({type(e).__name__}): verrà ripreso")
+                    return report
+
+                completato = len(feeds) < RISULTATI_PER_PAGINA
+                with conn:
+                    if feeds:
+                        ts, entry_id, valori, campi = self._da_feeds(feeds)
+                        report['righe_nuove'] += self._inserisci(conn, canale, ts, entry_id, valori, campi)
+                        minimo = int(entry_id.min())
+                        completato = completato or minimo <= limite + 1
+                        # L'estremo end è incluso: le entry con lo stesso istante tornano e vengono ignorate.
+                        # Se la pagina non scende (più di una pagina nello stesso secondo) si salta al secondo prima.
+                        fine = int(ts.min()) - (1 if minimo == minimo_precedente else 0)
+                        minimo_precedente = minimo
+                    conn.execute(
+                        "UPDATE backfill SET prossimo_fine = ?, completato = ? WHERE canale = ?",
+                        (fine, int(completato), canale),
+                    )
+                report['pagine'] += 1
+                if completato:
+                    report['completato'] = True
+                    return report
+                time.sleep(pausa)
+        return report
+
+    # --- Lettura ---
+
+    def leggi_intervallo(self, canale, inizio, fine, sensori=None):
+        """
+        Legge le entry di un canale con inizio <= created_at <= fine (istanti
+        naive nel fuso orario locale) con una lettura per intervallo della
+        chiave primaria, applicando le calibrazioni della stazione del canale.
+
+        Restituisce:
+            pandas.DataFrame: created_at, entry_id e i campi richiesti presenti
+            nel canale (tutti se sensori è None), oppure un DataFrame vuoto in
+            caso di errore.
+        """
+        canale = str(canale)
+        try:
+            with closing(self._connetti()) as conn:
+                riga = conn.execute("SELECT campi FROM canali WHERE canale = ?", (canale,)).fetchone()
+                presenti = riga[0].split(',') if riga and riga[0] else []
+                if sensori is not None:
+                    sensori = [sensori] if isinstance(sensori, str) else sensori
+                    presenti = [campo for campo in presenti if campo in sensori]
+                df = pd.read_sql_query(
+                    f"SELECT ts, entry_id{''.join(', ' + c for c in presenti)} FROM feeds "
+                    "WHERE canale = ? AND ts BETWEEN ? AND ? ORDER BY ts, entry_id",
+                    conn,
+                    params=(canale, _epoch_utc(inizio, True), _epoch_utc(fine, False)),
+                )
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Errore nella lettura dell'archivio ThingSpeak: {e}")
+            return pd.DataFrame()
+
+        istanti = pd.to_datetime(df.pop('ts'), unit='s', utc=True).dt.as_unit('ns')
+        df.insert(0, 'created_at', istanti.dt.tz_convert(FUSO_ORARIO).dt.tz_localize(None))
+        stazione = stazione_canale(canale)
+        for campo in presenti:
+            valori = df[campo].to_numpy(dtype='float64')
+            df[campo] = funzione_calibrazione(stazione, campo)(valori)
+        return df
+
+    def versione(self, canale):
+        """
+        Versione dei dati di un canale: cambia a ogni scrittura di entry nuove
+        e a ogni modifica delle calibrazioni. None se il canale non è archiviato.
+        """
+        canale = str(canale)
+        with closing(self._connetti()) as conn:
+            riga = conn.execute("SELECT versione FROM canali WHERE canale = ?", (canale,)).fetchone()
+        if riga is None:
+            return None
+        return (riga[0], impronta_calibrazioni(stazione_canale(canale)))
+
+    def metadati(self, canale):
+        """
+        Metadati di un canale archiviato, con la stessa forma di data_loader.metadati_file.
+
+        Restituisce:
+            dict: Chiavi 'righe', 'inizio', 'fine', 'sensori' e 'null_ratio',
+            oppure None se il canale non ha entry.
+        """
+        canale = str(canale)
+        with closing(self._connetti()) as conn:
+            riga = conn.execute("SELECT campi FROM canali WHERE canale = ?", (canale,)).fetchone()
+            campi = riga[0].split(',') if riga and riga[0] else []
+            conteggi = conn.execute(
+                f"SELECT COUNT(*), MIN(ts), MAX(ts){''.join(f', COUNT({c})' for c in campi)} "
+                "FROM feeds WHERE canale = ?",
+                (canale,),
+            ).fetchone()
+        righe = conteggi[0]
+        if not righe:
+            return None
+
+        def locale(ts):
+            return pd.Timestamp(ts, unit='s', tz='UTC').tz_convert(FUSO_ORARIO).tz_localize(None)
+
+        return {
+            'righe': righe,
+            'inizio': locale(conteggi[1]),
+            'fine': locale(conteggi[2]),
+            'sensori': campi,
+            'null_ratio': {campo: 1 - n / righe for campo, n in zip(campi, conteggi[3:])},
+        }
+
+    def canali(self):
+        """Canali presenti nell'archivio."""
+        with closing(self._connetti()) as conn:
+            return [riga[0] for riga in conn.execute("SELECT canale FROM canali ORDER BY canale")]
+
+
+# Archivio condiviso dal poller e dalle pagine dei grafici
+archivio_thingspeak = ArchivioThingSpeak()
+
+
+if __name__ == '__main__':
+    # Backfill dello storico: python GUI/archivio_thingspeak.py <canale> [api_key]
+    import sys
+    from thingspeak_client import client_thingspeak
+
+    if len(sys.argv) < 2:
+        sys.exit("Uso: python GUI/archivio_thingspeak.py <canale> [api_key]")
+    report = archivio_thingspeak.backfill(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None, client_thingspeak())
+    print(f"Backfill del canale {sys.argv[1]}: {report['pagine']} pagine, "
+          f"{report['righe_nuove']} entry nuove, {'completato' if report['completato'] else 'da riprendere'}")
@@ -0,0 +1,103 @@
+// Grafico in tempo reale della pagina /thingspeak: i punti nuovi arrivano dal
+// server con Server-Sent Events (route /eventi/thingspeak) e vengono accodati
+// con Plotly.extendTraces. Nessuna richiesta parte dal browser finché non
+// arrivano dati; se la connessione cade EventSource si ricollega da solo
+// ripartendo dall'ultima entry ricevuta (header Last-Event-ID). Se il server
+// rifiuta la connessione (503: troppi flussi aperti) o il browser non supporta
+// EventSource, la pagina torna ad aggiornarsi con dcc.Interval e ritenta il
+// flusso a ogni ridisegno del grafico.
+
+(function () {
+    // Valore di thingspeak-sse quando la pagina si aggiorna con l'intervallo
+    var MODALITA_POLLING = 'polling';
+
+    var sorgente = null;
+    var ultimoArrivo = null;
+    var statoServer = {stantio: false, errore: null};
+    var timerStato = null;
+
+    function graficoPlotly() {
+        var contenitore = document.getElementById('thingspeak-live-graph');
+        return contenitore ? contenitore.querySelector('.js-plotly-plot') : null;
+    }
+
+    function chiudi() {
+        if (sorgente !== null) {
+            sorgente.close();
+            sorgente = null;
+        }
+        if (timerStato !== null) {
+            clearInterval(timerStato);
+            timerStato = null;
+        }
+    }
+
+    // Età calcolata nel browser: il testo si aggiorna senza interpellare il server
+    function mostraStato() {
+        var elemento = document.getElementById('thingspeak-stato');
+        if (elemento === null) {
+            chiudi();  // la pagina è stata lasciata
+            return;
+        }
+        if (ultimoArrivo === null) {
+            return;
+        }
+        var testo = 'Last update ' + Math.floor((Date.now() - ultimoArrivo) / 1000) + ' s ago';
+        if (statoServer.stantio && statoServer.errore) {
+            testo += ' (ThingSpeak not reachable: ' + statoServer.errore + ')';
+        }
+        elemento.textContent = testo;
+    }
+
+    function passaAPolling() {
+        chiudi();
+        window.dash_clientside.set_props('thingspeak-sse', {data: MODALITA_POLLING});
+        window.dash_clientside.set_props('interval-component', {disabled: false});
+    }
+
+    function collega(handle) {
+        chiudi();
+        if (!handle) {
+            return null;
+        }
+        if (!window.EventSource) {
+            window.dash_clientside.set_props('interval-component', {disabled: false});
+            return MODALITA_POLLING;
+        }
+        var url = '/eventi/thingspeak?canale=' + encodeURIComponent(handle.canale) +
+            '&sensore=' + encodeURIComponent(handle.sensore) +
+            '&dopo=' + encodeURIComponent(handle.entry_id);
+        var questa = new EventSource(url);
+        sorgente = questa;
+
+        // Con la connessione rifiutata (risposta diversa da 200) il browser non riprova da solo
+        questa.addEventListener('error', function () {
+            if (sorgente === questa && questa.readyState === EventSource.CLOSED) {
+                passaAPolling();
+            }
+        });
+
+        sorgente.addEventListener('punti', function (evento) {
+            var punti = JSON.parse(evento.data);
+            var grafico = graficoPlotly();
+            if (grafico === null || !window.Plotly) {
+                return;
+            }
+            Plotly.extendTraces(grafico, {x: [punti.x], y: [punti.y]}, [0], handle.max_punti);
+            ultimoArrivo = Date.now();
+            mostraStato();
+        });
+
+        sorgente.addEventListener('stato', function (evento) {
+            statoServer = JSON.parse(evento.data);
+            mostraStato();
+        });
+
+        timerStato = setInterval(mostraStato, 1000);
+        return handle.canale;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        thingspeak: {collega: collega}
+    });
+})();
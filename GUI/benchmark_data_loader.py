@@ -0,0 +1,113 @@
+"""
+Benchmark del caricamento dei CSV ThingSpeak.
+
+Genera file sintetici nel formato esportato da ThingSpeak (righe tra virgolette
+con "" come escape) e confronta il vecchio carica_df (readlines + StringIO +
+apply per cella) con il parsing vettoriale attuale e con la lettura a freddo
+dal sidecar Parquet.
+
+Uso:
+    python benchmark_data_loader.py                 # 1e5, 1e6, 1e7 righe
+    python benchmark_data_loader.py 100000 1000000  # dimensioni personalizzate
+"""
+import math
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+
+import pandas as pd
+
+from data_loader import CARTELLA_DATI, _parsa_csv, carica_df
+
+INTESTAZIONE = 'created_at,entry_id,field1,field2,field3,field4,field5,field6,field7,latitude,longitude,elevation,status\n'
+
+
+def genera_csv(percorso, n_righe, racchiuse=True):
+    """
+    Scrive un CSV sintetico di n_righe nel formato ThingSpeak o, con
+    racchiuse=False, come CSV normale con il solo campo status tra virgolette.
+    """
+    inizio = datetime(2025, 1, 1)
+    with open(percorso, 'w', encoding='utf-8', newline='') as outfile:
+        outfile.write(INTESTAZIONE)
+        for i in range(n_righe):
+            istante = inizio + timedelta(seconds=30 * i)
+            if not racchiuse:
+                outfile.write(
+                    f'{istante:%Y-%m-%dT%H:%M:%S}+02:00,{i + 1},{i % 7},{i % 5},{1400 + i % 200},2,0,0,'
+                    f'{20 + (i % 100) / 7},45.613811,11.487136,2,"GPS OK, uSD OK"\n'
+                )
+                continue
+            outfile.write(
+                f'"{istante:%Y-%m-%dT%H:%M:%S}+02:00,{i + 1},{i % 7},{i % 5},{1400 + i % 200},2,0,0,'
+                f'{20 + (i % 100) / 7},45.613811,11.487136,2,""[{istante:%d-%m-%Y %H:%M:%S}] GPS OK, uSD OK, """\n'
+            )
+
+
+def carica_df_originale(percorso_csv):
+    """Implementazione di carica_df precedente alla versione vettoriale (solo per confronto)."""
+    with open(percorso_csv, 'r', encoding='utf-8', newline='') as infile:
+        lines = infile.readlines()
+
+    righe_pulite = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('"') and line.endswith('"'):
+            line = line[1:-1]
+        line = line.replace('""', '"')
+        righe_pulite.append(line)
+
+    df = pd.read_csv(StringIO('\n'.join(righe_pulite)))
+    df.columns = df.columns.str.strip()
+    df['created_at'] = pd.to_datetime(df['created_at'])
+    if df['created_at'].dt.tz is not None:
+        df['created_at'] = df['created_at'].dt.tz_localize(None)
+
+    for col_name in df.columns:
+        if col_name.startswith('field') and col_name[5:].isdigit():
+            df[col_name] = pd.to_numeric(df[col_name], errors='coerce')
+            df[col_name] = df[col_name].apply(lambda x: math.trunc(x * 100) / 100.0 if not pd.isna(x) else None)
+    return df
+
+
+def cronometra(funzione, *args):
+    inizio = time.perf_counter()
+    risultato = funzione(*args)
+    return risultato, time.perf_counter() - inizio
+
+
+def main(dimensioni):
+    # I sidecar si scrivono solo dentro la cartella dei dati (cartella nascosta: trova_stazioni la ignora)
+    with tempfile.TemporaryDirectory(prefix='.benchmark_', dir=CARTELLA_DATI) as cartella:
+        for n_righe in dimensioni:
+            percorso = os.path.join(cartella, f'feeds_{n_righe}.csv')
+            genera_csv(percorso, n_righe)
+
+            df_originale, t_originale = cronometra(carica_df_originale, percorso)
+            df_nuovo, t_nuovo = cronometra(_parsa_csv, percorso)
+            pd.testing.assert_frame_equal(df_originale, df_nuovo, check_column_type=False)
+
+            # Un CSV normale con campi tra virgolette deve restare intatto
+            percorso_normale = os.path.join(cartella, f'normale_{n_righe}.csv')
+            genera_csv(percorso_normale, min(n_righe, 100_000), racchiuse=False)
+            pd.testing.assert_frame_equal(
+                carica_df_originale(percorso_normale), _parsa_csv(percorso_normale), check_column_type=False
+            )
+            os.remove(percorso_normale)
+
+            # Il primo carica_df scrive il sidecar, il secondo lo legge
+            carica_df(percorso)
+            df_sidecar, t_sidecar = cronometra(carica_df, percorso)
+            pd.testing.assert_frame_equal(df_nuovo, df_sidecar)
+
+            print(f"{n_righe:>10} righe | originale {t_originale:8.2f} s | vettoriale {t_nuovo:8.2f} s "
+                  f"| speedup x{t_originale / t_nuovo:.1f} | sidecar {t_sidecar * 1000:8.1f} ms")
+            os.remove(percorso)
+            os.remove(percorso + '.parquet')
+
+
+if __name__ == '__main__':
+    main([int(float(a)) for a in sys.argv[1:]] or [100_000, 1_000_000, 10_000_000])
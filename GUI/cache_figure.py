@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from calibrazioni import impronta_calibrazioni
+
+# --- Cache delle figure già costruite (payload serializzati) ---
+
+# Numero massimo di figure conservate
+CACHE_FIGURE_MAX_VOCI = 128
+
+# Durata massima (secondi) di una figura in cache
+CACHE_FIGURE_TTL = 600
+
+
+def versione_file(percorso_csv):
+    """
+    Versione di un file dati: mtime, dimensione e impronta delle calibrazioni
+    della stazione. Restituisce None se il file non esiste.
+    """
+    try:
+        stat = os.stat(percorso_csv)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, impronta_calibrazioni(os.path.basename(percorso_csv)))
+
+
+class CacheFigure:
+    """
+    Cache LRU con scadenza dei risultati già pronti per il browser.
+
+    Ogni voce è indicizzata dalla query normalizzata e validata con la
+    versione del file da cui è stata costruita: se il CSV cambia la voce
+    viene scartata alla prima richiesta. I payload sono strutture JSON
+    (dict e liste) e vanno trattati come sola lettura.
+    """
+
+    def __init__(self, max_voci=CACHE_FIGURE_MAX_VOCI, ttl=CACHE_FIGURE_TTL):
+        self.max_voci = max_voci
+        self.ttl = ttl
+        self._voci = OrderedDict()  # chiave -> (versione, scadenza, payload)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.scartate = 0
+
+    def get(self, chiave, versione):
+        """Restituisce il payload in cache per chiave, se ancora valido per versione."""
+        adesso = time.monotonic()
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None and voce[0] == versione and voce[1] > adesso:
+                self._voci.move_to_end(chiave)
+                self.hits += 1
+                return voce[2]
+            if voce is not None:
+                del self._voci[chiave]  # scaduta o costruita da una versione precedente del file
+                self.scartate += 1
+            self.misses += 1
+            return None
+
+    def put(self, chiave, versione, payload):
+        """Inserisce un payload, eliminando le voci usate meno di recente oltre max_voci."""
+        if versione is None:
+            return
+        with self._lock:
+            self._voci.pop(chiave, None)
+            self._voci[chiave] = (versione, time.monotonic() + self.ttl, payload)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+                self.evictions += 1
+
+    def invalida(self):
+        """Svuota la cache."""
+        with self._lock:
+            self._voci.clear()
+
+    def statistiche(self):
+        """Restituisce contatori e occupazione corrente della cache."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'scartate': self.scartate,
+                'voci': len(self._voci),
+                'max_voci': self.max_voci,
+                'ttl': self.ttl,
+            }
@@ -0,0 +1,103 @@
+import hashlib
+import json
+from functools import lru_cache
+
+import numpy as np
+
+# --- Registro delle calibrazioni per stazione e sensore ---
+#
+# Ogni stazione è identificata dal nome del suo file CSV. Per ogni campo fieldN
+# si indica il tipo di trasformazione e i suoi parametri; i campi non elencati
+# vengono troncati a due decimali (tipo 'troncamento').
+#
+# Tipi disponibili:
+#   'troncamento'     -> decimali
+#   'lineare'         -> guadagno, offset             (y = guadagno * x + offset)
+#   'corrente_4_20mA' -> delta, resistenza, i_min, i_max, h_min, h_max
+#                        (lettura ADC -> corrente in mA -> livello)
+#   'polinomio'       -> coefficienti                 (dal grado più alto, come np.polyval)
+
+CALIBRAZIONE_PREDEFINITA = {'tipo': 'troncamento', 'decimali': 2}
+
+CALIBRAZIONI = {
+    'm4w_Villaverla.csv': {
+        'field3': {
+            'tipo': 'corrente_4_20mA',
+            'delta': 2.048 / (2**12),
+            'resistenza': 102,
+            'i_min': 4,
+            'i_max': 20,
+            'h_min': 0,
+            'h_max': 20,
+        },
+    },
+}
+
+
+def _troncamento(decimali):
+    scala = 10 ** decimali
+    return lambda valori: np.trunc(valori * scala) / float(scala)
+
+
+def _lineare(guadagno, offset=0.0):
+    return lambda valori: valori * guadagno + offset
+
+
+def _corrente_4_20mA(delta, resistenza, i_min=4, i_max=20, h_min=0, h_max=20):
+    def converti(valori):
+        i = valori * delta / resistenza * 1000
+        return ((i - i_min) / (i_max - i_min)) * (h_max - h_min) + h_min
+    return converti
+
+
+def _polinomio(coefficienti):
+    coefficienti = np.asarray(coefficienti, dtype='float64')
+    return lambda valori: np.polyval(coefficienti, valori)
+
+
+_COSTRUTTORI = {
+    'troncamento': _troncamento,
+    'lineare': _lineare,
+    'corrente_4_20mA': _corrente_4_20mA,
+    'polinomio': _polinomio,
+}
+
+
+def compila_calibrazione(configurazione):
+    """
+    Trasforma la configurazione di una calibrazione in una funzione vettoriale
+    che riceve e restituisce array NumPy float64.
+    """
+    parametri = dict(configurazione)
+    tipo = parametri.pop('tipo')
+    if tipo not in _COSTRUTTORI:
+        raise ValueError(f"Tipo di calibrazione sconosciuto: {tipo}")
+    return _COSTRUTTORI[tipo](**parametri)
+
+
+@lru_cache(maxsize=None)
+def funzione_calibrazione(stazione, campo):
+    """Restituisce (compilandola una sola volta) la calibrazione di un campo di una stazione."""
+    configurazione = CALIBRAZIONI.get(stazione, {}).get(campo, CALIBRAZIONE_PREDEFINITA)
+    return compila_calibrazione(configurazione)
+
+
+def registra_calibrazione(stazione, campo, tipo, **parametri):
+    """
+    Aggiunge o sostituisce la calibrazione di un campo (es. per una nuova stazione).
+    I sidecar vengono ricostruiti automaticamente; i DataFrame già in memoria
+    vanno invalidati con data_loader.invalida_cache.
+    """
+    configurazione = {'tipo': tipo, **parametri}
+    compila_calibrazione(configurazione)  # valida i parametri prima di registrarli
+    CALIBRAZIONI.setdefault(stazione, {})[campo] = configurazione
+    funzione_calibrazione.cache_clear()
+
+
+def impronta_calibrazioni(stazione):
+    """Hash della configurazione di una stazione: cambia se cambiano le sue calibrazioni."""
+    configurazione = {
+        'predefinita': CALIBRAZIONE_PREDEFINITA,
+        'campi': CALIBRAZIONI.get(stazione, {}),
+    }
+    return hashlib.sha1(json.dumps(configurazione, sort_keys=True).encode('utf-8')).hexdigest()
@@ -0,0 +1,8 @@
+# --- Impostazioni condivise dall'app ---
+#
+# Solo costanti, senza import: i moduli che le usano (archivio ThingSpeak,
+# database delle segnalazioni, export) possono importarle senza tirarsi dietro
+# le dipendenze gli uni degli altri.
+
+# Fuso orario in cui vengono mostrati i dati e in cui sono scritti i vecchi timestamp senza fuso
+FUSO_ORARIO = 'Europe/Rome'
@@ -1,10 +1,35 @@
 import pandas as pd
+import numpy as np
 import requests
 import os
-from io import StringIO
-import math
+import re
+import json
+import hashlib
+import multiprocessing
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
 from datetime import datetime
 import csv
+from io import StringIO
+
+from calibrazioni import funzione_calibrazione, impronta_calibrazioni
+from rollup import aggiorna_piramidi
+from thingspeak_client import client_thingspeak
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi, ogni processo precarica da sé
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # i sidecar Parquet sono opzionali
+    pa = None
+    pq = None
 
 # --- ID del canale ThingSpeak da utilizzare per i dati in tempo reale ---
 
@@ -16,14 +41,16 @@ def carica_df_thingspeak():
     """
     Carica gli ultimi 100 dati in tempo reale dal canale ThingSpeak.
 
+    La richiesta passa dal client condiviso (vedi thingspeak_client): se
+    ThingSpeak non risponde vengono restituiti gli ultimi dati validi.
+
     Restituisce:
         pandas.DataFrame: Un DataFrame con i dati, o un DataFrame vuoto in caso di errore.
     """
     try:
-        url = f"https://api.thingspeak.com/channels/{THINGSPEAK_CHANNEL_ID}/feeds.json?results=100&api_key={THINGSPEAK_API_KEY}"
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = client_thingspeak().feeds(
+            THINGSPEAK_CHANNEL_ID, THINGSPEAK_API_KEY, usa_ultima_buona=True, results=100
+        )
         
         feeds = data.get('feeds', [])
         if not feeds:
@@ -52,57 +79,1126 @@ def carica_df_thingspeak():
         return pd.DataFrame()
 
 
-def carica_df(percorso_csv):
+# --- Parsing in streaming dei CSV esportati da ThingSpeak ---
+
+# Dimensione (in caratteri) dei blocchi letti dal disco durante il parsing
+DIMENSIONE_BLOCCO = 1 << 20
+
+# Offset del fuso orario accettati in coda ai timestamp ISO di ThingSpeak
+_OFFSET_ISO = re.compile(r'^(Z|[+-]\d{2}:\d{2})?$')
+
+# Riga racchiusa tra virgolette (il blocco è sempre diviso su un a capo)
+_RIGA_RACCHIUSA = re.compile(r'(?m)^"(.*)"$')
+
+
+class _FlussoThingSpeak:
+    """
+    Sorgente file-like per pd.read_csv che pulisce il CSV di ThingSpeak al volo.
+
+    Il file (aperto con gli a capo universali) viene letto a blocchi terminati
+    da un a capo: su ciascun blocco vengono rimosse le virgolette esterne
+    delle righe racchiuse tra virgolette e le doppie virgolette ("") vengono
+    sostituite con una singola, senza mai tenere in memoria una copia
+    completa del file.
+    """
+
+    def __init__(self, infile, dimensione_blocco=DIMENSIONE_BLOCCO):
+        self._infile = infile
+        self._dimensione_blocco = dimensione_blocco
+        self._blocchi_puliti = self._blocchi()
+        self._buffer = ''
+
+    @staticmethod
+    def _pulisci(testo):
+        # Le righe di dati di ThingSpeak sono racchiuse tra virgolette, con quelle
+        # interne raddoppiate: si tolgono solo le virgolette delle righe che
+        # iniziano e finiscono con '"' (un CSV normale con campi tra virgolette
+        # resta intatto), con una sola sostituzione in C per blocco.
+        return _RIGA_RACCHIUSA.sub(r'\1', testo).replace('""', '"')
+
+    def _blocchi(self):
+        resto = ''
+        while True:
+            blocco = self._infile.read(self._dimensione_blocco)
+            if not blocco:
+                break
+            testo = resto + blocco
+            taglio = testo.rfind('\n') + 1
+            resto = testo[taglio:]
+            if taglio:
+                yield self._pulisci(testo[:taglio])
+        if resto:
+            yield self._pulisci(resto + '\n')
+
+    def read(self, size=-1):
+        parti = [self._buffer]
+        letti = len(self._buffer)
+        while size < 0 or letti < size:
+            blocco = next(self._blocchi_puliti, None)
+            if blocco is None:
+                break
+            parti.append(blocco)
+            letti += len(blocco)
+        testo = ''.join(parti)
+        if size < 0:
+            self._buffer = ''
+            return testo
+        self._buffer = testo[size:]
+        return testo[:size]
+
+    def __iter__(self):
+        if self._buffer:
+            yield from self.read().splitlines(keepends=True)
+        for blocco in self._blocchi_puliti:
+            yield from blocco.splitlines(keepends=True)
+
+
+def _converti_created_at(serie):
+    """
+    Converte la colonna created_at in datetime senza fuso orario.
+
+    Se tutte le righe hanno lo stesso offset (es. "+02:00"), rimuoverlo equivale
+    a tenere l'ora locale scritta nel file: in quel caso basta parsare i primi
+    19 caratteri con un formato fisso, molto più veloce dell'inferenza per riga.
+    Negli altri casi si usa il parsing generico di pandas.
+    """
+    if pd.api.types.is_string_dtype(serie) and len(serie) > 0:
+        offset = serie.str.slice(19)
+        primo = offset.iloc[0]
+        if isinstance(primo, str) and _OFFSET_ISO.match(primo) and (offset == primo).all():
+            try:
+                return pd.to_datetime(serie.str.slice(0, 19), format='%Y-%m-%dT%H:%M:%S')
+            except (ValueError, TypeError):
+                pass
+    serie = pd.to_datetime(serie)
+
+    # Rimuovi le informazioni sul fuso orario per compatibilità
+    if serie.dt.tz is not None:
+        serie = serie.dt.tz_localize(None)
+    return serie
+
+
+def _parsa_csv(percorso_csv):
+    """
+    Parsa il CSV in streaming (vedi _FlussoThingSpeak) e applica le conversioni
+    vettoriali NumPy alle colonne fieldN.
+    """
+    with open(percorso_csv, 'r', encoding='utf-8') as infile:
+        df = pd.read_csv(_FlussoThingSpeak(infile))
+    
+    df.columns = df.columns.str.strip()
+    return _ordina_per_tempo(_pulisci_df(df, percorso_csv))
+
+
+def _pulisci_df(df, percorso_csv):
+    """
+    Converte created_at e applica alle colonne fieldN la calibrazione registrata
+    per la stazione (vedi calibrazioni.py), come operazione vettoriale NumPy.
+    """
+    df['created_at'] = _converti_created_at(df['created_at'])
+    
+    stazione = os.path.basename(percorso_csv)
+
+    for col_name in df.columns:
+        if col_name.startswith('field') and col_name[5:].isdigit():
+            valori = pd.to_numeric(df[col_name], errors='coerce').to_numpy(dtype='float64')
+            df[col_name] = funzione_calibrazione(stazione, col_name)(valori)
+    
+    return df
+
+
+def _ordina_per_tempo(df):
+    """
+    Garantisce che il DataFrame sia ordinato per created_at e senza entry_id
+    duplicati (a parità di entry_id vince l'ultima riga letta).
+    Se il file è già ordinato, come accade per gli export ThingSpeak, il costo
+    è solo quello dei due controlli.
+    """
+    modificato = False
+    if 'entry_id' in df.columns and not df['entry_id'].is_unique:
+        df = df.drop_duplicates(subset='entry_id', keep='last')
+        modificato = True
+    if not df['created_at'].is_monotonic_increasing:
+        df = df.sort_values('created_at', kind='stable')
+        modificato = True
+    return df.reset_index(drop=True) if modificato else df
+
+
+def intervallo_df(df, inizio, fine):
+    """
+    Restituisce le righe con inizio <= created_at <= fine.
+
+    Sfrutta l'ordinamento garantito dal loader: i due estremi vengono trovati
+    con una ricerca binaria (O(log n)) e il risultato è una slice posizionale
+    del DataFrame, senza maschere booleane né copie dei dati.
+    """
+    istanti = df['created_at']
+    a = istanti.searchsorted(pd.Timestamp(inizio), side='left')
+    b = istanti.searchsorted(pd.Timestamp(fine), side='right')
+    return df.iloc[a:b]
+
+
+def _passo_mediano(istanti):
+    passi = np.diff(np.asarray(istanti, dtype='datetime64[ns]').astype('int64'))
+    return pd.Timedelta(int(np.median(passi))) if len(passi) else pd.Timedelta(0)
+
+
+def allinea_serie(istanti, serie):
+    """
+    Allinea più serie temporali su un asse dei tempi comune con un join as-of
+    vettoriale (merge_asof): a ogni istante viene associato il campione più
+    vicino di ciascuna serie, se dista al massimo il passo di campionamento più
+    largo tra l'asse e la serie; altrimenti il valore è NaN.
+
+    Argomenti:
+        istanti: asse dei tempi comune, ordinato; se None è l'unione ordinata
+            degli istanti di tutte le serie, così nessun campione va perso
+            anche se le serie coprono periodi diversi.
+        serie (dict): nome -> pandas.Series di valori con indice temporale ordinato.
+
+    Restituisce:
+        pandas.DataFrame: Colonna 'created_at' con gli istanti e una colonna per serie.
+    """
+    if istanti is None:
+        indici = [pd.DatetimeIndex(valori.index).astype('datetime64[ns]') for valori in serie.values()]
+        istanti = np.unique(np.concatenate([indice.to_numpy() for indice in indici]))
+    asse = pd.DataFrame({'created_at': pd.DatetimeIndex(istanti).astype('datetime64[ns]')})
+    passo_asse = _passo_mediano(asse['created_at'])
+    for nome, valori in serie.items():
+        destra = pd.DataFrame({
+            'created_at': pd.DatetimeIndex(valori.index).astype('datetime64[ns]'),
+            nome: valori.to_numpy(dtype='float64'),
+        })
+        tolleranza = max(passo_asse, _passo_mediano(destra['created_at']))
+        asse = pd.merge_asof(
+            asse, destra, on='created_at', direction='nearest',
+            tolerance=tolleranza if tolleranza > pd.Timedelta(0) else None,
+        )
+    return asse
+
+
+# --- Rappresentazione compatta dei DataFrame dei sensori ---
+
+# Errore assoluto massimo ammesso convertendo un campo fieldN da float64 a float32
+TOLLERANZA_FLOAT32 = 1e-4
+
+# Colonne GPS ed errore massimo ammesso in float32 (1e-5 gradi, circa un metro)
+COLONNE_GPS = ('latitude', 'longitude', 'elevation')
+TOLLERANZA_FLOAT32_GPS = 1e-5
+
+# Le colonne con meno valori distinti di questa frazione delle righe diventano categoriche
+FRAZIONE_MAX_DISTINTI = 0.5
+
+
+def _errore_float32(serie):
+    """Errore assoluto massimo della conversione della serie da float64 a float32."""
+    valori = serie.to_numpy(dtype='float64')
+    return np.nanmax(np.abs(valori.astype('float32').astype('float64') - valori))
+
+
+def _pochi_distinti(serie):
+    return serie.nunique() <= FRAZIONE_MAX_DISTINTI * len(serie)
+
+
+def _tipo_compatto(col, serie):
+    """
+    Tipo scelto da compatta_df per una colonna: 'float32', 'float64',
+    'category', None se la colonna va eliminata, 'invariato' se resta com'è.
+    """
+    if col.startswith('field') and col[5:].isdigit():
+        if serie.isna().all():
+            return None
+        return 'float32' if _errore_float32(serie) <= TOLLERANZA_FLOAT32 else 'float64'
+    if col == 'status':
+        return 'category' if _pochi_distinti(serie) else 'invariato'
+    if col in COLONNE_GPS and not serie.isna().all():
+        if _pochi_distinti(serie):
+            return 'category'
+        return 'float32' if _errore_float32(serie) <= TOLLERANZA_FLOAT32_GPS else 'float64'
+    return 'invariato'
+
+
+def compatta_df(df):
+    """
+    Restituisce una versione del DataFrame che occupa meno memoria.
+
+    - i campi fieldN passano a float32 se l'errore di conversione resta entro
+      TOLLERANZA_FLOAT32, e vengono eliminati se sono sempre vuoti;
+    - status viene codificato come categoria (dizionario di stringhe) quando
+      i messaggi si ripetono: se ogni riga ha un testo diverso resta com'è;
+    - latitudine, longitudine ed elevazione diventano categorie se quasi
+      costanti, altrimenti float32 se la precisione lo consente.
+    """
+    colonne = {}
+    for col in df.columns:
+        serie = df[col]
+        tipo = _tipo_compatto(col, serie)
+        if tipo is None:
+            continue
+        colonne[col] = serie if tipo == 'invariato' else serie.astype(tipo)
+    return pd.DataFrame(colonne, index=df.index)
+
+
+def _colonne_da_ricompattare(df, nuove, aggiunte):
+    """
+    Colonne di df (già compatto e concatenato con le righe nuove; nuove è in
+    precisione piena, prima di _allinea_tipi) per cui compatta_df sul file
+    intero sceglierebbe ora un tipo diverso: es. la longitudine smette di
+    essere quasi costante, oppure un campo vuoto riceve valori (le colonne
+    aggiunte, da ricompattare sempre).
+    """
+    colonne = list(aggiunte)
+    for col in df.columns:
+        if col in aggiunte:
+            continue
+        tipo = df[col].dtype
+        campo = col.startswith('field') and col[5:].isdigit()
+        if tipo == 'float32':
+            # Le righe già presenti rispettavano la tolleranza: basta controllare le nuove
+            tolleranza = TOLLERANZA_FLOAT32 if campo else TOLLERANZA_FLOAT32_GPS
+            if nuove[col].notna().any() and _errore_float32(nuove[col]) > tolleranza:
+                colonne.append(col)
+            elif col in COLONNE_GPS and _pochi_distinti(df[col]):
+                colonne.append(col)
+        elif campo:
+            # float64: le righe già presenti superano comunque la tolleranza
+            continue
+        elif isinstance(tipo, pd.CategoricalDtype):
+            # Le categorie conservano i valori originali: si decide sulla colonna intera
+            if _tipo_compatto(col, df[col].astype(tipo.categories.dtype)) != 'category':
+                colonne.append(col)
+        elif _tipo_compatto(col, df[col]) not in ('invariato', tipo):
+            colonne.append(col)
+    return colonne
+
+
+def _ricompatta(df, colonne):
+    """
+    Applica a queste colonne di df il tipo che sceglierebbe compatta_df,
+    ripartendo dai valori originali (le categorie li conservano, le colonne
+    float64 e di testo sono già in precisione piena). Restituisce None se una
+    colonna è in float32: la precisione persa serve un caricamento completo.
+    """
+    risultato = {}
+    for col in df.columns:
+        serie = df[col]
+        if col not in colonne:
+            risultato[col] = serie
+            continue
+        if serie.dtype == 'float32':
+            return None
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.astype(serie.dtype.categories.dtype)
+        tipo = _tipo_compatto(col, serie)
+        if tipo is not None:
+            risultato[col] = serie if tipo == 'invariato' else serie.astype(tipo)
+    return pd.DataFrame(risultato, index=df.index)
+
+
+def memoria_df(df):
+    """Memoria occupata dal DataFrame, in byte (stringhe comprese)."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+# --- Ingestione incrementale delle righe aggiunte in coda ai CSV ---
+
+# Numero di byte prima dell'offset usati per riconoscere un file riscritto
+_BYTE_IMPRONTA = 4096
+
+
+def _impronta(percorso, offset):
+    """Hash degli ultimi byte già consumati: se cambia, il file è stato riscritto."""
+    with open(percorso, 'rb') as infile:
+        inizio = max(0, offset - _BYTE_IMPRONTA)
+        infile.seek(inizio)
+        return hashlib.sha1(infile.read(offset - inizio)).hexdigest()
+
+
+def _riassunto_df(df):
+    """Conteggi che alimentano l'indice dei metadati (vedi metadati_file)."""
+    istanti = df['created_at']
+    return {
+        'righe': len(df),
+        'inizio': istanti.min().isoformat() if not df.empty else None,
+        'fine': istanti.max().isoformat() if not df.empty else None,
+        'nulli': {col: int(n) for col, n in df.isna().sum().items()},
+    }
+
+
+def _unisci_riassunti(riassunto, riassunto_coda):
+    """Aggiorna i conteggi di un file con quelli delle righe aggiunte in coda."""
+    if riassunto_coda['righe'] == 0:
+        return riassunto
+    estremi = [pd.Timestamp(t) for t in (riassunto['inizio'], riassunto['fine']) if t]
+    estremi += [pd.Timestamp(riassunto_coda['inizio']), pd.Timestamp(riassunto_coda['fine'])]
+    return {
+        'righe': riassunto['righe'] + riassunto_coda['righe'],
+        'inizio': min(estremi).isoformat(),
+        'fine': max(estremi).isoformat(),
+        'nulli': {col: riassunto['nulli'].get(col, 0) + n for col, n in riassunto_coda['nulli'].items()},
+    }
+
+
+def _stato_ingestione(percorso_csv, df, size):
+    """
+    Descrive fin dove il file è stato consumato: offset in byte (sempre a fine
+    riga), ultimo entry_id letto e impronta dei byte che precedono l'offset,
+    più il riassunto usato dall'indice dei metadati. Senza entry_id il file non
+    può crescere in coda e lo stato contiene solo il riassunto.
+    """
+    if 'entry_id' not in df.columns:
+        return {'riassunto': _riassunto_df(df)}
+    with open(percorso_csv, 'rb') as infile:
+        inizio = max(0, size - DIMENSIONE_BLOCCO)
+        infile.seek(inizio)
+        finale = infile.read(size - inizio)
+    offset = inizio + finale.rfind(b'\n') + 1
+    colonne = _intestazione(percorso_csv)
+    entry_id = df['entry_id']
+    if offset < size:
+        # L'ultima riga non ha l'a capo: può essere una riga a metà scrittura,
+        # già nel DataFrame ma non consumata. Il suo entry_id resta fuori da
+        # ultimo_entry_id, così quando la riga viene completata la rilettura
+        # della coda la sostituisce (vedi _leggi_coda).
+        parziale = _entry_id_riga(finale[offset - inizio:], colonne)
+        if parziale is not None:
+            entry_id = entry_id[entry_id != parziale]
+    ultimo_entry_id = int(entry_id.max()) if not entry_id.empty else 0
+    return {
+        'offset': offset,
+        'colonne': colonne,
+        'ultimo_entry_id': ultimo_entry_id,
+        'impronta': _impronta(percorso_csv, offset),
+        'riassunto': _riassunto_df(df),
+    }
+
+
+def _entry_id_riga(riga, colonne):
+    """entry_id di una riga grezza del CSV, oppure None se non è leggibile."""
+    try:
+        testo = _FlussoThingSpeak._pulisci(riga.decode('utf-8').strip() + '\n')
+        valore = pd.read_csv(StringIO(testo), header=None, names=colonne)['entry_id'].iat[0]
+        return int(valore)
+    except (ValueError, TypeError, KeyError, IndexError, pd.errors.ParserError):
+        return None
+
+
+def _intestazione(percorso_csv):
+    """Nomi delle colonne così come compaiono nella prima riga del CSV."""
+    with open(percorso_csv, 'r', encoding='utf-8') as infile:
+        return [col.strip() for col in infile.readline().strip().split(',')]
+
+
+def _tipo_comune(tipo, tipo_nuove):
+    """
+    Tipo numerico che read_csv darebbe alla colonna intera: es. int64 diventa
+    float64 se le righe nuove hanno valori mancanti o decimali. Per gli altri
+    tipi resta quello di df.
+    """
+    numerici = all(
+        pd.api.types.is_numeric_dtype(t) and not pd.api.types.is_bool_dtype(t) for t in (tipo, tipo_nuove)
+    )
+    return np.result_type(tipo, tipo_nuove) if numerici else tipo
+
+
+def _allinea_tipi(df, nuove):
+    """
+    Porta le righe nuove ai tipi di df prima della concatenazione, allargando
+    le colonne di df quando serve (es. un intero che riceve un valore
+    mancante passa a float64, come in un parsing completo). Le colonne
+    categoriche (vedi compatta_df) vengono estese con le eventuali nuove
+    categorie, tenute in ordine come farebbe una nuova compattazione. Il
+    DataFrame originale, condiviso dalla cache, non viene modificato.
+    """
+    tipi = {}
+    for col, tipo in df.dtypes.items():
+        if isinstance(tipo, pd.CategoricalDtype):
+            categorie = tipo.categories
+            tipo_valori = _tipo_comune(categorie.dtype, nuove[col].dtype)
+            if tipo_valori != categorie.dtype:
+                categorie = categorie.astype(tipo_valori)
+            nuove_categorie = pd.Index(nuove[col].dropna().unique()).difference(categorie)
+            if len(nuove_categorie):
+                categorie = categorie.append(nuove_categorie).sort_values()
+            if categorie is not tipo.categories:
+                tipo = pd.CategoricalDtype(categorie)
+                df = df.astype({col: tipo})
+        elif tipo != 'float32':
+            comune = _tipo_comune(tipo, nuove[col].dtype)
+            if comune != tipo:
+                tipo = comune
+                df = df.astype({col: tipo})
+        tipi[col] = tipo
+    return df, nuove.astype(tipi)
+
+
+def _leggi_coda(percorso_csv, df, stato, compatto=False):
+    """
+    Aggiunge a df solo le righe scritte nel CSV dopo stato['offset'].
+
+    Il parsing riguarda soltanto la coda del file, quindi il costo dipende dal
+    numero di righe nuove e non dalla lunghezza dello storico. Con
+    compatto=True df è nella forma di compatta_df e resta identico a una
+    nuova compattazione del file intero: le colonne per cui le righe nuove
+    cambiano la scelta dei tipi vengono ricompattate sul posto, e serve un
+    caricamento completo solo se una di queste era in float32.
+
+    Restituisce:
+        tuple: (DataFrame aggiornato, nuovo stato), oppure None se il file è
+        stato troncato o riscritto e serve un caricamento completo.
+    """
+    if not stato or 'offset' not in stato:
+        return None
+    offset = stato['offset']
+    size = os.path.getsize(percorso_csv)
+    if size < offset or _impronta(percorso_csv, offset) != stato['impronta']:
+        return None
+
+    with open(percorso_csv, 'rb') as infile:
+        infile.seek(offset)
+        coda = infile.read(size - offset)
+    fine = coda.rfind(b'\n') + 1
+    if fine == 0:
+        return df, stato
+
+    try:
+        testo = coda[:fine].decode('utf-8').replace('\r\n', '\n')
+        nuove = pd.read_csv(StringIO(_FlussoThingSpeak._pulisci(testo)), header=None, names=stato['colonne'])
+        nuove = _pulisci_df(nuove, percorso_csv)
+        complete = nuove.loc[nuove['entry_id'] > stato['ultimo_entry_id']]
+        aggiunte = []
+        if compatto:
+            # Campi eliminati perché sempre vuoti che ora ricevono valori
+            aggiunte = [col for col in complete.columns if col not in df.columns and complete[col].notna().any()]
+            if aggiunte:
+                df = df.assign(**{col: np.nan for col in aggiunte})
+                df = df[[col for col in complete.columns if col in df.columns]]
+        df, nuove = _allinea_tipi(df, complete[list(df.columns)])
+    except (ValueError, TypeError, pd.errors.ParserError):
+        return None
+
+    nuovo_stato = {
+        'offset': offset + fine,
+        'colonne': stato['colonne'],
+        'ultimo_entry_id': int(nuove['entry_id'].max()) if not nuove.empty else stato['ultimo_entry_id'],
+        'impronta': _impronta(percorso_csv, offset + fine),
+        'riassunto': _unisci_riassunti(stato['riassunto'], _riassunto_df(nuove)),
+    }
+    if nuove.empty:
+        return df, nuovo_stato
+    df = _ordina_per_tempo(pd.concat([df, nuove], ignore_index=True))
+    if compatto:
+        colonne = _colonne_da_ricompattare(df, complete, aggiunte)
+        if colonne:
+            df = _ricompatta(df, colonne)
+            if df is None:
+                return None
+    if len(df) != nuovo_stato['riassunto']['righe']:
+        # Sono stati scartati duplicati: i conteggi vanno ricalcolati
+        nuovo_stato['riassunto'] = _riassunto_df(df)
+    return df, nuovo_stato
+
+
+# --- Sidecar colonnare (Parquet) accanto ai CSV ---
+
+# Versione del contenuto dei sidecar: va incrementata quando cambia la pulizia dei dati.
+# Le modifiche alle calibrazioni sono rilevate dall'impronta salvata nei metadati.
+VERSIONE_SIDECAR = 4
+_CHIAVE_METADATI_SIDECAR = b'more4water'
+
+
+def _percorso_sidecar(percorso_csv):
+    return percorso_csv + '.parquet'
+
+
+def _hash_file(percorso):
+    h = hashlib.sha1()
+    with open(percorso, 'rb') as infile:
+        for blocco in iter(lambda: infile.read(DIMENSIONE_BLOCCO), b''):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+def _metadati_sidecar(percorso_csv):
+    """
+    Legge solo i metadati del sidecar (senza caricare i dati), oppure None se
+    il sidecar manca, è illeggibile, è di una versione precedente o è stato
+    scritto con calibrazioni diverse da quelle attuali.
+    """
+    percorso_sidecar = _percorso_sidecar(percorso_csv)
+    if pq is None or not os.path.exists(percorso_sidecar):
+        return None
+    try:
+        metadati_schema = pq.read_schema(percorso_sidecar).metadata or {}
+        metadati = json.loads(metadati_schema[_CHIAVE_METADATI_SIDECAR])
+    except Exception:
+        return None
+    if metadati.get('versione') != VERSIONE_SIDECAR:
+        return None
+    if metadati.get('calibrazioni') != impronta_calibrazioni(os.path.basename(percorso_csv)):
+        return None
+    return metadati
+
+
+def _leggi_sidecar(percorso_csv):
+    """
+    Restituisce il DataFrame salvato nel sidecar se è ancora allineato al CSV,
+    altrimenti None. Il CSV è considerato invariato se dimensione e mtime
+    coincidono, oppure (mtime diverso) se coincide l'hash del contenuto.
+    Se al CSV sono state solo aggiunte righe, il sidecar viene completato
+    leggendo la coda del file e poi riscritto.
+    """
+    metadati = _metadati_sidecar(percorso_csv)
+    if metadati is None:
+        return None
+    percorso_sidecar = _percorso_sidecar(percorso_csv)
+
+    stat = os.stat(percorso_csv)
+    if metadati.get('size') != stat.st_size:
+        risultato = _leggi_coda(percorso_csv, pd.read_parquet(percorso_sidecar), metadati.get('stato'))
+        if risultato is None:
+            return None
+        df = risultato[0]
+        _scrivi_sidecar(percorso_csv, df, stat)
+        return df
+
+    mtime_cambiato = metadati.get('mtime_ns') != stat.st_mtime_ns
+    if mtime_cambiato and metadati.get('sha1') != _hash_file(percorso_csv):
+        return None
+
+    df = pd.read_parquet(percorso_sidecar)
+    if mtime_cambiato:
+        # Contenuto identico (es. file copiato o "toccato"): aggiorna solo i metadati
+        _scrivi_sidecar(percorso_csv, df, stat)
+    return df
+
+
+def _dentro_cartella(percorso, cartella):
+    """True se percorso (risolti i link simbolici) si trova dentro cartella."""
+    percorso, cartella = os.path.realpath(percorso), os.path.realpath(cartella)
+    return os.path.commonpath([percorso, cartella]) == cartella
+
+
+def _scrivi_sidecar(percorso_csv, df, stat):
+    """
+    Salva il DataFrame già pulito e calibrato nel sidecar Parquet.
+    stat è lo stato del CSV letto prima del parsing: se nel frattempo il file è
+    cambiato il sidecar non viene scritto. I sidecar si scrivono solo dentro
+    CARTELLA_DATI, mai accanto a file arbitrari.
+    """
+    if pq is None:
+        return
+    percorso_sidecar = _percorso_sidecar(percorso_csv)
+    if not _dentro_cartella(percorso_sidecar, CARTELLA_DATI):
+        print(f"Sidecar non scritto fuori dalla cartella dei dati: {percorso_sidecar}")
+        return
+    percorso_tmp = f"{percorso_sidecar}.{os.getpid()}.tmp"
+    try:
+        sha1 = _hash_file(percorso_csv)
+        stat_attuale = os.stat(percorso_csv)
+        if (stat_attuale.st_mtime_ns, stat_attuale.st_size) != (stat.st_mtime_ns, stat.st_size):
+            return
+        metadati = {
+            'versione': VERSIONE_SIDECAR,
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha1': sha1,
+            'calibrazioni': impronta_calibrazioni(os.path.basename(percorso_csv)),
+            'stato': _stato_ingestione(percorso_csv, df, stat.st_size),
+        }
+        tabella = pa.Table.from_pandas(df, preserve_index=False)
+        tabella = tabella.replace_schema_metadata({
+            **(tabella.schema.metadata or {}),
+            _CHIAVE_METADATI_SIDECAR: json.dumps(metadati).encode('utf-8'),
+        })
+        pq.write_table(tabella, percorso_tmp)
+        os.replace(percorso_tmp, percorso_sidecar)
+    except OSError as e:
+        print(f"Impossibile scrivere il sidecar {percorso_sidecar}: {e}")
+        if os.path.exists(percorso_tmp):
+            os.remove(percorso_tmp)
+
+
+def carica_df(percorso_csv, usa_sidecar=True, compatto=False):
     """
     Carica, pulisce e parsa il file CSV in un DataFrame di Pandas.
+
+    Dopo il primo parsing il risultato viene salvato in un sidecar Parquet
+    accanto al CSV (se pyarrow è installato): i caricamenti successivi leggono
+    direttamente il sidecar finché il CSV non cambia.
+    Con compatto=True il DataFrame viene restituito nella forma di compatta_df.
     """
     try:
         if not os.path.exists(percorso_csv):
             print(f"File non trovato: {percorso_csv}")
             return pd.DataFrame()
 
-        with open(percorso_csv, 'r', encoding='utf-8', newline='') as infile:
-            lines = infile.readlines()
-        
-        righe_pulite = []
-        for line in lines:
-            line = line.strip()
-            if line.startswith('"') and line.endswith('"'):
-                line = line[1:-1]
-            line = line.replace('""', '"')
-            righe_pulite.append(line)
-        
-        cleaned_data_io = StringIO('\n'.join(righe_pulite))
-        df = pd.read_csv(cleaned_data_io)
-        
-        df.columns = df.columns.str.strip()
-        df['created_at'] = pd.to_datetime(df['created_at'])
-        
-        # Rimuovi le informazioni sul fuso orario per compatibilità
-        if df['created_at'].dt.tz is not None:
-            df['created_at'] = df['created_at'].dt.tz_localize(None)
-        
-        DELTA = 2.048 / (2**12)
-        I_MIN = 4
-        I_MAX = 20
-        H_MIN = 0
-        H_MAX = 20
-        
-        is_villaverla_sensor = percorso_csv.endswith('m4w_Villaverla.csv')
-
-        for col_name in df.columns:
-            if col_name.startswith('field') and col_name[5:].isdigit():
-                if col_name == 'field3' and is_villaverla_sensor:
-                    df[col_name] = pd.to_numeric(df[col_name], errors='coerce')
-                    i = df[col_name] * DELTA / 102 * 1000
-                    h = ((i - I_MIN) / (I_MAX - I_MIN)) * (H_MAX - H_MIN) + H_MIN
-                    df[col_name] = h
-                else:
-                    df[col_name] = pd.to_numeric(df[col_name], errors='coerce')
-                    df[col_name] = df[col_name].apply(lambda x: math.trunc(x * 100) / 100.0 if not pd.isna(x) else None)
-        
-        return df
+        df = _leggi_sidecar(percorso_csv) if usa_sidecar else None
+        if df is None:
+            stat = os.stat(percorso_csv)
+            df = _parsa_csv(percorso_csv)
+            if usa_sidecar:
+                _scrivi_sidecar(percorso_csv, df, stat)
+        return compatta_df(df) if compatto else df
     except Exception as e:
         print(f"Si è verificato un errore in carica_df: {e}")
         return pd.DataFrame()
 
+
+# --- Scoperta e precaricamento in parallelo dei CSV di stazione ---
+
+# Cartella predefinita dei dati: la radice del progetto, dove si trovano i CSV
+CARTELLA_DATI = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Cartelle ignorate durante la ricerca dei CSV di stazione
+_CARTELLE_ESCLUSE = {'__pycache__', 'venv', 'node_modules'}
+
+
+def _e_csv_stazione(percorso):
+    """Un CSV è di stazione se l'intestazione contiene created_at ed entry_id."""
+    try:
+        colonne = _intestazione(percorso)
+    except (OSError, UnicodeDecodeError):
+        return False
+    return 'created_at' in colonne and 'entry_id' in colonne
+
+
+def trova_stazioni(cartella=CARTELLA_DATI):
+    """
+    Restituisce i percorsi assoluti (ordinati) di tutti i CSV di stazione
+    presenti nella cartella e nelle sue sottocartelle.
+    """
+    percorsi = []
+    for radice, cartelle, file in os.walk(cartella):
+        cartelle[:] = [c for c in cartelle if not c.startswith('.') and c not in _CARTELLE_ESCLUSE]
+        for nome in file:
+            percorso = os.path.join(radice, nome)
+            if nome.lower().endswith('.csv') and _e_csv_stazione(percorso):
+                percorsi.append(os.path.abspath(percorso))
+    return sorted(percorsi)
+
+
+def _precarica_stazione(percorso_csv):
+    """
+    Eseguita nei processi del pool: parsa il CSV e scrive il sidecar.
+    Il DataFrame torna al processo principale solo se i sidecar non sono
+    disponibili (pyarrow non installato), altrimenti basta il sidecar su disco.
+    """
+    inizio = time.perf_counter()
+    df = carica_df(percorso_csv)
+    secondi = time.perf_counter() - inizio
+    return len(df), secondi, (df if pq is None else None)
+
+
+def _contesto_processi():
+    """
+    Contesto dei processi del pool: forkserver, sicuro anche se chi lo avvia ha
+    thread attivi (poller, gunicorn), con data_loader (e quindi pandas) già
+    importato nel server da cui vengono creati i figli; spawn dove forkserver
+    non esiste (Windows). In entrambi i casi i figli importano lo script
+    principale come __mp_main__: l'avvio protetto da __name__ non si ripete.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    contesto = multiprocessing.get_context('forkserver')
+    contesto.set_forkserver_preload(['data_loader'])
+    return contesto
+
+
+def _precaricamenti(percorsi, processi):
+    """Produce le coppie (percorso, future) man mano che i parsing terminano."""
+    if processi == 1:
+        for percorso in percorsi:
+            future = Future()
+            try:
+                future.set_result(_precarica_stazione(percorso))
+            except Exception as e:
+                future.set_exception(e)
+            yield percorso, future
+        return
+    with ProcessPoolExecutor(max_workers=processi, mp_context=_contesto_processi()) as pool:
+        futures = {pool.submit(_precarica_stazione, percorso): percorso for percorso in percorsi}
+        for future in as_completed(futures):
+            yield futures[future], future
+
+
+def precarica_stazioni(cartella=CARTELLA_DATI, processi=None, in_cache=True):
+    """
+    Parsa in parallelo, con un pool di processi, tutti i CSV di stazione della
+    cartella. I risultati finiscono nei sidecar Parquet e, se in_cache è True,
+    nella cache di processo insieme alle piramidi dei sensori: il tempo di riscaldamento dopo un deploy scala con
+    il numero di core invece che con il numero di stazioni. Con processi=1 i
+    file vengono parsati uno alla volta nel processo chiamante, senza pool.
+
+    Restituisce:
+        dict: Per ogni file righe e secondi di parsing, più il tempo totale.
+    """
+    percorsi = trova_stazioni(cartella)
+    report = {'file': {}, 'processi': processi or os.cpu_count(), 'secondi_totali': 0.0}
+    inizio = time.perf_counter()
+
+    for completati, (percorso, future) in enumerate(_precaricamenti(percorsi, processi), start=1):
+        try:
+            righe, secondi, df = future.result()
+        except Exception as e:
+            print(f"[{completati}/{len(percorsi)}] Errore nel precaricamento di {percorso}: {e}")
+            continue
+        report['file'][percorso] = {'righe': righe, 'secondi': secondi}
+        print(f"[{completati}/{len(percorsi)}] {os.path.relpath(percorso, cartella)}: "
+              f"{righe} righe in {secondi:.2f} s")
+        if in_cache and df is not None and not df.empty:
+            _cache_df.get(percorso, lambda _: df)
+
+    if in_cache and pq is not None:
+        # I sidecar appena scritti rendono questo passaggio una semplice lettura
+        for percorso in report['file']:
+            carica_df_cache(percorso)
+
+    report['secondi_totali'] = time.perf_counter() - inizio
+    print(f"Precaricati {len(report['file'])} file su {len(percorsi)} in {report['secondi_totali']:.2f} s "
+          f"con {report['processi']} processi")
+    return report
+
+
+# --- Riscaldamento all'avvio del server web ---
+#
+# Il precaricamento gira nel processo web, in un thread in background, e non
+# in una fase di release: su Heroku la release viene eseguita in un dyno
+# separato il cui filesystem non viene conservato, quindi i sidecar scritti lì
+# non arriverebbero mai ai dyno web. I sidecar finiscono accanto ai CSV nel
+# filesystem del dyno e durano fino al suo riavvio (a ogni riavvio il
+# riscaldamento si ripete); le richieste che arrivano prima della fine parsano
+# il file da sé come senza precaricamento. I file vengono parsati in parallelo
+# da un pool di PROCESSI_PRECARICA processi (uno per core) creati con
+# forkserver, non con fork: il processo web ha già thread attivi (poller,
+# gunicorn). Tra i worker gunicorn dello stesso dyno il pool lo avvia solo chi
+# prende il lock: gli altri aspettano e poi caricano nella propria cache i
+# sidecar già pronti. Per riscaldare una cartella dati persistente resta il
+# comando python GUI/data_loader.py (vedi in fondo al file).
+
+# Impostare a 0 per disattivare il precaricamento all'avvio
+PRECARICA_ALL_AVVIO = os.environ.get('MORE4WATER_PRECARICA', '1') != '0'
+
+# Processi usati dal precaricamento all'avvio (1: nel processo web stesso, senza pool)
+PROCESSI_PRECARICA = os.cpu_count() or 1
+
+# File di lock condiviso dai worker dello stesso host
+PERCORSO_LOCK_PRECARICA = os.path.join(tempfile.gettempdir(), 'more4water_precarica.lock')
+
+
+def _precarica_in_background(cartella, processi):
+    file_lock = None
+    try:
+        if fcntl is not None:
+            file_lock = open(PERCORSO_LOCK_PRECARICA, 'a+')
+            try:
+                fcntl.flock(file_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Un altro worker sta già scrivendo i sidecar: si aspetta e si leggono quelli
+                fcntl.flock(file_lock, fcntl.LOCK_EX)
+                for percorso in trova_stazioni(cartella):
+                    carica_df_cache(percorso)
+                return
+        precarica_stazioni(cartella, processi, in_cache=True)
+    except Exception as e:
+        print(f"Errore nel precaricamento delle stazioni: {e}")
+    finally:
+        if file_lock is not None:
+            file_lock.close()
+
+
+def avvia_precaricamento(cartella=CARTELLA_DATI, processi=PROCESSI_PRECARICA):
+    """
+    Avvia in background il precaricamento di tutte le stazioni (vedi sopra),
+    se non è disattivato con MORE4WATER_PRECARICA=0.
+
+    Restituisce:
+        threading.Thread: Il thread avviato, oppure None.
+    """
+    if not PRECARICA_ALL_AVVIO:
+        return None
+    thread = threading.Thread(
+        target=_precarica_in_background, args=(cartella, processi), name='precarica-stazioni', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+# --- Lettura a chunk con filtro sull'intervallo temporale ---
+
+# Oltre questa dimensione i CSV non vengono caricati interi in memoria
+SOGLIA_STREAMING_BYTES = 256 * 1024 * 1024
+
+# Righe parsate per ogni chunk nella lettura in streaming
+RIGHE_PER_CHUNK = 100_000
+
+
+def carica_df_intervallo(percorso_csv, sensore, inizio, fine, righe_per_chunk=RIGHE_PER_CHUNK):
+    """
+    Modalità streaming di carica_df per archivi troppo grandi per la RAM.
+
+    Legge il file a chunk, parsando solo created_at e le colonne dei sensori
+    richiesti (un nome oppure una lista di nomi), e applica le stesse pulizie e calibrazioni di carica_df. Poiché i file sono
+    ordinati nel tempo, i chunk precedenti a inizio vengono scartati e la
+    lettura si interrompe appena si supera fine: la memoria usata dipende
+    dalla dimensione del chunk e dalle righe dell'intervallo.
+
+    Restituisce:
+        pandas.DataFrame: Le righe con inizio <= created_at <= fine, oppure un
+        DataFrame vuoto in caso di errore. Se un sensore non esiste nel file il
+        DataFrame restituito non contiene la sua colonna.
+    """
+    try:
+        if not os.path.exists(percorso_csv):
+            print(f"File non trovato: {percorso_csv}")
+            return pd.DataFrame()
+
+        inizio = pd.Timestamp(inizio)
+        fine = pd.Timestamp(fine)
+        sensori = [sensore] if isinstance(sensore, str) else list(sensore)
+        colonne = {'created_at', *sensori}
+        parti = []
+        vuoto = pd.DataFrame()
+        with open(percorso_csv, 'r', encoding='utf-8') as infile:
+            lettore = pd.read_csv(
+                _FlussoThingSpeak(infile),
+                usecols=lambda c: c.strip() in colonne,
+                chunksize=righe_per_chunk,
+            )
+            for chunk in lettore:
+                chunk.columns = chunk.columns.str.strip()
+                chunk = _pulisci_df(chunk, percorso_csv)
+                vuoto = chunk.iloc[0:0]
+                istanti = chunk['created_at']
+                if istanti.is_monotonic_increasing:
+                    if len(chunk) and istanti.iloc[-1] < inizio:
+                        continue
+                    parti.append(intervallo_df(chunk, inizio, fine))
+                    if len(chunk) and istanti.iloc[-1] > fine:
+                        break
+                else:
+                    parti.append(chunk[(istanti >= inizio) & (istanti <= fine)])
+
+        return pd.concat(parti, ignore_index=True) if parti else vuoto
+    except Exception as e:
+        print(f"Si è verificato un errore in carica_df_intervallo: {e}")
+        return pd.DataFrame()
+
+
+# --- Cache di processo dei DataFrame già parsati ---
+
+# Memoria massima (in byte) occupata dai DataFrame tenuti in cache
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Se True la cache conserva i DataFrame in forma compatta (vedi compatta_df)
+CACHE_COMPATTA = False
+
+
+class CacheDataFrame:
+    """
+    Cache LRU dei DataFrame restituiti da carica_df, limitata per byte occupati.
+
+    Ogni voce è indicizzata per percorso assoluto e validata con mtime e
+    dimensione del file. Se il CSV è cresciuto vengono parsate solo le righe
+    aggiunte in coda (vedi _leggi_coda); se è stato troncato o riscritto la
+    voce viene ricaricata da zero. A ogni ingestione (caricamento o righe
+    aggiunte) vengono costruite o estese anche le piramidi dei sensori
+    (vedi rollup.aggiorna_piramidi). Con compatto=True i DataFrame vengono
+    conservati nella forma ridotta di compatta_df.
+    I DataFrame restituiti sono condivisi tra le callback e non vanno modificati.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, compatto=False):
+        self.max_bytes = max_bytes
+        self.compatto = compatto
+        self._voci = OrderedDict()  # percorso -> (firma, df, byte, stato di ingestione)
+        self._lock = threading.Lock()
+        self._byte_totali = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.aggiornamenti_incrementali = 0
+
+    @staticmethod
+    def _firma(percorso):
+        stat = os.stat(percorso)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, percorso_csv, loader):
+        """
+        Restituisce il DataFrame del file dalla cache, oppure lo carica con loader.
+        """
+        percorso = os.path.abspath(percorso_csv)
+        try:
+            firma = self._firma(percorso)
+        except OSError:
+            self.invalida(percorso)
+            return loader(percorso_csv)
+
+        with self._lock:
+            voce = self._voci.get(percorso)
+            if voce is not None and voce[0] == firma:
+                self._voci.move_to_end(percorso)
+                self.hits += 1
+                return voce[1]
+            self.misses += 1
+
+        if voce is not None:
+            risultato = _leggi_coda(percorso, voce[1], voce[3], self.compatto)
+            if risultato is not None:
+                self.aggiornamenti_incrementali += 1
+                self._inserisci(percorso, firma, *risultato)
+                self._aggiorna_piramidi(percorso, risultato[0])
+                return risultato[0]
+
+        df = loader(percorso_csv)
+        if not df.empty:
+            if self.compatto:
+                df = compatta_df(df)
+            self._inserisci(percorso, firma, df, _stato_ingestione(percorso, df, firma[1]))
+            self._aggiorna_piramidi(percorso, df)
+        return df
+
+    @staticmethod
+    def _aggiorna_piramidi(percorso, df):
+        """Aggrega le righe appena ingerite: un errore non impedisce di restituire i dati."""
+        try:
+            aggiorna_piramidi(percorso, df)
+        except Exception as e:
+            print(f"Errore nell'aggiornamento delle piramidi di {percorso}: {e}")
+
+    def _inserisci(self, percorso, firma, df, stato):
+        byte = memoria_df(df)
+        with self._lock:
+            self._rimuovi(percorso)
+            if byte > self.max_bytes:
+                return
+            self._voci[percorso] = (firma, df, byte, stato)
+            self._byte_totali += byte
+            while self._byte_totali > self.max_bytes:
+                vecchio = next(iter(self._voci))
+                self._rimuovi(vecchio)
+                self.evictions += 1
+
+    def _rimuovi(self, percorso):
+        voce = self._voci.pop(percorso, None)
+        if voce is not None:
+            self._byte_totali -= voce[2]
+
+    def stato(self, percorso_csv, firma):
+        """Stato di ingestione della voce in cache, se corrisponde ancora a firma."""
+        with self._lock:
+            voce = self._voci.get(os.path.abspath(percorso_csv))
+        if voce is None or voce[0] != firma:
+            return None
+        return voce[3]
+
+    def invalida(self, percorso_csv=None):
+        """Rimuove dalla cache un singolo file, oppure tutti i file se percorso_csv è None."""
+        with self._lock:
+            if percorso_csv is None:
+                self._voci.clear()
+                self._byte_totali = 0
+            else:
+                self._rimuovi(os.path.abspath(percorso_csv))
+
+    def statistiche(self):
+        """Restituisce contatori e occupazione corrente della cache."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'aggiornamenti_incrementali': self.aggiornamenti_incrementali,
+                'voci': len(self._voci),
+                'byte': self._byte_totali,
+                'max_bytes': self.max_bytes,
+                'byte_per_file': {percorso: voce[2] for percorso, voce in self._voci.items()},
+            }
+
+
+_cache_df = CacheDataFrame(compatto=CACHE_COMPATTA)
+
+
+def carica_df_cache(percorso_csv):
+    """
+    Come carica_df, ma riusa il DataFrame già parsato se il file non è cambiato
+    e, se il file è solo cresciuto, parsa soltanto le righe aggiunte in coda.
+    """
+    return _cache_df.get(percorso_csv, carica_df)
+
+
+def invalida_cache(percorso_csv=None):
+    """Invalida la cache di un file (o di tutti i file se non indicato)."""
+    _cache_df.invalida(percorso_csv)
+
+
+def statistiche_cache():
+    """Restituisce hit/miss/eviction e byte occupati dalla cache dei DataFrame, anche per file."""
+    return _cache_df.statistiche()
+
+
+# --- Indice dei metadati dei file (limiti temporali, sensori, valori mancanti) ---
+
+_indice_metadati = {}  # percorso assoluto -> (firma, metadati)
+
+
+def _metadati_da_riassunto(riassunto):
+    righe = riassunto['righe']
+    return {
+        'righe': righe,
+        'inizio': pd.Timestamp(riassunto['inizio']) if riassunto['inizio'] else None,
+        'fine': pd.Timestamp(riassunto['fine']) if riassunto['fine'] else None,
+        'sensori': [col for col in riassunto['nulli'] if col.startswith('field') and col[5:].isdigit()],
+        'null_ratio': {col: (n / righe if righe else 1.0) for col, n in riassunto['nulli'].items()},
+    }
+
+
+def metadati_file(percorso_csv):
+    """
+    Restituisce i metadati di un file dati senza caricarne il contenuto.
+
+    I metadati vengono presi, nell'ordine, dall'indice in memoria, dai metadati
+    del sidecar Parquet o dallo stato della cache dei DataFrame: il file viene
+    parsato solo se nessuna di queste fonti è aggiornata. Quando il CSV cresce,
+    i conteggi vengono aggiornati con le sole righe aggiunte.
+
+    Restituisce:
+        dict: Chiavi 'righe', 'inizio', 'fine' (ultimo timestamp), 'sensori'
+        (colonne fieldN presenti) e 'null_ratio' (frazione di valori mancanti
+        per colonna), oppure None se il file non esiste o non contiene dati.
+    """
+    percorso = os.path.abspath(percorso_csv)
+    try:
+        stat = os.stat(percorso)
+    except OSError:
+        print(f"File non trovato: {percorso_csv}")
+        return None
+    firma = (stat.st_mtime_ns, stat.st_size)
+
+    voce = _indice_metadati.get(percorso)
+    if voce is not None and voce[0] == firma:
+        return voce[1]
+
+    riassunto = None
+    metadati_sidecar = _metadati_sidecar(percorso)
+    if metadati_sidecar and (metadati_sidecar['mtime_ns'], metadati_sidecar['size']) == firma:
+        riassunto = metadati_sidecar['stato']['riassunto']
+    else:
+        df = carica_df_cache(percorso)
+        if df.empty:
+            return None
+        stato = _cache_df.stato(percorso, firma)
+        riassunto = stato['riassunto'] if stato else _riassunto_df(df)
+
+    metadati = _metadati_da_riassunto(riassunto)
+    if metadati['righe'] == 0:
+        return None
+    _indice_metadati[percorso] = (firma, metadati)
+    return metadati
+
+
+if __name__ == '__main__':
+    # Riscaldamento manuale (es. di una cartella dati persistente): python GUI/data_loader.py [cartella_dati]
+    import sys
+    precarica_stazioni(sys.argv[1] if len(sys.argv) > 1 else CARTELLA_DATI, in_cache=False)
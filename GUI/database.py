@@ -0,0 +1,469 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+from configurazione import FUSO_ORARIO
+
+# --- Accesso al database delle segnalazioni ---
+#
+# Tutte le letture e scritture di mydatabase.db passano da qui: le connessioni
+# vengono riusate da un pool di processo invece di essere aperte e chiuse a
+# ogni richiesta, sono configurate una volta sola (WAL, sincronizzazione,
+# cache, mmap, attesa sui lock) e lo schema viene inizializzato una sola
+# volta per processo, portandolo all'ultima versione con le migrazioni
+# (vedi MIGRAZIONI). Con WAL i lettori non bloccano lo scrittore; le
+# scritture concorrenti (più worker gunicorn) aspettano il proprio turno fino
+# a TIMEOUT_LOCK invece di fallire subito con "database is locked".
+
+# Percorso assoluto al file mydatabase.db (si può sovrascrivere, es. per le prove)
+DB_PATH = os.environ.get(
+    'MORE4WATER_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mydatabase.db'),
+)
+
+# Connessioni inattive conservate nel pool
+DIMENSIONE_POOL = 8
+
+# Secondi di attesa massima sul lock del database prima di un errore
+TIMEOUT_LOCK = 30
+
+# Impostazioni di ogni connessione
+PRAGMA_CONNESSIONE = {
+    'synchronous': 'NORMAL',    # con WAL si sincronizza solo ai checkpoint, senza perdere transazioni dopo un crash del processo
+    'cache_size': -16000,       # 16 MB di cache delle pagine (valori negativi in KiB)
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+# --- Migrazioni dello schema ---
+#
+# La versione dello schema è salvata nel file (PRAGMA user_version). Ogni
+# migrazione porta il database dalla versione precedente alla successiva ed
+# è eseguita in una transazione insieme all'aggiornamento della versione:
+# qualunque sia la storia di un mydatabase.db (creato da create_db o dai
+# vecchi inserimenti di db_utils, con tabelle diverse) converge allo stesso
+# schema. Le nuove modifiche vanno aggiunte in coda, senza toccare le precedenti.
+
+# Schema originale di create_db: non modifica le tabelle già esistenti
+_SCHEMA_INIZIALE = '''
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    role TEXT DEFAULT 'user',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    sensor_id TEXT,
+    issue_type TEXT NOT NULL,
+    description TEXT,
+    priority INTEGER DEFAULT 1,
+    status TEXT DEFAULT 'open',
+    timestamp TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE TABLE IF NOT EXISTS general_reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    province TEXT,
+    city TEXT,
+    address TEXT,
+    problem_description TEXT,
+    image_path TEXT
+);
+'''
+
+# Istante corrente in secondi epoch, come valore predefinito delle colonne
+_ADESSO = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+
+def _epoca(valore, utc=False):
+    """
+    Secondi epoch di un timestamp salvato come testo: i timestamp di db_utils
+    (datetime.now()) sono ore locali dell'app (FUSO_ORARIO), indipendentemente
+    dal fuso del server che esegue la migrazione; CURRENT_TIMESTAMP è in UTC.
+    """
+    if valore is None or isinstance(valore, (int, float)):
+        return None if valore is None else int(valore)
+    try:
+        istante = datetime.fromisoformat(str(valore))
+    except ValueError:
+        return None
+    if istante.tzinfo is None:
+        istante = istante.replace(tzinfo=timezone.utc if utc else ZoneInfo(FUSO_ORARIO))
+    return int(istante.timestamp())
+
+
+def _colonne(conn, tabella):
+    return [riga[1] for riga in conn.execute(f"PRAGMA table_info({tabella})")]
+
+
+def _ricostruisci(conn, tabella, definizione, converti):
+    """
+    Ricrea una tabella con una nuova definizione copiando le righe esistenti:
+    converti riceve ogni riga come dict (con le sole colonne presenti nella
+    vecchia tabella) e restituisce la tupla delle colonne della nuova.
+    """
+    vecchie = _colonne(conn, tabella)
+    righe = [dict(zip(vecchie, riga)) for riga in conn.execute(f"SELECT * FROM {tabella}")]
+    conn.execute(f"CREATE TABLE {tabella}_nuova ({definizione})")
+    nuove = _colonne(conn, f"{tabella}_nuova")
+    conn.executemany(
+        f"INSERT INTO {tabella}_nuova ({', '.join(nuove)}) VALUES ({', '.join('?' * len(nuove))})",
+        [converti(riga) for riga in righe],
+    )
+    conn.execute(f"DROP TABLE {tabella}")
+    conn.execute(f"ALTER TABLE {tabella}_nuova RENAME TO {tabella}")
+
+
+def _migrazione_1(conn):
+    """Tabelle di partenza (quelle già presenti restano come sono)."""
+    for istruzione in _SCHEMA_INIZIALE.split(';'):
+        if istruzione.strip():
+            conn.execute(istruzione)
+
+
+def _migrazione_2(conn):
+    """
+    Schema unico di reports (status, created_at e chiave esterna verso users,
+    mancanti nella versione di db_utils) e timestamp in secondi epoch, così
+    gli intervalli di tempo sono confronti tra interi su un indice.
+    """
+    adesso = int(time.time())
+
+    def converti_report(riga):
+        creata = _epoca(riga.get('created_at'), utc=True)
+        timestamp = _epoca(riga.get('timestamp'))
+        timestamp = timestamp if timestamp is not None else (creata if creata is not None else adesso)
+        return (
+            riga['id'], riga.get('user_id'), riga.get('sensor_id'), riga.get('issue_type') or '',
+            riga.get('description'), riga.get('priority') if riga.get('priority') is not None else 1,
+            riga.get('status') or 'open', timestamp, creata if creata is not None else timestamp,
+        )
+
+    _ricostruisci(conn, 'reports', f'''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER REFERENCES users (id),
+        sensor_id TEXT,
+        issue_type TEXT NOT NULL,
+        description TEXT,
+        priority INTEGER NOT NULL DEFAULT 1,
+        status TEXT NOT NULL DEFAULT 'open',
+        timestamp INTEGER NOT NULL DEFAULT {_ADESSO},
+        created_at INTEGER NOT NULL DEFAULT {_ADESSO}
+    ''', converti_report)
+
+    def converti_generica(riga):
+        return (
+            riga['id'], _epoca(riga.get('timestamp')) or adesso, riga.get('first_name'), riga.get('last_name'),
+            riga.get('province'), riga.get('city'), riga.get('address'),
+            riga.get('problem_description'), riga.get('image_path'),
+        )
+
+    _ricostruisci(conn, 'general_reports', f'''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL DEFAULT {_ADESSO},
+        first_name TEXT,
+        last_name TEXT,
+        province TEXT,
+        city TEXT,
+        address TEXT,
+        problem_description TEXT,
+        image_path TEXT
+    ''', converti_generica)
+
+
+def _migrazione_3(conn):
+    """
+    Indici per le interrogazioni degli operatori:
+    - segnalazioni aperte di un sensore per priorità, dalla più recente
+      (WHERE status = ? AND sensor_id = ? ORDER BY priority DESC, timestamp DESC),
+      coprente anche per issue_type: la lista si legge dal solo indice;
+    - tutte le segnalazioni dalla più recente e per intervallo di tempo;
+    - storico delle segnalazioni di un sensore.
+    """
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS reports_stato_sensore "
+        "ON reports (status, sensor_id, priority DESC, timestamp DESC, issue_type)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS reports_timestamp ON reports (timestamp DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS reports_sensore_timestamp ON reports (sensor_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS general_reports_timestamp ON general_reports (timestamp)")
+
+
+# Migrazioni in ordine: la migrazione i-esima porta lo schema alla versione i
+MIGRAZIONI = [_migrazione_1, _migrazione_2, _migrazione_3]
+
+
+def versione_schema(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migra(conn):
+    """
+    Applica le migrazioni mancanti, una transazione per versione. Con più
+    processi all'avvio solo il primo che prende il lock esegue ogni
+    migrazione: gli altri trovano la versione già aggiornata.
+
+    Restituisce:
+        int: La versione finale dello schema.
+    """
+    versione = versione_schema(conn)
+    if versione > len(MIGRAZIONI):
+        raise RuntimeError(
+            f"Il database è alla versione {versione}, più recente di questo codice ({len(MIGRAZIONI)})"
+        )
+    while versione < len(MIGRAZIONI):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            versione = versione_schema(conn)
+            if versione < len(MIGRAZIONI):
+                MIGRAZIONI[versione](conn)
+                versione += 1
+                conn.execute(f'PRAGMA user_version={versione}')
+                print(f"Database migrato alla versione {versione}")
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    return versione
+
+
+class PoolConnessioni:
+    """
+    Pool di connessioni SQLite verso un file, condiviso dai thread del processo.
+
+    Le connessioni sono in autocommit: le transazioni si aprono esplicitamente
+    con transazione(). Dopo un fork il pool del processo padre viene scartato.
+    """
+
+    def __init__(self, percorso=DB_PATH, dimensione=DIMENSIONE_POOL):
+        self.percorso = percorso
+        self.dimensione = dimensione
+        self._libere = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._schema_pronto = False
+
+    def _apri(self):
+        conn = sqlite3.connect(
+            self.percorso, timeout=TIMEOUT_LOCK, isolation_level=None, check_same_thread=False
+        )
+        # La modalità WAL resta scritta nel file: basta impostarla, le altre impostazioni valgono per connessione
+        conn.execute('PRAGMA journal_mode=WAL')
+        for nome, valore in PRAGMA_CONNESSIONE.items():
+            conn.execute(f'PRAGMA {nome}={valore}')
+        return conn
+
+    def _inizializza(self, conn):
+        with self._lock:
+            if not self._schema_pronto:
+                migra(conn)
+                self._schema_pronto = True
+
+    @contextmanager
+    def connessione(self):
+        """Presta una connessione del pool (aprendone una nuova se non ce ne sono di libere)."""
+        if self._pid != os.getpid():
+            # Le connessioni SQLite non vanno usate attraverso un fork
+            self._libere = queue.LifoQueue()
+            self._pid = os.getpid()
+        try:
+            conn = self._libere.get_nowait()
+        except queue.Empty:
+            conn = self._apri()
+        try:
+            if not self._schema_pronto:
+                self._inizializza(conn)
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction or self._libere.qsize() >= self.dimensione:
+                conn.close()
+            else:
+                self._libere.put(conn)
+
+    @contextmanager
+    def transazione(self, durevole=False):
+        """
+        Connessione con una transazione di scrittura: commit all'uscita,
+        rollback in caso di eccezione. BEGIN IMMEDIATE prende subito il lock di
+        scrittura, così l'attesa avviene all'inizio (entro TIMEOUT_LOCK) e non
+        a metà transazione, dove SQLite fallirebbe senza aspettare.
+
+        Con durevole=True il COMMIT attende la sincronizzazione su disco del
+        WAL (synchronous=FULL): la transazione sopravvive anche a una
+        interruzione di corrente, non solo a un crash del processo.
+        """
+        with self.connessione() as conn:
+            if durevole:
+                conn.execute('PRAGMA synchronous=FULL')
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                yield conn
+                conn.execute('COMMIT')
+            finally:
+                if durevole:
+                    # Il livello di sincronizzazione non si può cambiare dentro una transazione
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    conn.execute(f"PRAGMA synchronous={PRAGMA_CONNESSIONE['synchronous']}")
+
+    def leggi_df(self, query, params=()):
+        """Esegue una query di lettura e ne restituisce il risultato come DataFrame."""
+        with self.connessione() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def chiudi(self):
+        """Chiude le connessioni libere del pool."""
+        while True:
+            try:
+                self._libere.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# Pool del database delle segnalazioni, condiviso da tutto il processo
+database = PoolConnessioni()
+
+
+def inizializza_database():
+    """Porta lo schema all'ultima versione (una sola volta per processo)."""
+    with database.connessione():
+        pass
+
+
+# --- Scritture raggruppate (write-behind) ---
+#
+# Gli inserimenti delle segnalazioni non aprono ognuno la propria transazione
+# dentro il callback: vengono accodati e un thread di scrittura li raccoglie
+# in un'unica transazione durevole (un solo COMMIT e una sola
+# sincronizzazione su disco per gruppo), appena il gruppo raggiunge
+# MAX_GRUPPO righe o è trascorsa FINESTRA_GRUPPO dalla prima in attesa. Chi
+# scrive riceve la conferma (o l'errore) solo dopo il COMMIT del proprio
+# gruppo: con molti invii contemporanei il numero di scritture al secondo
+# cresce con la dimensione dei gruppi invece di essere limitato dalle
+# sincronizzazioni del disco. All'uscita del processo la coda viene svuotata.
+
+# Righe massime per transazione
+MAX_GRUPPO = 256
+
+# Secondi di attesa massima di altre righe dopo la prima di un gruppo
+FINESTRA_GRUPPO = 0.005
+
+# Secondi di attesa massima della conferma da parte di chi scrive
+TIMEOUT_CONFERMA = TIMEOUT_LOCK + 10
+
+
+class CodaScritture:
+    """
+    Coda di istruzioni di scrittura eseguite a gruppi da un thread dedicato.
+
+    accoda() restituisce un Future che si completa con il lastrowid della riga
+    dopo il COMMIT; scrivi() accoda e attende la conferma. Il thread parte
+    alla prima scrittura (e riparte dopo un fork); chiudi() svuota la coda.
+    """
+
+    def __init__(self, pool, max_gruppo=MAX_GRUPPO, finestra=FINESTRA_GRUPPO):
+        self.pool = pool
+        self.max_gruppo = max_gruppo
+        self.finestra = finestra
+        self._coda = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._chiusa = False
+
+    def accoda(self, query, params=()):
+        """Accoda un'istruzione e restituisce il Future della sua conferma."""
+        futuro = Future()
+        with self._lock:
+            if self._chiusa:
+                raise RuntimeError("Coda delle scritture chiusa")
+            if self._pid != os.getpid():
+                # Il thread del processo padre non esiste nel figlio
+                self._coda = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._esegui, name='coda-scritture', daemon=True)
+                self._thread.start()
+            self._coda.put((query, params, futuro))
+        return futuro
+
+    def scrivi(self, query, params=(), timeout=TIMEOUT_CONFERMA):
+        """Accoda un'istruzione e ne attende il COMMIT; restituisce il lastrowid."""
+        return self.accoda(query, params).result(timeout)
+
+    def _raccogli(self, prima):
+        gruppo = [prima]
+        scadenza = time.monotonic() + self.finestra
+        while len(gruppo) < self.max_gruppo:
+            try:
+                elemento = self._coda.get(timeout=max(scadenza - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if elemento is None:
+                # Richiesta di chiusura: si scrive il gruppo e poi ci si ferma
+                self._coda.put(None)
+                break
+            gruppo.append(elemento)
+        return gruppo
+
+    def _scrivi_gruppo(self, gruppo):
+        try:
+            with self.pool.transazione(durevole=True) as conn:
+                risultati = [conn.execute(query, params).lastrowid for query, params, _ in gruppo]
+        except Exception as e:
+            if len(gruppo) == 1 or isinstance(e, sqlite3.OperationalError):
+                # Riga non valida, oppure database bloccato oltre TIMEOUT_LOCK o non
+                # scrivibile (errore comune a tutto il gruppo): l'errore va a chi ha scritto
+                print(f"Errore nella scrittura sul database: {e}")
+                for _, _, futuro in gruppo:
+                    futuro.set_exception(e)
+                return
+            # Un'istruzione non valida non deve far perdere le altre: si riprova una riga per volta
+            for elemento in gruppo:
+                self._scrivi_gruppo([elemento])
+            return
+        for (_, _, futuro), risultato in zip(gruppo, risultati):
+            futuro.set_result(risultato)
+
+    def _esegui(self):
+        while True:
+            prima = self._coda.get()
+            if prima is None:
+                return
+            self._scrivi_gruppo(self._raccogli(prima))
+
+    def chiudi(self, timeout=TIMEOUT_CONFERMA):
+        """Rifiuta nuove scritture e attende quelle già accodate."""
+        with self._lock:
+            self._chiusa = True
+            if self._pid != os.getpid():
+                return
+            self._coda.put(None)
+        self._thread.join(timeout)
+
+
+# Coda delle scritture sul database delle segnalazioni
+coda_scritture = CodaScritture(database)
+atexit.register(coda_scritture.chiudi)
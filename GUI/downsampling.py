@@ -0,0 +1,86 @@
+import numpy as np
+
+# --- Riduzione del numero di punti da inviare al browser ---
+#
+# Entrambi i metodi restituiscono gli indici (ordinati) dei punti da tenere,
+# così il chiamante può selezionare le righe del DataFrame con .iloc.
+
+# Punti per pixel di larghezza del grafico: oltre questa densità non si vede differenza
+PUNTI_PER_PIXEL = 2
+
+
+def budget_punti(larghezza_px):
+    """Numero massimo di punti da disegnare per un grafico largo larghezza_px pixel."""
+    return max(int(larghezza_px * PUNTI_PER_PIXEL), 4)
+
+
+def minmax(y, n_punti):
+    """
+    Divide la serie in bucket di uguale numero di campioni e di ciascuno tiene
+    il minimo e il massimo: i picchi restano visibili qualunque sia lo zoom.
+    Operazione interamente vettoriale (O(n)). I valori NaN vengono ignorati.
+    """
+    y = np.asarray(y, dtype='float64')
+    n = len(y)
+    if n <= n_punti:
+        return np.arange(n)
+
+    n_bucket = max(n_punti // 2, 1)
+    dimensione = -(-n // n_bucket)  # divisione intera per eccesso
+    griglia = np.full(n_bucket * dimensione, np.nan)
+    griglia[:n] = y
+    griglia = griglia.reshape(n_bucket, dimensione)
+
+    vuoti = np.isnan(griglia).all(axis=1)
+    base = np.arange(n_bucket) * dimensione
+    indici_min = base + np.argmin(np.where(np.isnan(griglia), np.inf, griglia), axis=1)
+    indici_max = base + np.argmax(np.where(np.isnan(griglia), -np.inf, griglia), axis=1)
+
+    indici = np.unique(np.concatenate([indici_min[~vuoti], indici_max[~vuoti], [0, n - 1]]))
+    indici = indici[indici < n]
+    return indici[~np.isnan(y[indici])]
+
+
+def lttb(x, y, n_punti):
+    """
+    Largest-Triangle-Three-Buckets: per ogni bucket tiene il punto che forma il
+    triangolo di area massima con il punto scelto nel bucket precedente e con
+    la media del bucket successivo. Conserva bene la forma della serie.
+    I valori NaN vengono scartati prima della selezione.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    validi = np.flatnonzero(~np.isnan(y))
+    n = len(validi)
+    if n <= n_punti or n_punti < 3:
+        return validi
+
+    xv = x[validi]
+    yv = y[validi]
+    bordi = np.linspace(1, n - 1, n_punti - 1).astype(int)
+    scelti = np.empty(n_punti, dtype=int)
+    scelti[0] = 0
+    scelti[-1] = n - 1
+
+    a = 0
+    for i in range(n_punti - 2):
+        inizio, fine = bordi[i], bordi[i + 1]
+        successivo_fine = bordi[i + 2] if i + 2 < len(bordi) else n
+        media_x = xv[fine:successivo_fine].mean() if successivo_fine > fine else xv[-1]
+        media_y = yv[fine:successivo_fine].mean() if successivo_fine > fine else yv[-1]
+
+        aree = np.abs(
+            (xv[a] - media_x) * (yv[inizio:fine] - yv[a])
+            - (xv[a] - xv[inizio:fine]) * (media_y - yv[a])
+        )
+        a = inizio + int(np.argmax(aree))
+        scelti[i + 1] = a
+
+    return validi[scelti]
+
+
+def riduci(x, y, n_punti, metodo='minmax'):
+    """Applica il metodo di downsampling scelto ('minmax' oppure 'lttb')."""
+    if metodo == 'lttb':
+        return lttb(x, y, n_punti)
+    return minmax(y, n_punti)
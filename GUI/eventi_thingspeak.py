@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+
+from flask import Response, abort, request, stream_with_context
+
+from thingspeak_live import poller_thingspeak
+
+# --- Push dei punti nuovi al browser con Server-Sent Events ---
+#
+# Ogni pagina in tempo reale apre una connessione EventSource su
+# /eventi/thingspeak per il canale e il sensore mostrati. Il generatore resta
+# fermo sulla condizione del poller (nessun lavoro finché non arrivano dati)
+# e invia solo le entry successive all'ultima già disegnata dal client. Se la
+# connessione cade, il browser si ricollega da solo con l'header
+# Last-Event-ID, cioè con l'ultima entry_id ricevuta.
+#
+# Ogni connessione aperta occupa un thread del server per tutta la sua durata:
+# con gunicorn servono worker a thread (vedi Procfile, GUNICORN_THREADS thread
+# per worker). Per lasciare thread liberi alle callback di Dash ogni worker
+# accetta al massimo MAX_FLUSSI connessioni contemporanee; oltre il limite la
+# route risponde 503 e la pagina torna ad aggiornarsi con dcc.Interval (vedi
+# assets/thingspeak_live.js). Con W worker i cruscotti collegati in tempo
+# reale sono al massimo W * MAX_FLUSSI.
+
+# Secondi di silenzio dopo cui si invia un commento, per tenere aperta la connessione
+# attraverso i proxy e accorgersi dei client che se ne sono andati
+INTERVALLO_KEEPALIVE = 15
+
+# Attesa (millisecondi) suggerita al browser prima di ricollegarsi
+ATTESA_RICONNESSIONE_MS = 5000
+
+# Thread di ogni worker gunicorn (lo stesso valore usato nel Procfile)
+THREAD_WORKER = int(os.environ.get('GUNICORN_THREADS', 64))
+
+# Connessioni SSE contemporanee per worker: di default metà dei thread
+MAX_FLUSSI = int(os.environ.get('MORE4WATER_MAX_FLUSSI_SSE', THREAD_WORKER // 2))
+
+# Secondi suggeriti (header Retry-After) ai client rifiutati per troppe connessioni
+ATTESA_FLUSSI_PIENI = 60
+
+_flussi_liberi = threading.BoundedSemaphore(MAX_FLUSSI)
+
+
+def punti_x(df):
+    return df['created_at'].dt.strftime('%Y-%m-%dT%H:%M:%S').tolist()
+
+
+def punti_y(df, sensore):
+    valori = df[sensore]
+    return valori.astype(object).where(valori.notna(), None).tolist()
+
+
+def _evento(tipo, dati, id_evento=None):
+    righe = [f"event: {tipo}"]
+    if id_evento is not None:
+        righe.append(f"id: {id_evento}")
+    righe.append(f"data: {json.dumps(dati, separators=(',', ':'))}")
+    return "\n".join(righe) + "\n\n"
+
+
+def _stato(snapshot):
+    return {'stantio': snapshot['stantio'], 'errore': snapshot['ultimo_errore']}
+
+
+def flusso_eventi(canale, sensore, entry_id):
+    """
+    Generatore degli eventi di un canale a partire da entry_id.
+
+    Eventi: 'punti' (x e y delle entry nuove, con id l'ultima entry_id) e
+    'stato' (dati vecchi ed eventuale errore del poller, solo quando cambia).
+    """
+    stato_inviato = _stato(poller_thingspeak.snapshot(canale))
+    yield f"retry: {ATTESA_RICONNESSIONE_MS}\n\n" + _evento('stato', stato_inviato)
+    while True:
+        nuove = poller_thingspeak.attendi_dati(canale, entry_id, INTERVALLO_KEEPALIVE)
+        messaggi = []
+        if not nuove.empty:
+            entry_id = int(nuove['entry_id'].iat[-1])
+            if sensore in nuove.columns:
+                messaggi.append(_evento('punti', {'x': punti_x(nuove), 'y': punti_y(nuove, sensore)}, entry_id))
+        stato = _stato(poller_thingspeak.snapshot(canale))
+        if stato != stato_inviato:
+            messaggi.append(_evento('stato', stato))
+            stato_inviato = stato
+        yield "".join(messaggi) or ": keepalive\n\n"
+
+
+def registra_eventi(server):
+    """Aggiunge al server Flask la route degli eventi in tempo reale."""
+
+    @server.route('/eventi/thingspeak')
+    def eventi_thingspeak():
+        canale = request.args.get('canale', poller_thingspeak.live.channel_id)
+        sensore = request.args.get('sensore')
+        if canale not in poller_thingspeak.lives or not sensore:
+            abort(404)
+        try:
+            entry_id = int(request.headers.get('Last-Event-ID') or request.args.get('dopo', 0))
+        except ValueError:
+            abort(400)
+        if not _flussi_liberi.acquire(blocking=False):
+            # Troppe connessioni aperte: il browser passa all'aggiornamento periodico
+            return Response(
+                "Too many live connections", status=503, mimetype='text/plain',
+                headers={'Retry-After': str(ATTESA_FLUSSI_PIENI)},
+            )
+        risposta = Response(
+            stream_with_context(flusso_eventi(canale, sensore, entry_id)),
+            mimetype='text/event-stream',
+            # Niente cache né buffering dei proxy (es. nginx): ogni evento deve arrivare subito
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+        # Il posto si libera alla chiusura della risposta, anche se il flusso non è mai partito
+        risposta.call_on_close(_flussi_liberi.release)
+        return risposta
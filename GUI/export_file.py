@@ -1,8 +1,13 @@
 import os
-import sqlite3
 import pandas as pd
+import atexit
 import base64
+import tempfile
+import threading
+import time
 import uuid
+from configurazione import FUSO_ORARIO
+from database import coda_scritture, database
 
 # Funzione per salvare l'immagine
 def save_image(contents, filename):
@@ -25,32 +30,50 @@ def save_image(contents, filename):
         
     return unique_filename
 
-# Percorso al database
+# Cartella in cui vengono scritti i CSV esportati
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'mydatabase.db')
 
 # Funzione per estrarre dati da una tabella e formattare i timestamp, se esistono
 def estrai_tabella_e_formatta(nome_tabella):
     """Estrae una tabella dal database, formatta le colonne con timestamp e restituisce un DataFrame."""
-    conn = sqlite3.connect(DB_PATH)
     df = pd.DataFrame()
     try:
-        df = pd.read_sql_query(f"SELECT * FROM {nome_tabella}", conn)
+        df = database.leggi_df(f"SELECT * FROM {nome_tabella}")
         
         # Identifica le colonne che contengono timestamp, ma solo se esistono
-        timestamp_cols = [col for col in df.columns if 'timestamp' in col.lower() or 'data' in col.lower()]
+        timestamp_cols = [
+            col for col in df.columns
+            if 'timestamp' in col.lower() or 'data' in col.lower() or col.lower() == 'created_at'
+        ]
         
         # Converti il formato del timestamp solo se la colonna è stata trovata
         if timestamp_cols:
             for col in timestamp_cols:
+                if pd.api.types.is_integer_dtype(df[col]):
+                    # Secondi epoch (vedi database.py): nell'ora locale dell'app, come i vecchi timestamp
+                    df[col] = pd.to_datetime(df[col], unit='s', utc=True).dt.tz_convert(FUSO_ORARIO)
                 df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d %H:%M:%S')
             
     except Exception as e:
         print(f"Errore durante la lettura della tabella {nome_tabella}: {e}")
         df = pd.DataFrame()
-    conn.close()
     return df
 
+def _scrivi_csv_atomico(df, percorso):
+    """
+    Scrive il CSV in un file temporaneo nella stessa cartella e lo sostituisce
+    all'originale con os.replace: chi legge vede sempre un export completo,
+    anche se due processi esportano nello stesso momento.
+    """
+    descrittore, temporaneo = tempfile.mkstemp(dir=os.path.dirname(percorso), suffix='.tmp')
+    try:
+        with os.fdopen(descrittore, 'w', encoding='utf-8', newline='') as f:
+            df.to_csv(f, index=False)
+        os.replace(temporaneo, percorso)
+    except BaseException:
+        os.unlink(temporaneo)
+        raise
+
 # Funzione principale per esportare in CSV
 def esporta_database_in_csv():
     """Esporta le tabelle 'reports' e 'general_reports' in file CSV."""
@@ -58,7 +81,7 @@ def esporta_database_in_csv():
     df_reports = estrai_tabella_e_formatta("reports")
     if not df_reports.empty:
         csv_reports_path = os.path.join(BASE_DIR, "segnalazioni_specializzate.csv")
-        df_reports.to_csv(csv_reports_path, index=False, encoding="utf-8")
+        _scrivi_csv_atomico(df_reports, csv_reports_path)
     else:
         # Se la tabella è vuota o non è stato possibile leggerla, non fa nulla
         pass
@@ -67,11 +90,104 @@ def esporta_database_in_csv():
     df_general = estrai_tabella_e_formatta("general_reports")
     if not df_general.empty:
         csv_general_path = os.path.join(BASE_DIR, "segnalazioni_generiche.csv")
-        df_general.to_csv(csv_general_path, index=False, encoding="utf-8")
+        _scrivi_csv_atomico(df_general, csv_general_path)
     else:
         # Se la tabella è vuota o non è stato possibile leggerla, non fa nulla
         pass
 
+# --- Esportazione differita ---
+#
+# Le pagine delle segnalazioni non esportano a ogni invio: chiedono un export
+# e tornano subito. Un thread in background aspetta RITARDO_ESPORTAZIONE
+# secondi di quiete e poi esporta una sola volta tutte le segnalazioni
+# arrivate nel frattempo. Gli export dello stesso processo non si
+# sovrappongono mai; quelli di worker diversi sono comunque atomici.
+
+# Secondi senza nuove richieste prima di esportare
+RITARDO_ESPORTAZIONE = 5
+
+# Secondi massimi di rinvio con invii continui: oltre si esporta comunque
+ATTESA_MAX_ESPORTAZIONE = 60
+
+
+class EsportazioneDifferita:
+    """Raggruppa le richieste di export in un'esportazione ogni RITARDO_ESPORTAZIONE secondi."""
+
+    def __init__(self, esporta, ritardo=RITARDO_ESPORTAZIONE, attesa_max=ATTESA_MAX_ESPORTAZIONE):
+        self.esporta = esporta
+        self.ritardo = ritardo
+        self.attesa_max = attesa_max
+        self._condizione = threading.Condition()
+        self._lock_esportazione = threading.Lock()  # un solo export alla volta (thread e uscita)
+        self._prima_richiesta = None  # istante della prima richiesta non ancora esportata
+        self._ultima_richiesta = None
+        self._thread = None
+        self._pid = None
+
+    def richiedi(self):
+        """Segnala che ci sono nuove segnalazioni da esportare; non blocca."""
+        with self._condizione:
+            adesso = time.monotonic()
+            if self._prima_richiesta is None:
+                self._prima_richiesta = adesso
+            self._ultima_richiesta = adesso
+            # Avviato alla prima richiesta, e di nuovo nel figlio dopo un fork
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._ciclo, name='esportazione-csv', daemon=True)
+                self._thread.start()
+            self._condizione.notify()
+
+    def _ciclo(self):
+        while True:
+            with self._condizione:
+                while self._prima_richiesta is None:
+                    self._condizione.wait()
+                scadenza = min(self._ultima_richiesta + self.ritardo, self._prima_richiesta + self.attesa_max)
+                attesa = scadenza - time.monotonic()
+                if attesa > 0:
+                    self._condizione.wait(attesa)
+                    continue
+                self._prima_richiesta = self._ultima_richiesta = None
+            self._esegui()
+
+    def _esegui(self):
+        try:
+            with self._lock_esportazione:
+                self.esporta()
+        except Exception as e:
+            print(f"Errore durante l'esportazione in CSV: {e}")
+
+    def svuota(self):
+        """Esegue subito l'export ancora in attesa (all'uscita del processo)."""
+        with self._condizione:
+            in_attesa = self._prima_richiesta is not None and self._pid == os.getpid()
+            self._prima_richiesta = self._ultima_richiesta = None
+        if in_attesa:
+            self._esegui()
+
+
+esportazione_differita = EsportazioneDifferita(esporta_database_in_csv)
+
+
+def _chiusura():
+    """
+    All'uscita del processo: prima si attendono le segnalazioni ancora nella
+    coda delle scritture, poi si esegue l'export in attesa, che così le
+    contiene. Un solo hook, perché atexit esegue le funzioni in ordine
+    inverso di registrazione e database.py registra la propria chiusura prima.
+    """
+    coda_scritture.chiudi()
+    esportazione_differita.svuota()
+
+
+atexit.register(_chiusura)
+
+
+def richiedi_esportazione_csv():
+    """Programma l'export in CSV delle segnalazioni senza attenderlo (vedi EsportazioneDifferita)."""
+    esportazione_differita.richiedi()
+
 # Esecuzione
 if __name__ == "__main__":
     esporta_database_in_csv()
@@ -26,6 +26,18 @@ layout = html.Div(
                     href="/thingspeak",  # Redirect to the ThingSpeak page
                     style={'textDecoration': 'none'}
                 ),
+
+                # Button for the latest values of all stations (ThingSpeak)
+                dcc.Link(
+                    dbc.Button(
+                        "All Stations (Live)",
+                        color="info",
+                        size="lg",
+                        className="me-3"
+                    ),
+                    href="/stazioni",  # Redirect to the stations overview page
+                    style={'textDecoration': 'none'}
+                ),
                 
                 # Button for historical data (CSV files)
                 dcc.Link(
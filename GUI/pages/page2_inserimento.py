@@ -1,10 +1,11 @@
 import dash
 from dash import html, dcc, Input, Output, State
 from datetime import datetime, date
-import pandas as pd
 import os
 import dash_bootstrap_components as dbc
-from data_loader import carica_df
+from data_loader import metadati_file, trova_stazioni
+from archivio_thingspeak import archivio_thingspeak, canale_da_sorgente, sorgente_archivio
+from thingspeak_live import canali_thingspeak
 
 dash.register_page(__name__, path='/inserimento', title='Seleziona dati')
 
@@ -12,10 +13,18 @@ dash.register_page(__name__, path='/inserimento', title='Seleziona dati')
 current_dir = os.path.dirname(__file__)
 project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
 
-# Nomi dei file CSV disponibili.
+# File CSV di stazione disponibili, trovati nella cartella del progetto.
 opzioni_file = [
-    {'label': 'feeds.csv', 'value': 'feeds.csv'},
-    {'label': 'm4w_Villaverla.csv', 'value': 'm4w_Villaverla.csv'}
+    {'label': os.path.relpath(p, project_root), 'value': os.path.relpath(p, project_root)}
+    for p in trova_stazioni(project_root)
+]
+_file_stazioni = {o['value'] for o in opzioni_file}
+
+# Canali ThingSpeak dell'archivio locale (quelli configurati anche se ancora vuoti)
+_nomi_canali = {c['id']: c['nome'] for c in canali_thingspeak}
+opzioni_file += [
+    {'label': f"{_nomi_canali.get(canale, f'Channel {canale}')} (ThingSpeak archive)", 'value': sorgente_archivio(canale)}
+    for canale in sorted(set(archivio_thingspeak.canali()) | set(_nomi_canali))
 ]
 
 minuti_options = [{'label': '00', 'value': 0}, {'label': '30', 'value': 30}]
@@ -59,15 +68,18 @@ layout = html.Div(style={'padding': '20px'}, children=[
     Input('file-dropdown', 'value')
 )
 def aggiorna_dati_e_layout(file_selezionato):
-    csv_path = os.path.join(project_root, file_selezionato)
+    canale = canale_da_sorgente(file_selezionato)
     
-    # La nostra funzione ora restituisce una lista di dizionari
-    dati_sensori = carica_df(csv_path)
-    
-    # Convertiamo subito la lista in un DataFrame
-    df_new = pd.DataFrame(dati_sensori)
+    # Per le opzioni della pagina bastano i metadati del file: i dati non vengono caricati
+    if canale is not None:
+        metadati = archivio_thingspeak.metadati(canale)
+    elif file_selezionato in _file_stazioni:
+        metadati = metadati_file(os.path.join(project_root, file_selezionato))
+    else:
+        # Solo i CSV di stazione del progetto, mai percorsi arbitrari
+        metadati = None
     
-    if df_new.empty:
+    if metadati is None:
         df_min_date = date(2020, 1, 1)
         df_max_date = date.today()
         latest_timestamp_data = None
@@ -87,11 +99,10 @@ def aggiorna_dati_e_layout(file_selezionato):
             latest_timestamp_data
         )
     else:
-        # Ora il resto del codice può usare il DataFrame come faceva prima
-        df_min_date = df_new['created_at'].min().date()
-        df_max_date = df_new['created_at'].max().date()
-        sensori = [f'field{i}' for i in range(1, 8) if f'field{i}' in df_new.columns]
-        latest_timestamp = df_new['created_at'].max()
+        df_min_date = metadati['inizio'].date()
+        df_max_date = metadati['fine'].date()
+        sensori = [f'field{i}' for i in range(1, 8) if f'field{i}' in metadati['sensori']]
+        latest_timestamp = metadati['fine']
         latest_timestamp_data = {'date': latest_timestamp.date().isoformat(), 'hour': latest_timestamp.hour, 'minute': latest_timestamp.minute}
         
         default_start_hour_value = None
@@ -106,6 +117,7 @@ def aggiorna_dati_e_layout(file_selezionato):
                     id='sensore-dropdown',
                     options=[{'label': f"Sensor {i+1}", 'value': s} for i, s in enumerate(sensori)],
                     placeholder="Select a sensor",
+                    multi=True,
                     searchable=False,
                     clearable=False,
                     className='common-dropdown-style'
@@ -234,7 +246,10 @@ def genera_link(sensore, sd, sh, sm, ed, eh, em, file_selezionato, latest_timest
         error_message = "Error: start date/time must be before or equal to end date/time."
         return link_output, error_message
     
-    query = f"?file={file_selezionato}&sensore={sensore}&sd={sd}&sh={sh}&sm={sm}&ed={ed}&eh={eh}&em={em}"
+    # Più sensori selezionati diventano parametri sensore ripetuti, sovrapposti nello stesso grafico
+    sensori = sensore if isinstance(sensore, list) else [sensore]
+    parametri_sensori = "".join(f"&sensore={s}" for s in sensori)
+    query = f"?file={file_selezionato}{parametri_sensori}&sd={sd}&sh={sh}&sm={sm}&ed={ed}&eh={eh}&em={em}"
     link_output = dcc.Link(
         dbc.Button("Generate Graph", color="success", className="me-1"),
         href=f"/grafici{query}",
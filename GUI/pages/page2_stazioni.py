@@ -0,0 +1,97 @@
+import dash
+from dash import html, dcc, Input, Output
+import dash_bootstrap_components as dbc
+import pandas as pd
+from thingspeak_live import poller_thingspeak
+
+# Mappa dei nomi dei sensori per una migliore leggibilità
+SENSOR_NAMES = {
+    'field3': 'Water Level',
+    'field7': 'Temperature'
+}
+
+# Registra la pagina con il router di Dash
+dash.register_page(__name__, path='/stazioni', title='All Stations')
+
+# Intervallo di aggiornamento della tabella (in millisecondi), allineato al poller
+REFRESH_INTERVAL = 20 * 1000
+
+# --- LAYOUT DELLA PAGINA ---
+layout = html.Div(
+    className="container mt-4",
+    children=[
+        html.H1("Latest Values from All Stations", className="text-center mb-4"),
+
+        # Tabella con l'ultima entry di ogni canale configurato
+        html.Div(id='stazioni-tabella'),
+        html.Div(id='stazioni-riepilogo', className="text-center text-muted"),
+
+        dcc.Interval(
+            id='stazioni-interval',
+            interval=REFRESH_INTERVAL,
+            n_intervals=0
+        ),
+
+        # Bottone "Torna alla selezione"
+        html.Div(
+            html.A(
+                "Back to Selection",
+                href="/scelta",
+                id="back-to-home-stazioni",
+                className="btn btn-secondary mt-4"
+            ),
+            className="text-center"
+        ),
+    ]
+)
+
+
+def formatta_valore(valore):
+    return "-" if pd.isna(valore) else f"{valore:.2f}"
+
+
+def formatta_eta(eta):
+    return "never" if eta is None or pd.isna(eta) else f"{int(eta)} s ago"
+
+
+# --- CALLBACK PER AGGIORNARE LA TABELLA ---
+@dash.callback(
+    Output('stazioni-tabella', 'children'),
+    Output('stazioni-riepilogo', 'children'),
+    Input('stazioni-interval', 'n_intervals')
+)
+def aggiorna_tabella(n_intervals):
+    """
+    Mostra l'ultimo valore di ogni stazione leggendo gli snapshot del poller
+    condiviso: la pagina non interroga mai ThingSpeak.
+    """
+    ultimi = poller_thingspeak.ultimi_valori()
+    campi = [col for col in ultimi.columns if col.startswith('field') and ultimi[col].notna().any()]
+
+    intestazione = html.Thead(html.Tr(
+        [html.Th("Station"), html.Th("Last entry")]
+        + [html.Th(SENSOR_NAMES.get(campo, campo)) for campo in campi]
+        + [html.Th("Updated")]
+    ))
+    righe = []
+    for riga in ultimi.itertuples(index=False):
+        riga = riga._asdict()
+        istante = riga['created_at']
+        righe.append(html.Tr(
+            [
+                html.Td(html.A(riga['nome'], href="/thingspeak")),
+                html.Td("-" if pd.isna(istante) else pd.Timestamp(istante).strftime('%d/%m/%Y %H:%M:%S')),
+            ]
+            + [html.Td(formatta_valore(riga[campo])) for campo in campi]
+            + [html.Td(formatta_eta(riga['eta']))],
+            # Le stazioni che non rispondono da FATTORE_STANTIO intervalli sono evidenziate
+            className="table-warning" if riga['stantio'] else None
+        ))
+
+    tabella = dbc.Table(
+        [intestazione, html.Tbody(righe)],
+        bordered=True, hover=True, responsive=True, size="sm", className="text-center"
+    )
+    aggiornate = int((~ultimi['stantio'].astype(bool)).sum())
+    riepilogo = f"{aggiornate} of {len(ultimi)} stations up to date (times in Europe/Rome)"
+    return tabella, riepilogo
@@ -1,10 +1,9 @@
 import dash
-from dash import html, dcc, Input, Output, State
+from dash import html, dcc, Input, Output, State, no_update, ClientsideFunction
 import dash_bootstrap_components as dbc
-import plotly.express as px
-import pandas as pd
-from io import StringIO
-from data_loader import carica_df_thingspeak
+import plotly.graph_objs as go
+from thingspeak_live import poller_thingspeak
+from eventi_thingspeak import punti_x, punti_y
 
 # Mappa dei nomi dei sensori per una migliore leggibilità
 SENSOR_NAMES = {
@@ -20,18 +19,40 @@ SENSOR_NAMES = {
 # Registra la pagina con il router di Dash
 dash.register_page(__name__, path='/thingspeak', title='Real-Time Data')
 
-# Intervallo di aggiornamento del grafico (in millisecondi)
-# Impostato a 20 secondi per allinearsi al canale ThingSpeak
+# Intervallo (in millisecondi) con cui si ricontrolla lo snapshot finché il
+# poller non ha ancora dati; poi i punti nuovi arrivano via Server-Sent Events
+# (vedi eventi_thingspeak e assets/thingspeak_live.js). Se il server rifiuta il
+# flusso (troppe connessioni) l'intervallo resta attivo e ridisegna il grafico.
 REFRESH_INTERVAL = 20 * 1000
 #1800 * 1000
 
+# Punti mostrati nel grafico: i più vecchi escono a sinistra quando ne arrivano di nuovi
+MAX_PUNTI_GRAFICO = 5000
+
+# Valore di thingspeak-sse quando il browser si aggiorna con l'intervallo invece che con gli eventi
+MODALITA_POLLING = 'polling'
+
 # --- LAYOUT DELLA PAGINA ---
 layout = html.Div(
     className="container mt-4",
     children=[
         html.H1("Real-Time Data from ThingSpeak", className="text-center mb-4"),
         
-        # Menu a tendina per la selezione del sensore
+        # Menu a tendina per la selezione della stazione e del sensore
+        html.Div(
+            className="d-flex justify-content-center mb-2",
+            children=[
+                html.Label("Select Station:", className="me-2 align-self-center"),
+                dcc.Dropdown(
+                    id='thingspeak-canale-dropdown',
+                    options=[{'label': live.nome, 'value': canale} for canale, live in poller_thingspeak.lives.items()],
+                    value=poller_thingspeak.live.channel_id,
+                    className="w-50",
+                    style={'width': '300px'},
+                    clearable=False
+                )
+            ]
+        ),
         html.Div(
             className="d-flex justify-content-center",
             children=[
@@ -49,11 +70,20 @@ layout = html.Div(
         
         # Grafico che verrà aggiornato
         dcc.Graph(id='thingspeak-live-graph'),
+
+        # Età dei dati mostrati (avviso se il poller non riceve risposte da ThingSpeak)
+        html.Div(id='thingspeak-stato', className="text-center text-muted"),
         
-        # Componente dcc.Store per memorizzare i dati
-        dcc.Store(id='thingspeak-data-store'),
+        # Riferimento ai dati del client: canale, sensore e ultima entry_id già disegnata.
+        # I dati restano nello store lato server (vedi thingspeak_live e store_frame)
+        dcc.Store(id='thingspeak-handle'),
+
+        # Canale a cui è collegata la connessione EventSource del browser,
+        # oppure MODALITA_POLLING se il flusso non è disponibile
+        dcc.Store(id='thingspeak-sse'),
         
-        # Componente dcc.Interval per l'aggiornamento automatico
+        # Attesa dei primi dati: si disattiva appena lo snapshot non è vuoto
+        # (salvo in MODALITA_POLLING, dove aggiorna anche il grafico)
         dcc.Interval(
             id='interval-component',
             interval=REFRESH_INTERVAL,
@@ -81,26 +111,54 @@ layout = html.Div(
     ]
 )
 
-# --- CALLBACK PER CARICARE E AGGIORNARE I DATI ---
+# --- CALLBACK PER CARICARE LE OPZIONI DEI SENSORI ---
 @dash.callback(
-    Output('thingspeak-data-store', 'data'),
     Output('thingspeak-sensor-dropdown', 'options'),
+    Output('interval-component', 'disabled'),
+    Output('thingspeak-stato', 'children'),
     Input('interval-component', 'n_intervals'),
+    Input('thingspeak-canale-dropdown', 'value'),
+    State('thingspeak-sensor-dropdown', 'options'),
+    State('thingspeak-sse', 'data'),
     # Input('refresh-button', 'n_clicks')
 )
-def update_data_and_options(n_intervals):
+def update_options(n_intervals, canale, opzioni_client, sse):
     """
-    Carica i dati da ThingSpeak e aggiorna lo Store e le opzioni del dropdown.
+    Legge l'ultimo snapshot del poller condiviso (vedi thingspeak_live): i
+    client non interrogano mai ThingSpeak. Appena il canale ha dati l'intervallo
+    si ferma: da lì in poi i punti nuovi arrivano al grafico via Server-Sent
+    Events, a meno che il flusso non sia stato rifiutato (MODALITA_POLLING).
     """
-    df = carica_df_thingspeak()
-    
+    snapshot = poller_thingspeak.snapshot(canale)
+    df = snapshot['df']
+    stato = testo_stato(snapshot)
+
     if df.empty:
-        return {}, []
-        
+        return no_update, False, stato
+
     sensori = [col for col in df.columns if col.startswith('field')]
     opzioni = [{'label': SENSOR_NAMES.get(s, s), 'value': s} for s in sensori]
-    
-    return df.to_json(date_format='iso', orient='split'), opzioni
+    if opzioni == opzioni_client:
+        opzioni = no_update
+    return opzioni, sse != MODALITA_POLLING, stato
+
+
+def crea_handle(df, canale, sensore):
+    return {
+        'canale': canale, 'sensore': sensore, 'entry_id': int(df['entry_id'].iat[-1]),
+        'max_punti': MAX_PUNTI_GRAFICO,
+    }
+
+
+def testo_stato(snapshot):
+    """Descrive l'età dei dati; se sono vecchi riporta anche l'ultimo errore del poller."""
+    if snapshot['eta'] is None:
+        testo = "Waiting for the first update from ThingSpeak..."
+    else:
+        testo = f"Last update {int(snapshot['eta'])} s ago"
+    if snapshot['stantio'] and snapshot['ultimo_errore']:
+        testo += f" (ThingSpeak not reachable: {snapshot['ultimo_errore']})"
+    return testo
 
 # --- CALLBACK PER MANTENERE LA SELEZIONE DEL SENSORE ---
 @dash.callback(
@@ -110,41 +168,70 @@ def update_data_and_options(n_intervals):
 )
 def set_default_sensor(options, current_value):
     """
-    Imposta il valore predefinito solo se non è già stato selezionato un sensore.
+    Imposta il valore predefinito solo se non è già stato selezionato un
+    sensore presente anche nella stazione corrente.
     """
-    if current_value:
-        return current_value
+    if current_value and any(o['value'] == current_value for o in options or []):
+        return no_update
     if options:
         return options[0]['value']
     return None
 
-# --- CALLBACK PER AGGIORNARE IL GRAFICO ---
+# --- CALLBACK PER DISEGNARE IL GRAFICO ---
 @dash.callback(
     Output('thingspeak-live-graph', 'figure'),
-    Input('thingspeak-data-store', 'data'),
-    Input('thingspeak-sensor-dropdown', 'value')
+    Output('thingspeak-handle', 'data'),
+    Input('thingspeak-sensor-dropdown', 'value'),
+    Input('thingspeak-canale-dropdown', 'value'),
+    Input('interval-component', 'n_intervals'),
+    State('thingspeak-sse', 'data'),
+    prevent_initial_call=True
 )
-def update_graph(data_json, selected_sensor):
+def update_graph(selected_sensor, canale, n_intervals, sse):
     """
-    Questa callback prende i dati dallo Store e aggiorna il grafico.
+    Ridisegna da zero il grafico (al cambio di sensore o di stazione) con gli
+    ultimi punti dello snapshot; da lì in poi il grafico cresce con i punti
+    inviati dal server (vedi il collegamento agli eventi qui sotto). Se il
+    flusso è stato rifiutato il grafico viene ridisegnato a ogni intervallo,
+    e il nuovo handle fa ritentare il collegamento.
     """
-    if not data_json or not selected_sensor:
-        return {}
-    
-    df = pd.read_json(StringIO(data_json), orient='split')
-    
-    fig = px.line(df, x='created_at', y=selected_sensor)
-    
+    if dash.ctx.triggered_id == 'interval-component' and sse != MODALITA_POLLING:
+        return no_update, no_update
+    snapshot = poller_thingspeak.snapshot(canale)
+    df = snapshot['df']
+    if not selected_sensor or df.empty or selected_sensor not in df.columns:
+        return {}, None
+
+    df = df.iloc[-MAX_PUNTI_GRAFICO:]
+    nome_sensore = SENSOR_NAMES.get(selected_sensor, selected_sensor)
+
+    fig = go.Figure(go.Scatter(
+        x=punti_x(df),
+        y=punti_y(df, selected_sensor),
+        mode='lines',
+        line=dict(color='#636efa'),
+        # Mantiene il tooltip pulito
+        hovertemplate='Date: %{x}<br>Value: %{y}<extra></extra>'
+    ))
+
     # Etichette degli assi ripristinate
     fig.update_layout(
         xaxis_title="Date and Time (Europe/Rome)", 
-        yaxis_title=SENSOR_NAMES.get(selected_sensor, selected_sensor),
-        title=f'Time trend of {SENSOR_NAMES.get(selected_sensor, selected_sensor)}'
+        yaxis_title=nome_sensore,
+        title=f'Time trend of {nome_sensore} - {snapshot["nome"]}',
+        template='plotly',
+        uirevision=f"{snapshot['canale']}:{selected_sensor}"
     )
     
-    # Mantiene il tooltip pulito
-    fig.update_traces(
-        hovertemplate='Date: %{x}<br>Value: %{y}<extra></extra>'
-    )
-    
-    return fig
\ No newline at end of file
+    return fig, crea_handle(df, snapshot['canale'], selected_sensor)
+
+
+# --- COLLEGAMENTO AL FLUSSO DEGLI EVENTI ---
+# Eseguito nel browser: (ri)apre la connessione EventSource per il canale e il
+# sensore disegnati, a partire dall'ultima entry del grafico. Ogni evento
+# accoda i punti con Plotly.extendTraces, senza callback verso il server.
+dash.clientside_callback(
+    ClientsideFunction(namespace='thingspeak', function_name='collega'),
+    Output('thingspeak-sse', 'data'),
+    Input('thingspeak-handle', 'data'),
+)
@@ -1,11 +1,17 @@
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, State, no_update
 from urllib import parse
 import pandas as pd
 import plotly.graph_objs as go
 from datetime import datetime
+import json
 import os
-from data_loader import carica_df
+import time
+from data_loader import allinea_serie, carica_df_cache, carica_df_intervallo, intervallo_df, trova_stazioni, SOGLIA_STREAMING_BYTES
+from downsampling import budget_punti, riduci
+from rollup import RISOLUZIONI, piramide
+from cache_figure import CacheFigure, versione_file
+from archivio_thingspeak import archivio_thingspeak, canale_da_sorgente
 
 # Registra la pagina Dash con path e titolo
 dash.register_page(__name__, path='/grafici', title='View Charts')
@@ -14,6 +20,44 @@ dash.register_page(__name__, path='/grafici', title='View Charts')
 current_dir = os.path.dirname(__file__)
 project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
 
+# Larghezza massima del grafico (px): determina quanti punti vale la pena inviare al browser
+LARGHEZZA_GRAFICO_PX = 1000
+
+# Metodo di downsampling: 'minmax' conserva i picchi, 'lttb' la forma della serie
+METODO_DOWNSAMPLING = 'minmax'
+
+# Oltre questo numero di punti il grafico usa una traccia WebGL (Scattergl)
+SOGLIA_WEBGL = 1000
+
+# Numero massimo di coppie file/sensore sovrapposte in un grafico
+MAX_SERIE = 6
+
+# Colori delle serie sovrapposte, nell'ordine della query
+COLORI_SERIE = ['RoyalBlue', 'Crimson', 'SeaGreen', 'DarkOrange', 'MediumPurple', 'Teal']
+
+# Figure già costruite, per query normalizzata e versione del file
+_cache_figure = CacheFigure()
+
+# Secondi minimi tra due ricerche dei CSV di stazione (per i file aggiunti dopo l'avvio)
+INTERVALLO_RICERCA_STAZIONI = 60
+
+# CSV di stazione consultabili: percorso relativo alla radice del progetto -> percorso assoluto.
+# Il parametro 'file' della query deve essere uno di questi oppure una sorgente 'thingspeak:<canale>'
+_stazioni = {}
+_ultima_ricerca_stazioni = None
+
+
+def _percorso_stazione(file_selezionato):
+    """Percorso assoluto di un CSV di stazione del progetto, oppure None se il file non è tra questi."""
+    global _stazioni, _ultima_ricerca_stazioni
+    if file_selezionato not in _stazioni and (
+        _ultima_ricerca_stazioni is None
+        or time.monotonic() - _ultima_ricerca_stazioni >= INTERVALLO_RICERCA_STAZIONI
+    ):
+        _stazioni = {os.path.relpath(p, project_root): p for p in trova_stazioni(project_root)}
+        _ultima_ricerca_stazioni = time.monotonic()
+    return _stazioni.get(file_selezionato)
+
 # Dizionario per mappare nomi sensori più leggibili
 sensor_labels = {
     'field1': 'Sensor 1',
@@ -36,7 +80,7 @@ layout = html.Div([
         style={
             'width': '100%',
             'height': '400px',
-            'maxWidth': '1000px',
+            'maxWidth': f'{LARGHEZZA_GRAFICO_PX}px',
             'margin': '0 auto'
         }
     ),
@@ -59,41 +103,44 @@ layout = html.Div([
     'backgroundColor': 'transparent',
 })
 
-@dash.callback(
-    Output('sensore-graph', 'figure'),
-    Output('error-message', 'children'),
-    Output('selected-dates', 'children'),
-    Output('graph-title', 'children'),
-    Input('url', 'search')
-)
-def mostra_grafico(query_string):
-    # Controllo iniziale della query string
+def _leggi_query(query_string):
+    """
+    Estrae le coppie (file, sensore) e l'intervallo dalla query string.
+    Restituisce (parametri, errore).
+
+    Per sovrapporre più serie i parametri file e sensore si ripetono e vengono
+    abbinati nell'ordine; un solo file (o un solo sensore) vale per tutte le coppie.
+    """
     if not query_string:
-        return go.Figure(), "Nessun parametro di ricerca trovato. Torna alla pagina di selezione per inserire i dati.", "", ""
+        return None, "Nessun parametro di ricerca trovato. Torna alla pagina di selezione per inserire i dati."
 
     params = parse.parse_qs(query_string[1:])
-    
-    file_selezionato = params.get('file', [None])[0]
-    sensore = params.get('sensore', [None])[0]
+
+    file_selezionati = params.get('file', [])
+    sensori = params.get('sensore', [])
     sd = params.get('sd', [None])[0]
     ed = params.get('ed', [None])[0]
-    
+
     # Controllo che tutti i parametri essenziali siano presenti
-    if not file_selezionato or not sensore or not sd or not ed:
-        return go.Figure(), "Errore: parametri mancanti. Torna alla pagina di selezione per inserire i dati.", "", ""
+    if not file_selezionati or not sensori or not sd or not ed:
+        return None, "Errore: parametri mancanti. Torna alla pagina di selezione per inserire i dati."
 
-    # Caricamento e controllo del DataFrame
-    csv_path = os.path.join(project_root, file_selezionato)
-    df = carica_df(csv_path)
+    if len(file_selezionati) == 1:
+        file_selezionati = file_selezionati * len(sensori)
+    elif len(sensori) == 1:
+        sensori = sensori * len(file_selezionati)
+    if len(file_selezionati) != len(sensori):
+        return None, "Errore: il numero di file e di sensori richiesti non corrisponde."
+
+    # Solo i CSV di stazione del progetto e l'archivio ThingSpeak: mai percorsi arbitrari
+    for file_selezionato in dict.fromkeys(file_selezionati):
+        if canale_da_sorgente(file_selezionato) is None and _percorso_stazione(file_selezionato) is None:
+            return None, f"Errore: il file '{file_selezionato}' non è disponibile."
+
+    coppie = list(dict.fromkeys(zip(file_selezionati, sensori)))
+    if len(coppie) > MAX_SERIE:
+        return None, f"Errore: si possono sovrapporre al massimo {MAX_SERIE} serie."
 
-    # Controllo se il DataFrame è vuoto dopo il caricamento
-    if df.empty:
-        return go.Figure(), f"Nessun dato valido trovato per il file '{file_selezionato}'.", "", ""
-    
-    # Controllo se la colonna del sensore esiste
-    if not sensore in df.columns:
-        return go.Figure(), f"Errore: il sensore '{sensore}' non esiste nel file '{file_selezionato}'.", "", ""
-    
     # Conversione degli orari
     try:
         sh = int(params.get('sh', ['0'])[0])
@@ -104,45 +151,350 @@ def mostra_grafico(query_string):
         start_dt = datetime.strptime(f"{sd} {sh}:{sm}", "%Y-%m-%d %H:%M")
         end_dt = datetime.strptime(f"{ed} {eh}:{em}", "%Y-%m-%d %H:%M")
     except (ValueError, TypeError):
-        return go.Figure(), "Errore nel formato di data o orario. Torna indietro e verifica le tue selezioni.", "", ""
+        return None, "Errore nel formato di data o orario. Torna indietro e verifica le tue selezioni."
 
     if start_dt > end_dt:
-        return go.Figure(), "Errore: la data/ora di inizio deve essere precedente o uguale a quella di fine.", "", ""
+        return None, "Errore: la data/ora di inizio deve essere precedente o uguale a quella di fine."
+
+    return (coppie, start_dt, end_dt), None
+
+
+def _carica_file(file_selezionato, sensori, inizio, fine):
+    """
+    Carica una sola volta un file per tutti i sensori richiesti.
+    Restituisce ((df, streaming), errore).
+
+    Le sorgenti 'thingspeak:<canale>' vengono lette dall'archivio locale con
+    una lettura per intervallo, come i file in streaming.
+    """
+    canale = canale_da_sorgente(file_selezionato)
+    if canale is not None:
+        return (archivio_thingspeak.leggi_intervallo(canale, inizio, fine, sensori), True), None
+
+    csv_path = _percorso_stazione(file_selezionato)
+
+    # Gli archivi troppo grandi per la RAM vengono letti in streaming solo per l'intervallo richiesto
+    if os.path.exists(csv_path) and os.path.getsize(csv_path) > SOGLIA_STREAMING_BYTES:
+        return (carica_df_intervallo(csv_path, sensori, inizio, fine), True), None
+
+    df = carica_df_cache(csv_path)
+
+    # Controllo se il DataFrame è vuoto dopo il caricamento
+    if df.empty:
+        return None, f"Nessun dato valido trovato per il file '{file_selezionato}'."
+    return (df, False), None
+
+
+def _versione_sorgente(file_selezionato):
+    """Versione di un file o di un canale archiviato, per la validazione della cache delle figure."""
+    canale = canale_da_sorgente(file_selezionato)
+    if canale is not None:
+        return archivio_thingspeak.versione(canale)
+    return versione_file(_percorso_stazione(file_selezionato))
+
+
+def _dati_finestra(file_selezionato, caricato, sensore, inizio, fine, risoluzione=None):
+    """
+    Restituisce ((risoluzione, dati), errore) per la finestra [inizio, fine].
 
-    # Filtraggio del DataFrame
-    df_filtered = df[(df['created_at'] >= start_dt) & (df['created_at'] <= end_dt)]
+    Se risoluzione è None viene scelta la più adatta alla finestra. Con 'raw'
+    i dati sono le righe originali (ridotte se superano il budget di punti),
+    altrimenti i bucket della piramide (min, max, mean, count). Gli archivi
+    letti in streaming non hanno piramide e restano sempre 'raw'.
+    """
+    df, streaming = caricato
+    n_punti = budget_punti(LARGHEZZA_GRAFICO_PX)
 
+    # Controllo se la colonna del sensore esiste
+    if sensore not in df.columns and not (streaming and 'created_at' not in df.columns):
+        return None, f"Errore: il sensore '{sensore}' non esiste nel file '{file_selezionato}'."
+
+    # Filtraggio del DataFrame (ricerca binaria sui timestamp ordinati)
+    df_filtered = df if streaming else intervallo_df(df, inizio, fine)
     if df_filtered.empty:
-        return go.Figure(), "Nessun dato trovato nell'intervallo selezionato. Prova un intervallo diverso.", "", ""
+        return None, "Nessun dato trovato nell'intervallo selezionato. Prova un intervallo diverso."
 
-    # Creazione del grafico
-    label_sensore = sensor_labels.get(sensore, sensore)
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df_filtered['created_at'],
-        y=df_filtered[sensore],
-        mode='lines+markers',
-        name=label_sensore,
-        marker=dict(color='RoyalBlue'),
-        line=dict(color='RoyalBlue'),
-        hovertemplate='Date: %{x|%d %b %Y %H:%M}<br>Value: %{y}<extra></extra>'
-    ))
+    if not streaming:
+        piramide_sensore = piramide(_percorso_stazione(file_selezionato), df, sensore)
+        if risoluzione is None:
+            risoluzione = piramide_sensore.scegli_risoluzione(len(df_filtered), inizio, fine, n_punti)
+        if risoluzione != 'raw':
+            aggregati = piramide_sensore.finestra(risoluzione, inizio, fine)
+            if len(aggregati) > n_punti:
+                # Finestra più lunga di quanto copra anche il livello giornaliero
+                aggregati = aggregati.iloc[riduci(aggregati.index.asi8, aggregati['mean'].to_numpy(), n_punti, METODO_DOWNSAMPLING)]
+            return (risoluzione, aggregati), None
+
+    # Downsampling: al browser arriva un numero di punti limitato dalla larghezza del grafico
+    if len(df_filtered) > n_punti:
+        indici = riduci(
+            df_filtered['created_at'].to_numpy(dtype='datetime64[ns]').astype('int64'),
+            df_filtered[sensore].to_numpy(dtype='float64'),
+            n_punti,
+            METODO_DOWNSAMPLING,
+        )
+        df_filtered = df_filtered.iloc[indici]
+    return ('raw', df_filtered), None
 
+
+def _stile_figura(fig, uirevision):
     fig.update_layout(
         xaxis_title='Date',
         yaxis_title='Values',
         template='plotly_white',
         margin=dict(l=20, r=20, t=50, b=20),
         xaxis=dict(title_font_size=14, tickfont_size=10),
-        yaxis=dict(title_font_size=14, tickfont_size=10)
+        yaxis=dict(title_font_size=14, tickfont_size=10),
+        showlegend=False,
+        # Mantiene lo zoom dell'utente quando la figura viene ridisegnata a un'altra risoluzione
+        uirevision=uirevision
     )
-    
+
     fig.update_xaxes(
         tickformat='%d %b %y',
         tickangle=0
     )
+    return fig
+
+
+def _crea_figura(risoluzione, dati, sensore, uirevision):
+    """Grafico dei dati grezzi, oppure della media con la fascia min-max degli aggregati."""
+    label_sensore = sensor_labels.get(sensore, sensore)
+    traccia = go.Scattergl if len(dati) > SOGLIA_WEBGL else go.Scatter
+    fig = go.Figure()
+
+    if risoluzione == 'raw':
+        fig.add_trace(traccia(
+            x=dati['created_at'],
+            y=dati[sensore],
+            mode='lines+markers',
+            name=label_sensore,
+            marker=dict(color='RoyalBlue'),
+            line=dict(color='RoyalBlue'),
+            hovertemplate='Date: %{x|%d %b %Y %H:%M}<br>Value: %{y}<extra></extra>'
+        ))
+    else:
+        fig.add_trace(traccia(
+            x=dati.index,
+            y=dati['max'],
+            mode='lines',
+            line=dict(width=0),
+            showlegend=False,
+            hoverinfo='skip'
+        ))
+        fig.add_trace(traccia(
+            x=dati.index,
+            y=dati['min'],
+            mode='lines',
+            line=dict(width=0),
+            fill='tonexty',
+            fillcolor='rgba(65, 105, 225, 0.2)',
+            showlegend=False,
+            hoverinfo='skip'
+        ))
+        fig.add_trace(traccia(
+            x=dati.index,
+            y=dati['mean'],
+            mode='lines',
+            name=f"{label_sensore} ({risoluzione})",
+            line=dict(color='RoyalBlue'),
+            customdata=dati[['min', 'max', 'count']].to_numpy(),
+            hovertemplate=(
+                'Date: %{x|%d %b %Y %H:%M}<br>Mean: %{y:.2f}<br>'
+                'Min: %{customdata[0]}<br>Max: %{customdata[1]}<br>Samples: %{customdata[2]}<extra></extra>'
+            )
+        ))
+
+    return _stile_figura(fig, uirevision)
+
+
+def _etichetta(file_selezionato, sensore, piu_stazioni):
+    label_sensore = sensor_labels.get(sensore, sensore)
+    if not piu_stazioni:
+        return label_sensore
+    return f"{label_sensore} - {os.path.splitext(os.path.basename(file_selezionato))[0]}"
+
+
+def _crea_figura_sovrapposta(allineate, serie, uirevision):
+    """
+    Grafico di più serie allineate sullo stesso asse dei tempi. Ogni sensore
+    diverso ha un proprio asse y: il primo a sinistra, gli altri a destra.
+
+    serie: lista di (colonna di allineate, etichetta, sensore).
+    """
+    assi = list(dict.fromkeys(sensore for _, _, sensore in serie))
+    fine_dominio = 1 - 0.07 * max(len(assi) - 2, 0)
+    traccia = go.Scattergl if len(allineate) > SOGLIA_WEBGL else go.Scatter
+    fig = go.Figure()
+
+    for i, (colonna, etichetta, sensore) in enumerate(serie):
+        n_asse = assi.index(sensore) + 1
+        fig.add_trace(traccia(
+            x=allineate['created_at'],
+            y=allineate[colonna],
+            mode='lines',
+            name=etichetta,
+            yaxis='y' if n_asse == 1 else f'y{n_asse}',
+            line=dict(color=COLORI_SERIE[i % len(COLORI_SERIE)]),
+            hovertemplate='%{y}'
+        ))
+
+    _stile_figura(fig, uirevision)
+    fig.update_layout(
+        showlegend=True,
+        legend=dict(orientation='h', y=-0.15),
+        hovermode='x unified',
+        xaxis=dict(domain=[0, fine_dominio]),
+    )
+    if len(assi) > 1:
+        fig.update_layout(yaxis_title=sensor_labels.get(assi[0], assi[0]))
+    for n_asse, sensore in enumerate(assi[1:], start=2):
+        fig.update_layout({f'yaxis{n_asse}': dict(
+            title=dict(text=sensor_labels.get(sensore, sensore), font_size=14),
+            tickfont_size=10,
+            overlaying='y',
+            side='right',
+            anchor='x' if n_asse == 2 else 'free',
+            position=fine_dominio + 0.07 * (n_asse - 2),
+            showgrid=False,
+        )})
+    return fig
+
+
+def _figura_finestra(coppie, inizio, fine, uirevision):
+    """
+    Costruisce la figura delle coppie (file, sensore) nella finestra [inizio, fine].
+    Restituisce (figura oppure None, lista dei messaggi di errore).
+    """
+    # Ogni file viene caricato una sola volta, qualunque sia il numero dei suoi sensori
+    sensori_per_file = {}
+    for file_selezionato, sensore in coppie:
+        sensori_per_file.setdefault(file_selezionato, []).append(sensore)
+
+    caricati = {}
+    errori = []
+    for file_selezionato, sensori in sensori_per_file.items():
+        caricato, errore = _carica_file(file_selezionato, sensori, inizio, fine)
+        if errore:
+            errori.append(errore)
+        else:
+            caricati[file_selezionato] = caricato
+
+    risultati = []
+    for file_selezionato, sensore in coppie:
+        if file_selezionato not in caricati:
+            continue
+        risultato, errore = _dati_finestra(file_selezionato, caricati[file_selezionato], sensore, inizio, fine)
+        if errore:
+            errori.append(errore)
+        else:
+            risultati.append((file_selezionato, sensore, risultato))
+
+    if not risultati:
+        return None, errori
+    if len(risultati) == 1:
+        _, sensore, risultato = risultati[0]
+        return _crea_figura(*risultato, sensore, uirevision), errori
+
+    # Tutte le serie alla risoluzione più grossolana tra quelle scelte, così i bucket coincidono
+    ordine = ['raw'] + RISOLUZIONI
+    comune = max((risultato[0] for _, _, risultato in risultati), key=ordine.index)
+    piu_stazioni = len(caricati) > 1
+
+    serie = {}
+    descrizioni = []
+    for i, (file_selezionato, sensore, risultato) in enumerate(risultati):
+        if risultato[0] != comune:
+            risultato, _ = _dati_finestra(file_selezionato, caricati[file_selezionato], sensore, inizio, fine, comune)
+        risoluzione, dati = risultato
+        if risoluzione == 'raw':
+            valori = pd.Series(dati[sensore].to_numpy(dtype='float64'), index=dati['created_at'])
+        else:
+            valori = dati['mean']
+        etichetta = _etichetta(file_selezionato, sensore, piu_stazioni)
+        if risoluzione != 'raw':
+            etichetta = f"{etichetta} ({risoluzione})"
+        colonna = f'serie{i}'
+        serie[colonna] = valori
+        descrizioni.append((colonna, etichetta, sensore))
+
+    # L'asse dei tempi è l'unione degli istanti di tutte le serie, allineate con un join as-of
+    allineate = allinea_serie(None, serie)
+    vuote = [d for d in descrizioni if allineate[d[0]].isna().all()]
+    for _, etichetta, _ in vuote:
+        errori.append(f"Nessun dato per {etichetta} nell'intervallo selezionato.")
+    descrizioni = [d for d in descrizioni if d not in vuote]
+    if not descrizioni:
+        return None, errori
+    return _crea_figura_sovrapposta(allineate, descrizioni, uirevision), errori
+
+
+@dash.callback(
+    Output('sensore-graph', 'figure'),
+    Output('error-message', 'children'),
+    Output('selected-dates', 'children'),
+    Output('graph-title', 'children'),
+    Input('url', 'search')
+)
+def mostra_grafico(query_string):
+    parametri, errore = _leggi_query(query_string)
+    if errore:
+        return go.Figure(), errore, "", ""
+    coppie, start_dt, end_dt = parametri
+    file_richiesti = list(dict.fromkeys(file_selezionato for file_selezionato, _ in coppie))
+
+    # Le visite ripetute allo stesso link non toccano né pandas né Plotly
+    chiave = (tuple(coppie), start_dt.isoformat(), end_dt.isoformat())
+    versione = tuple(_versione_sorgente(f) for f in file_richiesti)
+    if None in versione:
+        versione = None
+    uscite = _cache_figure.get(chiave, versione)
+    if uscite is not None:
+        return uscite
+
+    fig, errori = _figura_finestra(coppie, start_dt, end_dt, query_string)
+    if fig is None:
+        uscite = (go.Figure(), " ".join(errori), "", "")
+    else:
+        intervallo_testo = f"Selected interval: {start_dt.strftime('%d/%m/%Y %H:%M')} → {end_dt.strftime('%d/%m/%Y %H:%M')}"
+        etichette = [_etichetta(f, s, len(file_richiesti) > 1) for f, s in coppie]
+        title_text = f"Time Series - {', '.join(etichette)}"
+        uscite = (fig, " ".join(errori), intervallo_testo, title_text)
+
+    uscite = (json.loads(uscite[0].to_json()),) + uscite[1:]
+    _cache_figure.put(chiave, versione, uscite)
+    return uscite
+
+
+@dash.callback(
+    Output('sensore-graph', 'figure', allow_duplicate=True),
+    Input('sensore-graph', 'relayoutData'),
+    State('url', 'search'),
+    prevent_initial_call=True
+)
+def aggiorna_risoluzione(relayout, query_string):
+    """Allo zoom (o al reset dello zoom) ridisegna la finestra visibile alla risoluzione adatta."""
+    if not relayout:
+        return no_update
+    parametri, errore = _leggi_query(query_string)
+    if errore:
+        return no_update
+    coppie, inizio, fine = parametri
+
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        estremi = (relayout['xaxis.range[0]'], relayout['xaxis.range[1]'])
+    elif 'xaxis.range' in relayout:
+        estremi = relayout['xaxis.range']
+    elif relayout.get('xaxis.autorange'):
+        estremi = None  # doppio clic: si torna all'intervallo selezionato
+    else:
+        return no_update
 
-    intervallo_testo = f"Selected interval: {start_dt.strftime('%d/%m/%Y %H:%M')} → {end_dt.strftime('%d/%m/%Y %H:%M')}"
-    title_text = f"Time Series - {label_sensore}"
+    if estremi is not None:
+        try:
+            inizio, fine = (pd.Timestamp(e).to_pydatetime() for e in estremi)
+        except (ValueError, TypeError):
+            return no_update
 
-    return fig, "", intervallo_testo, title_text
\ No newline at end of file
+    fig, _ = _figura_finestra(coppie, inizio, fine, query_string)
+    return fig if fig is not None else no_update
@@ -5,7 +5,7 @@ import os
 import base64
 import uuid
 from db_utils import insert_general_report
-from export_file import esporta_database_in_csv, save_image
+from export_file import richiedi_esportazione_csv, save_image
 
 dash.register_page(__name__, path='/segnalazione_generica', title='MORE4WATER - General Report')
 
@@ -85,7 +85,8 @@ def submit_general_report_callback(n_clicks, first_name, last_name, province, ci
             return dbc.Alert(f"Error while uploading the photo: {str(e)}", color="danger")
 
     try:
-        insert_general_report(
+        # Ritorna dopo il COMMIT della riga (la scrittura è raggruppata con quelle contemporanee)
+        report_id = insert_general_report(
             first_name,
             last_name,
             province or '',
@@ -94,9 +95,10 @@ def submit_general_report_callback(n_clicks, first_name, last_name, province, ci
             problem_description,
             image_path
         )
-        
-        esporta_database_in_csv()
 
-        return dbc.Alert("General report submitted", color="success")
+        # I CSV vengono aggiornati in background, senza far attendere l'utente
+        richiedi_esportazione_csv()
+
+        return dbc.Alert(f"General report #{report_id} submitted", color="success")
     except Exception as e:
-        return dbc.Alert(f"Error submitting report or exporting data: {str(e)}", color="danger")
\ No newline at end of file
+        return dbc.Alert(f"Error submitting report: {str(e)}", color="danger")
\ No newline at end of file
@@ -1,22 +1,22 @@
 import os
-import pandas as pd
 import dash
 from dash import html, dcc, Input, Output, State
 import dash_bootstrap_components as dbc
 from db_utils import insert_report
-from export_file import esporta_database_in_csv
+from export_file import richiedi_esportazione_csv
+from data_loader import metadati_file
 
 dash.register_page(__name__, path='/segnalazione_specializzata', title='Insert Report') 
 
-# Percorso e caricamento CSV
+# Percorso del CSV: i sensori disponibili arrivano dall'indice dei metadati
 current_dir = os.path.dirname(__file__)
 project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
 csv_path = os.path.join(project_root, 'feeds.csv')
 
-df = pd.read_csv(csv_path)
+metadati = metadati_file(csv_path)
 
 # Lista sensori = colonne field1..field7 che esistono
-sensori = [f'field{i}' for i in range(1, 8) if f'field{i}' in df.columns]
+sensori = [f'field{i}' for i in range(1, 8) if metadati and f'field{i}' in metadati['sensori']]
 
 # --- MODIFICA APPORTATA QUI ---
 # Opzioni per il dropdown con etichette personalizzate
@@ -91,12 +91,12 @@ def submit_report(n_clicks, sensor_id, issue_type, description, priority):
         return dbc.Alert("Sensor ID and Issue Type are mandatory.", color="danger")
     try:
         user_id = None
-        # Passo 1: Inserimento del report nel database
-        insert_report(user_id, sensor_id, issue_type, description or '', priority or 1)
+        # Passo 1: Inserimento del report nel database (ritorna dopo il COMMIT della riga)
+        report_id = insert_report(user_id, sensor_id, issue_type, description or '', priority or 1)
         
-        # Passo 2: Esportazione in CSV
-        esporta_database_in_csv()
+        # Passo 2: Esportazione in CSV, differita e in background (vedi export_file)
+        richiedi_esportazione_csv()
 
-        return dbc.Alert("Report submitted and data exported to CSV successfully!", color="success")
+        return dbc.Alert(f"Report #{report_id} submitted successfully!", color="success")
     except Exception as e:
-        return dbc.Alert(f"Error submitting report or exporting data: {str(e)}", color="danger")
+        return dbc.Alert(f"Error submitting report: {str(e)}", color="danger")
@@ -0,0 +1,177 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# --- Piramide di aggregati a più risoluzioni (min, max, media, conteggio) ---
+#
+# Per ogni file e sensore vengono precalcolati gli aggregati a risoluzione
+# crescente. Ogni livello è costruito a partire dal precedente, quindi la
+# costruzione costa O(n) una sola volta; quando il file cresce vengono
+# aggregate solo le righe nuove e fuse con l'ultimo bucket esistente. Le
+# piramidi vengono costruite ed estese all'ingestione (vedi aggiorna_piramidi
+# e CacheDataFrame.get in data_loader), non alla prima visualizzazione.
+# Se i dati già aggregati cambiano (file corretto, calibrazione modificata)
+# la piramide viene ricostruita.
+
+# Risoluzioni della piramide, dalla più fine alla più grossolana ('raw' = dati originali)
+RISOLUZIONI = ['5min', '30min', '1h', '1D']
+
+COLONNE_AGGREGATI = ['min', 'max', 'mean', 'count']
+
+# Numero massimo di piramidi (file, sensore) conservate in memoria: basta per
+# i campi di tutte le stazioni precaricate, che le costruiscono all'ingestione
+MAX_PIRAMIDI = 256
+
+
+def _aggrega(istanti, valori, frequenza):
+    """Aggrega una serie grezza nei bucket della frequenza indicata."""
+    serie = pd.Series(np.asarray(valori, dtype='float64'), index=pd.DatetimeIndex(istanti))
+    aggregati = serie.groupby(serie.index.floor(frequenza)).agg(COLONNE_AGGREGATI)
+    aggregati['count'] = aggregati['count'].astype('int64')
+    return aggregati
+
+
+def _riaggrega(aggregati, frequenza):
+    """Costruisce un livello più grossolano combinando i bucket di quello più fine."""
+    gruppi = aggregati.index.floor(frequenza)
+    somma = (aggregati['mean'].fillna(0) * aggregati['count']).groupby(gruppi).sum()
+    risultato = pd.DataFrame({
+        'min': aggregati['min'].groupby(gruppi).min(),
+        'max': aggregati['max'].groupby(gruppi).max(),
+        'count': aggregati['count'].groupby(gruppi).sum(),
+    })
+    risultato['mean'] = (somma / risultato['count']).where(risultato['count'] > 0)
+    return risultato[COLONNE_AGGREGATI]
+
+
+def _unisci(aggregati, nuovi):
+    """Accoda i bucket nuovi fondendo quello eventualmente in comune con l'ultimo esistente."""
+    if nuovi.empty:
+        return aggregati
+    if aggregati.empty or nuovi.index[0] > aggregati.index[-1]:
+        return pd.concat([aggregati, nuovi])
+
+    comune = nuovi.index[0]
+    vecchio = aggregati.loc[comune]
+    nuovo = nuovi.loc[comune]
+    conteggio = int(vecchio['count'] + nuovo['count'])
+    somma = np.nan_to_num(vecchio['mean']) * vecchio['count'] + np.nan_to_num(nuovo['mean']) * nuovo['count']
+    fuso = pd.DataFrame({
+        'min': [np.fmin(vecchio['min'], nuovo['min'])],
+        'max': [np.fmax(vecchio['max'], nuovo['max'])],
+        'mean': [somma / conteggio if conteggio else np.nan],
+        'count': [conteggio],
+    }, index=pd.DatetimeIndex([comune]))
+    return pd.concat([aggregati.iloc[:-1], fuso, nuovi.iloc[1:]])
+
+
+class PiramideRollup:
+    """Aggregati di un sensore a tutte le risoluzioni di RISOLUZIONI."""
+
+    def __init__(self, istanti, valori):
+        self.livelli = {}
+        self.righe = 0
+        self.ultimo_istante = None
+        self.aggiorna(istanti, valori)
+
+    def aggiorna(self, istanti, valori):
+        """Aggiunge alla piramide righe successive a quelle già aggregate."""
+        istanti = pd.DatetimeIndex(istanti)
+        if len(istanti) == 0:
+            return
+        precedente = None
+        for frequenza in RISOLUZIONI:
+            if precedente is None:
+                nuovi = _aggrega(istanti, valori, frequenza)
+            else:
+                nuovi = _riaggrega(precedente, frequenza)
+            precedente = nuovi
+            self.livelli[frequenza] = _unisci(self.livelli.get(frequenza, nuovi.iloc[0:0]), nuovi)
+        self.righe += len(istanti)
+        self.ultimo_istante = istanti[-1]
+
+    def scegli_risoluzione(self, righe_grezze, inizio, fine, n_punti):
+        """
+        Sceglie la risoluzione più fine che mostra al massimo n_punti punti
+        nella finestra [inizio, fine]: 'raw' se bastano i dati originali.
+        """
+        if righe_grezze <= n_punti:
+            return 'raw'
+        durata = pd.Timestamp(fine) - pd.Timestamp(inizio)
+        for frequenza in RISOLUZIONI:
+            if durata / pd.Timedelta(frequenza) <= n_punti:
+                return frequenza
+        return RISOLUZIONI[-1]
+
+    def finestra(self, frequenza, inizio, fine):
+        """Bucket del livello richiesto che cadono nella finestra (ricerca binaria)."""
+        livello = self.livelli[frequenza]
+        a = livello.index.searchsorted(pd.Timestamp(inizio).floor(frequenza), side='left')
+        b = livello.index.searchsorted(pd.Timestamp(fine), side='right')
+        return livello.iloc[a:b]
+
+
+_piramidi = OrderedDict()  # (percorso assoluto, sensore) -> (PiramideRollup, DataFrame (rif. debole), impronta)
+_lock = threading.Lock()
+
+
+def _impronta_dati(df, sensore, righe):
+    """
+    Somme di istanti e valori delle prime righe del DataFrame: cambiano se
+    le righe già aggregate sono state riscritte o ricalibrate.
+    """
+    istanti = df['created_at'].iloc[:righe].to_numpy(dtype='datetime64[ns]').astype('int64')
+    valori = df[sensore].iloc[:righe].to_numpy(dtype='float64')
+    return int(istanti.sum()), float(np.nansum(valori))
+
+
+def _salva(chiave, piramide_sensore, df, sensore):
+    _piramidi[chiave] = (piramide_sensore, weakref.ref(df), _impronta_dati(df, sensore, piramide_sensore.righe))
+    _piramidi.move_to_end(chiave)
+    while len(_piramidi) > MAX_PIRAMIDI:
+        _piramidi.popitem(last=False)
+
+
+def piramide(percorso_csv, df, sensore):
+    """
+    Restituisce la piramide del sensore per il DataFrame (ordinato) del file.
+
+    Con lo stesso DataFrame già aggregato la piramide è riusata così com'è.
+    Con un DataFrame diverso (file cresciuto, ricaricato o ricalibrato) le
+    righe già aggregate vengono confrontate tramite l'impronta: se sono
+    invariate si aggregano solo le righe nuove, altrimenti la piramide viene
+    ricostruita.
+    """
+    chiave = (os.path.abspath(percorso_csv), sensore)
+    with _lock:
+        voce = _piramidi.get(chiave)
+        if voce is not None:
+            esistente, riferimento, impronta = voce
+            if riferimento() is df:
+                _piramidi.move_to_end(chiave)
+                return esistente
+            righe = esistente.righe
+            if len(df) >= righe > 0 and _impronta_dati(df, sensore, righe) == impronta:
+                if len(df) > righe:
+                    nuove = df.iloc[righe:]
+                    esistente.aggiorna(nuove['created_at'], nuove[sensore])
+                _salva(chiave, esistente, df, sensore)
+                return esistente
+        nuova = PiramideRollup(df['created_at'], df[sensore])
+        _salva(chiave, nuova, df, sensore)
+        return nuova
+
+
+def aggiorna_piramidi(percorso_csv, df):
+    """
+    Costruisce, o estende con le sole righe nuove, le piramidi di tutti i
+    campi fieldN del DataFrame del file: il primo grafico (o zoom) di una
+    stazione trova gli aggregati già pronti.
+    """
+    for sensore in df.columns:
+        if sensore.startswith('field') and sensore[5:].isdigit():
+            piramide(percorso_csv, df, sensore)
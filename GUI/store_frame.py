@@ -0,0 +1,102 @@
+import os
+import re
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # senza pyarrow i frame vengono salvati in .npz e letti con una copia
+    pa = None
+    ipc = None
+
+# --- Store di DataFrame lato server, condiviso tra i worker ---
+#
+# Ogni frame è un file Arrow IPC (un solo record batch, senza compressione)
+# nella cartella dello store, indicizzato da una chiave (es. il canale). La
+# scrittura è atomica (file temporaneo + os.replace), la lettura mappa il file
+# in memoria: le colonne numeriche e temporali diventano array NumPy che
+# puntano direttamente alle pagine del file, senza copie né deserializzazione.
+# Al browser basta la chiave (più una versione), non i dati.
+
+CARTELLA_STORE = os.environ.get(
+    'MORE4WATER_CARTELLA_STORE', os.path.join(tempfile.gettempdir(), 'more4water_store')
+)
+
+_CHIAVE_VALIDA = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+def _percorso(chiave, cartella):
+    if not _CHIAVE_VALIDA.match(chiave):
+        raise ValueError(f"Chiave dello store non valida: {chiave}")
+    estensione = '.arrow' if pa is not None else '.npz'
+    return os.path.join(cartella, chiave + estensione)
+
+
+def versione_frame(chiave, cartella=CARTELLA_STORE):
+    """Versione (inode, mtime_ns, size) del frame salvato, oppure None se non esiste."""
+    try:
+        stat = os.stat(_percorso(chiave, cartella))
+    except OSError:
+        return None
+    # os.replace crea sempre un nuovo inode: due versioni non coincidono anche a parità di dimensione
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def salva_frame(chiave, df, cartella=CARTELLA_STORE):
+    """
+    Salva un DataFrame con colonne numeriche o datetime64 e ne restituisce la versione.
+    I lettori che hanno già mappato la versione precedente continuano a vederla intatta.
+    """
+    os.makedirs(cartella, exist_ok=True)
+    percorso = _percorso(chiave, cartella)
+    colonne = {str(col): df[col].to_numpy() for col in df.columns}
+    tmp = f"{percorso}.{os.getpid()}.tmp"
+    if pa is not None:
+        # pa.array su array NumPy conserva i NaN come valori (non null): la lettura resta zero-copy
+        tabella = pa.table({col: pa.array(valori) for col, valori in colonne.items()})
+        with pa.OSFile(tmp, 'wb') as sink:
+            with ipc.new_file(sink, tabella.schema) as writer:
+                writer.write_table(tabella, max_chunksize=max(len(df), 1))
+    else:
+        with open(tmp, 'wb') as f:
+            np.savez(f, _colonne=np.array(list(colonne), dtype=str), **{f'c{i}': v for i, v in enumerate(colonne.values())})
+    os.replace(tmp, percorso)
+    return versione_frame(chiave, cartella)
+
+
+def leggi_frame(chiave, cartella=CARTELLA_STORE):
+    """
+    Legge un frame dallo store.
+
+    Con pyarrow il DataFrame restituito è una vista in sola lettura sul file
+    mappato in memoria (nessuna copia dei dati): non va modificato.
+
+    Restituisce:
+        tuple: (DataFrame, versione), oppure (None, None) se il frame non esiste.
+    """
+    percorso = _percorso(chiave, cartella)
+    # Versione letta prima di aprire il file: se nel frattempo viene sostituito
+    # si leggono dati più nuovi della versione, e il frame verrà solo riletto
+    versione = versione_frame(chiave, cartella)
+    try:
+        if pa is not None:
+            sorgente = pa.memory_map(percorso, 'r')
+            lettore = ipc.open_file(sorgente)
+            if lettore.num_record_batches == 0:
+                return pd.DataFrame(columns=lettore.schema.names), versione
+            batch = lettore.get_batch(0)
+            colonne = {
+                nome: batch.column(i).to_numpy(zero_copy_only=False)
+                for i, nome in enumerate(batch.schema.names)
+            }
+        else:
+            with np.load(percorso, allow_pickle=False) as dati:
+                nomi = list(dati['_colonne'])
+                colonne = {nome: dati[f'c{i}'] for i, nome in enumerate(nomi)}
+    except FileNotFoundError:
+        return None, None
+    return pd.DataFrame(colonne, copy=False), versione
+
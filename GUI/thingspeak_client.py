@@ -0,0 +1,273 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Client HTTP per l'API di ThingSpeak ---
+#
+# Una sessione persistente per indirizzo (connessioni TCP/TLS riusate),
+# timeout separati di connessione e lettura, tentativi ripetuti con attesa
+# esponenziale casuale (full jitter) e un circuit breaker: dopo troppi errori
+# consecutivi le richieste falliscono subito per PAUSA_CIRCUITO secondi,
+# servendo se richiesto l'ultima risposta valida, invece di bloccare i worker.
+# Finita la pausa il circuito è semiaperto: passa una sola richiesta di prova
+# (un solo tentativo) e le altre vengono rifiutate, o servite con l'ultima
+# risposta valida, finché la prova non richiude o riapre il circuito.
+# Aprono il circuito solo i guasti di ThingSpeak (rete, timeout, 429 e 5xx):
+# una richiesta sbagliata (4xx, es. canale inesistente o chiave non valida)
+# viene restituita al chiamante senza contare come errore consecutivo. Il
+# pool di connessioni è condiviso, ma ogni canale ha il proprio circuito:
+# una stazione che non risponde non ferma le altre.
+
+# Indirizzo dell'API: si può sovrascrivere (es. con un server di prova locale)
+THINGSPEAK_BASE_URL = os.environ.get('THINGSPEAK_BASE_URL', 'https://api.thingspeak.com')
+
+# Timeout in secondi: (connessione, lettura)
+TIMEOUT_CONNESSIONE = 3.05
+TIMEOUT_LETTURA = 10
+
+# Tentativi per richiesta e attesa massima tra due tentativi (secondi)
+TENTATIVI = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+
+# Errori consecutivi che aprono il circuito e secondi prima di riprovare
+SOGLIA_CIRCUITO = 5
+PAUSA_CIRCUITO = 60
+
+# Connessioni tenute aperte per indirizzo: una per ogni canale interrogato in parallelo
+DIMENSIONE_POOL = 64
+
+# Codici HTTP per cui ha senso ripetere la richiesta
+_CODICI_DA_RIPETERE = {429, 500, 502, 503, 504}
+
+# Latenze conservate per il calcolo dei percentili
+_CAMPIONI_LATENZA = 500
+
+
+class CircuitoAperto(requests.exceptions.RequestException):
+    """Il circuito è aperto: ThingSpeak non viene interrogato fino alla fine della pausa."""
+
+
+def _guasto_remoto(errore):
+    """True se l'errore indica ThingSpeak non disponibile e non una richiesta sbagliata (4xx)."""
+    risposta = getattr(errore, 'response', None)
+    if isinstance(errore, requests.exceptions.HTTPError) and risposta is not None:
+        return risposta.status_code == 429 or risposta.status_code >= 500
+    return True
+
+
+class ClientThingSpeak:
+    """Client con pool di connessioni, timeout, backoff e circuit breaker."""
+
+    def __init__(self, base_url=THINGSPEAK_BASE_URL, timeout=(TIMEOUT_CONNESSIONE, TIMEOUT_LETTURA),
+                 tentativi=TENTATIVI, soglia_circuito=SOGLIA_CIRCUITO, pausa_circuito=PAUSA_CIRCUITO):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.tentativi = tentativi
+        self.soglia_circuito = soglia_circuito
+        self.pausa_circuito = pausa_circuito
+
+        self.session = requests.Session()
+        adattatore = HTTPAdapter(pool_connections=DIMENSIONE_POOL, pool_maxsize=DIMENSIONE_POOL)
+        self.session.mount('http://', adattatore)
+        self.session.mount('https://', adattatore)
+
+        self._lock = threading.Lock()
+        # circuito (canale, None per le altre richieste) -> [errori consecutivi, aperto fino a, prova in corso]
+        self._circuiti = {}
+        self._ultime_buone = {}  # (percorso, parametri) -> ultima risposta JSON valida
+        self._latenze = deque(maxlen=_CAMPIONI_LATENZA)
+        self._contatori = {
+            'richieste': 0,
+            'successi': 0,
+            'errori': 0,
+            'tentativi_ripetuti': 0,
+            'rifiutate_circuito_aperto': 0,
+            'risposte_da_cache': 0,
+            'aperture_circuito': 0,
+        }
+        self._errori_per_tipo = {}
+
+    # --- Circuit breaker ---
+
+    def _stato(self, errori, aperto_fino, prova_in_corso=False):
+        if errori < self.soglia_circuito:
+            return 'chiuso'
+        return 'aperto' if time.monotonic() < aperto_fino else 'semiaperto'
+
+    def stato_circuito(self, circuito=None):
+        """
+        Stato del circuito di un canale (None per le richieste non legate a un
+        canale): 'chiuso', 'aperto' oppure 'semiaperto' (pausa finita: la
+        prossima richiesta fa da prova).
+        """
+        with self._lock:
+            return self._stato(*self._circuiti.get(circuito, (0, 0.0)))
+
+    def _ammetti(self, circuito):
+        """
+        Decide se una richiesta può partire: solleva CircuitoAperto se il
+        circuito è aperto, o semiaperto con una prova già in corso.
+        Restituisce True se la richiesta è la prova del circuito semiaperto.
+        """
+        with self._lock:
+            stato = self._circuiti.get(circuito)
+            condizione = self._stato(*stato) if stato else 'chiuso'
+            if condizione == 'semiaperto' and not stato[2]:
+                stato[2] = True
+                return True
+            if condizione == 'chiuso':
+                return False
+            self._contatori['rifiutate_circuito_aperto'] += 1
+        destinazione = self.base_url + (f" (canale {circuito})" if circuito is not None else "")
+        if condizione == 'aperto':
+            raise CircuitoAperto(f"Circuito aperto verso {destinazione}")
+        raise CircuitoAperto(f"Circuito semiaperto verso {destinazione}: prova già in corso")
+
+    def _fine_prova(self, circuito):
+        with self._lock:
+            stato = self._circuiti.get(circuito)
+            if stato is not None:
+                stato[2] = False
+
+    def _registra_successo(self, latenza, circuito):
+        with self._lock:
+            self._circuiti.pop(circuito, None)
+            self._contatori['successi'] += 1
+            self._latenze.append(latenza)
+
+    def _registra_errore(self, errore, circuito):
+        with self._lock:
+            self._contatori['errori'] += 1
+            tipo = type(errore).__name__
+            self._errori_per_tipo[tipo] = self._errori_per_tipo.get(tipo, 0) + 1
+            if not _guasto_remoto(errore):
+                return
+            stato = self._circuiti.setdefault(circuito, [0, 0.0, False])
+            stato[0] += 1
+            if stato[0] >= self.soglia_circuito:
+                if time.monotonic() >= stato[1]:
+                    self._contatori['aperture_circuito'] += 1
+                stato[1] = time.monotonic() + self.pausa_circuito
+
+    # --- Richieste ---
+
+    def _attesa(self, tentativo):
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** tentativo))
+
+    def _richiedi(self, url, params, circuito, tentativi):
+        ultimo_errore = None
+        for tentativo in range(tentativi):
+            if tentativo:
+                with self._lock:
+                    self._contatori['tentativi_ripetuti'] += 1
+                time.sleep(self._attesa(tentativo - 1))
+            inizio = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                response.raise_for_status()
+                dati = response.json()
+            except requests.exceptions.HTTPError as e:
+                ultimo_errore = e
+                if e.response is not None and e.response.status_code not in _CODICI_DA_RIPETERE:
+                    break
+                continue
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                ultimo_errore = e
+                continue
+            except ValueError as e:  # corpo non JSON
+                ultimo_errore = e
+                break
+            self._registra_successo(time.perf_counter() - inizio, circuito)
+            return dati
+        self._registra_errore(ultimo_errore, circuito)
+        raise ultimo_errore
+
+    def get_json(self, percorso, params=None, usa_ultima_buona=False, circuito=None):
+        """
+        Esegue una GET su base_url + percorso e restituisce il JSON della risposta.
+        circuito è il circuit breaker da usare (es. il canale interrogato).
+
+        Con usa_ultima_buona=True, se ThingSpeak non risponde (o il circuito è
+        aperto, o semiaperto con la prova affidata a un'altra richiesta) viene restituita l'ultima risposta valida alla stessa richiesta,
+        se esiste. Altrimenti viene sollevata un'eccezione di requests
+        (CircuitoAperto se la richiesta non è stata nemmeno tentata).
+        """
+        params = dict(params or {})
+        chiave = (percorso, tuple(sorted(params.items())))
+        with self._lock:
+            self._contatori['richieste'] += 1
+
+        try:
+            prova = self._ammetti(circuito)
+            try:
+                dati = self._richiedi(self.base_url + percorso, params, circuito, 1 if prova else self.tentativi)
+            finally:
+                if prova:
+                    self._fine_prova(circuito)
+        except (requests.exceptions.RequestException, ValueError):
+            if usa_ultima_buona and chiave in self._ultime_buone:
+                with self._lock:
+                    self._contatori['risposte_da_cache'] += 1
+                return self._ultime_buone[chiave]
+            raise
+
+        if usa_ultima_buona:
+            self._ultime_buone[chiave] = dati
+        return dati
+
+    def feeds(self, channel_id, api_key=None, usa_ultima_buona=False, **params):
+        """Feed di un canale (/channels/<id>/feeds.json) con i parametri dell'API."""
+        if api_key:
+            params['api_key'] = api_key
+        return self.get_json(f"/channels/{channel_id}/feeds.json", params, usa_ultima_buona, str(channel_id))
+
+    # --- Metriche ---
+
+    def metriche(self):
+        """
+        Contatori, errori per tipo, latenze (secondi) delle risposte valide e
+        stato dei circuiti: 'circuito' è 'aperto' se lo è almeno un canale,
+        'circuiti' elenca i canali con errori consecutivi.
+        """
+        with self._lock:
+            latenze = np.array(self._latenze)
+            metriche = dict(self._contatori)
+            metriche['errori_per_tipo'] = dict(self._errori_per_tipo)
+            circuiti = {
+                str(circuito): {'stato': self._stato(*stato), 'errori_consecutivi': stato[0], 'prova_in_corso': stato[2]}
+                for circuito, stato in self._circuiti.items()
+            }
+        metriche['circuiti'] = circuiti
+        stati = {circuito['stato'] for circuito in circuiti.values()}
+        metriche['circuito'] = next((stato for stato in ('aperto', 'semiaperto') if stato in stati), 'chiuso')
+        if len(latenze):
+            metriche['latenza'] = {
+                'ultima': float(latenze[-1]),
+                'media': float(latenze.mean()),
+                'p50': float(np.percentile(latenze, 50)),
+                'p95': float(np.percentile(latenze, 95)),
+                'max': float(latenze.max()),
+            }
+        else:
+            metriche['latenza'] = None
+        return metriche
+
+
+_client = {}  # base_url -> ClientThingSpeak
+_lock_client = threading.Lock()
+
+
+def client_thingspeak(base_url=THINGSPEAK_BASE_URL):
+    """Client condiviso (e quindi pool di connessioni condiviso) per un indirizzo dell'API."""
+    base_url = base_url.rstrip('/')
+    with _lock_client:
+        if base_url not in _client:
+            _client[base_url] = ClientThingSpeak(base_url)
+        return _client[base_url]
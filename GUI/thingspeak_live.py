@@ -0,0 +1,537 @@
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi, ogni processo interroga da sé
+    fcntl = None
+
+from archivio_thingspeak import archivio_thingspeak, secondi_epoch
+from configurazione import FUSO_ORARIO
+from data_loader import THINGSPEAK_API_KEY, THINGSPEAK_CHANNEL_ID
+from thingspeak_client import THINGSPEAK_BASE_URL, client_thingspeak
+from store_frame import leggi_frame, salva_frame, versione_frame
+
+# --- Flusso incrementale dei dati in tempo reale da ThingSpeak ---
+#
+# Il primo aggiornamento scarica gli ultimi punti del canale; i successivi
+# chiedono solo le entry più recenti dell'ultima ricevuta. L'API dei feed non
+# filtra per entry_id: si chiede a partire dall'istante dell'ultima entry
+# (parametro start) e si scartano lato client quelle già viste. Le righe
+# nuove finiscono in un buffer circolare di capacità fissa e nell'archivio
+# locale (vedi archivio_thingspeak), che conserva tutto lo storico.
+
+# Numero di punti conservati in memoria per ogni canale
+CAPACITA_BUFFER = 10_000
+
+# Massimo numero di risultati restituiti da una richiesta all'API dei feed
+MAX_RISULTATI_API = 8000
+
+
+class BufferCircolare:
+    """
+    Buffer circolare di capacità fissa basato su array NumPy.
+
+    Conserva istanti (datetime64[ns]), entry_id e i valori dei campi come
+    matrice float64. L'inserimento costa O(righe nuove): quando il buffer è
+    pieno le righe più vecchie vengono sovrascritte.
+    """
+
+    def __init__(self, capacita, campi):
+        self.capacita = capacita
+        self.campi = list(campi)
+        self._istanti = np.empty(capacita, dtype='datetime64[ns]')
+        self._entry_id = np.empty(capacita, dtype='int64')
+        self._valori = np.full((capacita, len(self.campi)), np.nan)
+        self._scritti = 0
+
+    def __len__(self):
+        return min(self._scritti, self.capacita)
+
+    def aggiungi(self, istanti, entry_id, valori):
+        """Accoda le righe (già ordinate); se sono più della capacità tiene le ultime."""
+        n = len(istanti)
+        if n == 0:
+            return
+        if n > self.capacita:
+            istanti, entry_id, valori = istanti[-self.capacita:], entry_id[-self.capacita:], valori[-self.capacita:]
+            self._scritti += n - self.capacita
+            n = self.capacita
+        posizioni = (self._scritti + np.arange(n)) % self.capacita
+        self._istanti[posizioni] = istanti
+        self._entry_id[posizioni] = entry_id
+        self._valori[posizioni] = valori
+        self._scritti += n
+
+    def _ordine(self, n=None):
+        righe = len(self)
+        n = righe if n is None else min(n, righe)
+        return (self._scritti - n + np.arange(n)) % self.capacita
+
+    def df(self, n=None):
+        """Restituisce le ultime n righe (tutte se n è None) in ordine cronologico."""
+        posizioni = self._ordine(n)
+        df = pd.DataFrame(self._valori[posizioni], columns=self.campi)
+        df.insert(0, 'entry_id', self._entry_id[posizioni])
+        df.insert(0, 'created_at', self._istanti[posizioni])
+        return df
+
+
+class LiveThingSpeak:
+    """
+    Scarica in modo incrementale i feed di un canale ThingSpeak.
+
+    base_url permette di puntare a un server di prova che implementi
+    /channels/<id>/feeds.json come l'API di ThingSpeak. Le richieste passano
+    dal client condiviso per quell'indirizzo (timeout, backoff, circuit breaker).
+    Le entry nuove vengono salvate in archivio (None per non archiviarle).
+    """
+
+    def __init__(self, channel_id=THINGSPEAK_CHANNEL_ID, api_key=THINGSPEAK_API_KEY,
+                 base_url=THINGSPEAK_BASE_URL, capacita=CAPACITA_BUFFER, archivio=archivio_thingspeak, nome=None):
+        self.channel_id = str(channel_id)
+        self.nome = nome or f"Channel {self.channel_id}"
+        self.api_key = api_key
+        self.client = client_thingspeak(base_url)
+        self.capacita = capacita
+        self.archivio = archivio
+        self.buffer = None
+        self.ultimo_entry_id = None
+        self._ultimo_istante_utc = None
+        self.ultimo_successo = None  # time.time() dell'ultima risposta valida
+        self.ultimo_errore = None  # tipo dell'ultimo errore, None dopo una risposta valida
+        self._lock = threading.Lock()
+
+    def _scarica(self):
+        if self.ultimo_entry_id is None:
+            params = {'results': min(self.capacita, MAX_RISULTATI_API)}
+        else:
+            # L'entry con l'istante di partenza torna di nuovo e viene scartata dal filtro su entry_id
+            params = {'start': self._ultimo_istante_utc.strftime('%Y-%m-%d %H:%M:%S'), 'timezone': 'UTC'}
+        return self.client.feeds(self.channel_id, self.api_key, **params).get('feeds', [])
+
+    def aggiorna(self):
+        """
+        Scarica le entry nuove e le accoda al buffer.
+
+        Restituisce:
+            int: Il numero di punti nuovi, oppure 0 in caso di errore.
+        """
+        with self._lock:
+            try:
+                feeds = self._scarica()
+            except requests.exceptions.RequestException as e:
+                print(f"Errore nella richiesta a ThingSpeak: {e}")
+                self.ultimo_errore = type(e).__name__  # senza URL: contiene la chiave API
+                return 0
+            except ValueError as e:
+                print(f"Risposta non valida da ThingSpeak: {e}")
+                self.ultimo_errore = type(e).__name__  # senza URL: contiene la chiave API
+                return 0
+            self.ultimo_successo = time.time()
+            self.ultimo_errore = None
+            if self.ultimo_entry_id is not None:
+                feeds = [f for f in feeds if f.get('entry_id', 0) > self.ultimo_entry_id]
+            if not feeds:
+                return 0
+
+            nuove = pd.DataFrame(feeds)
+            nuove = nuove.drop_duplicates('entry_id', keep='last').sort_values('entry_id')
+            if self.buffer is None:
+                campi = sorted(
+                    (col for col in nuove.columns if col.startswith('field') and col[5:].isdigit()),
+                    key=lambda col: int(col[5:]),
+                )
+                self.buffer = BufferCircolare(self.capacita, campi)
+
+            # Conversione del fuso orario solo per le righe nuove
+            istanti_utc = pd.to_datetime(nuove['created_at'], utc=True)
+            istanti = istanti_utc.dt.tz_convert(FUSO_ORARIO).dt.tz_localize(None)
+            valori = nuove.reindex(columns=self.buffer.campi).apply(pd.to_numeric, errors='coerce')
+
+            self.buffer.aggiungi(
+                istanti.to_numpy(dtype='datetime64[ns]'),
+                nuove['entry_id'].to_numpy(dtype='int64'),
+                valori.to_numpy(dtype='float64'),
+            )
+            self.ultimo_entry_id = int(nuove['entry_id'].iat[-1])
+            self._ultimo_istante_utc = istanti_utc.iat[-1]
+
+            if self.archivio is not None:
+                try:
+                    self.archivio.salva(
+                        self.channel_id,
+                        secondi_epoch(istanti_utc),
+                        nuove['entry_id'].to_numpy(dtype='int64'),
+                        valori.to_numpy(dtype='float64'),
+                        self.buffer.campi,
+                    )
+                except (sqlite3.Error, ValueError) as e:
+                    # Il buffer resta aggiornato: le entry mancanti si recuperano con il backfill
+                    print(f"Errore nel salvataggio nell'archivio ThingSpeak: {e}")
+            return len(nuove)
+
+    def df(self, n=None):
+        """Ultimi n punti del buffer (tutti se n è None) come DataFrame, vuoto se non ci sono dati."""
+        with self._lock:
+            if self.buffer is None:
+                return pd.DataFrame()
+            return self.buffer.df(n)
+
+
+# --- Canali delle stazioni ---
+#
+# Ogni stazione ha il proprio canale ThingSpeak. I canali si configurano in un
+# file JSON indicato dalla variabile THINGSPEAK_CANALI, con una lista di
+# oggetti {"id": "...", "api_key": "...", "nome": "..."} (api_key e nome
+# facoltativi); senza file si usa il solo canale predefinito di data_loader.
+
+THINGSPEAK_CANALI = os.environ.get('THINGSPEAK_CANALI')
+
+
+def carica_canali(percorso=THINGSPEAK_CANALI):
+    """
+    Legge la configurazione dei canali.
+
+    Restituisce:
+        list: Un dict per canale con chiavi 'id', 'api_key' e 'nome'; il primo
+        è il canale predefinito delle pagine in tempo reale.
+    """
+    if not percorso:
+        return [{'id': THINGSPEAK_CHANNEL_ID, 'api_key': THINGSPEAK_API_KEY, 'nome': f"Channel {THINGSPEAK_CHANNEL_ID}"}]
+    with open(percorso, 'r', encoding='utf-8') as f:
+        voci = json.load(f)
+    canali = []
+    for voce in voci:
+        canale = str(voce['id'])
+        if any(c['id'] == canale for c in canali):
+            raise ValueError(f"Canale ripetuto nella configurazione: {canale}")
+        canali.append({'id': canale, 'api_key': voce.get('api_key'), 'nome': voce.get('nome') or f"Channel {canale}"})
+    if not canali:
+        raise ValueError(f"Nessun canale configurato in {percorso}")
+    return canali
+
+
+# --- Poller condiviso: un solo processo interroga ThingSpeak, gli altri leggono lo snapshot ---
+#
+# Con più worker gunicorn ogni processo avvia il proprio PollerThingSpeak, ma
+# solo quello che ottiene il lock esclusivo sul file dei canali (il leader)
+# interroga l'API e pubblica i dati nello store condiviso (vedi store_frame);
+# gli altri (follower) li rimappano in memoria, senza copie, quando cambiano e
+# tentano di diventare leader a ogni giro, così se il leader termina un altro
+# processo ne prende il posto. I canali vengono interrogati in parallelo da un
+# pool di thread limitato: un giro dura quanto la richiesta più lenta, non
+# quanto la somma delle richieste.
+
+# Secondi tra due interrogazioni di ThingSpeak (allineato al canale)
+INTERVALLO_POLLING = 20
+
+# Secondi tra due controlli dello snapshot da parte dei follower
+INTERVALLO_LETTURA_SNAPSHOT = 2
+
+# Lo snapshot è considerato vecchio dopo questo numero di intervalli senza risposte valide
+FATTORE_STANTIO = 3
+
+# Cartella condivisa tra i worker per lock e stato del poller
+CARTELLA_SNAPSHOT = os.environ.get('THINGSPEAK_CARTELLA_SNAPSHOT', tempfile.gettempdir())
+
+# Richieste contemporanee al massimo durante un giro (thread del pool)
+MAX_RICHIESTE_PARALLELE = 64
+
+
+class PollerThingSpeak:
+    """
+    Interroga periodicamente uno o più canali in un thread in background, una
+    sola volta per tutti i client e per tutti i worker. Le callback leggono
+    solo snapshot() e ultimi_valori().
+    """
+
+    def __init__(self, live, intervallo=INTERVALLO_POLLING, cartella=CARTELLA_SNAPSHOT,
+                 max_paralleli=MAX_RICHIESTE_PARALLELE):
+        lives = [live] if isinstance(live, LiveThingSpeak) else list(live)
+        self.lives = {l.channel_id: l for l in lives}
+        self.live = lives[0]  # canale predefinito
+        self.intervallo = intervallo
+        self.max_paralleli = max_paralleli
+        nome = self.live.channel_id if len(lives) == 1 else 'canali'
+        base = os.path.join(cartella, f"more4water_thingspeak_{nome}")
+        self.percorso_lock = base + '.lock'
+        self.percorso_stato = base + '.json'
+        self.nome = nome
+        self.leader = False
+        self._file_lock = None
+        self._thread = None
+        self._pool = None
+        self._pid = None
+        self._ferma = threading.Event()
+        self._lock = threading.Lock()
+        # Svegliata a ogni pubblicazione di dati nuovi (vedi attendi_dati)
+        self._dati_nuovi = threading.Condition(self._lock)
+        self._df = {canale: pd.DataFrame() for canale in self.lives}
+        self._versioni_dati = {}
+        self._stato = {
+            'leader_pid': None, 'metriche_client': None,
+            'canali': {canale: self._stato_vuoto() for canale in self.lives},
+        }
+        self._atexit_registrato = False
+
+    @staticmethod
+    def _stato_vuoto():
+        return {'ultimo_entry_id': None, 'ultimo_successo': None, 'ultimo_errore': None, 'circuito': 'chiuso'}
+
+    @staticmethod
+    def chiave_store(canale):
+        """Chiave dello store condiviso con le ultime righe di un canale."""
+        return f"thingspeak_{canale}"
+
+    # --- Ciclo di vita ---
+
+    def avvia(self):
+        """Avvia il thread del poller se non è già attivo in questo processo (anche dopo un fork)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Dopo un fork il lock, il thread e il pool appartengono al processo padre
+                self.leader = False
+                self._file_lock = None
+                self._pool = None
+            self._pid = os.getpid()
+            self._ferma.clear()
+            if self._pool is None and len(self.lives) > 1:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=min(len(self.lives), self.max_paralleli),
+                    thread_name_prefix=f"thingspeak-{self.nome}",
+                )
+            self._thread = threading.Thread(
+                target=self._ciclo, name=f"poller-thingspeak-{self.nome}", daemon=True
+            )
+            self._thread.start()
+            if not self._atexit_registrato:
+                atexit.register(self.ferma)
+                self._atexit_registrato = True
+
+    def ferma(self, timeout=5):
+        """Ferma il thread, attende la fine del giro in corso e cede la leadership."""
+        self._ferma.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self._cedi_leadership()
+
+    def _prova_leadership(self):
+        if self.leader:
+            return True
+        if fcntl is None:
+            self.leader = True
+            return True
+        file_lock = open(self.percorso_lock, 'a+')
+        try:
+            fcntl.flock(file_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file_lock.close()
+            return False
+        file_lock.seek(0)
+        file_lock.truncate()
+        file_lock.write(str(os.getpid()))
+        file_lock.flush()
+        self._file_lock = file_lock
+        self.leader = True
+        print(f"Poller ThingSpeak: processo {os.getpid()} leader per {len(self.lives)} canali ({self.nome})")
+        return True
+
+    def _cedi_leadership(self):
+        with self._lock:
+            if self._file_lock is not None and self._pid == os.getpid():
+                fcntl.flock(self._file_lock, fcntl.LOCK_UN)
+                self._file_lock.close()
+            self._file_lock = None
+            self.leader = False
+
+    def _ciclo(self):
+        while not self._ferma.is_set():
+            try:
+                if self._prova_leadership():
+                    self._interroga()
+                else:
+                    self._leggi_snapshot()
+            except Exception as e:
+                print(f"Errore nel poller ThingSpeak: {e}")
+            self._ferma.wait(self.intervallo if self.leader else INTERVALLO_LETTURA_SNAPSHOT)
+
+    # --- Leader: interroga e pubblica ---
+
+    def aggiorna_canali(self):
+        """
+        Interroga tutti i canali in parallelo (ognuno in modo incrementale).
+
+        Restituisce:
+            dict: Per ogni canale il numero di punti nuovi.
+        """
+        lives = list(self.lives.values())
+        if self._pool is None:
+            return {live.channel_id: live.aggiorna() for live in lives}
+        return dict(zip(self.lives, self._pool.map(LiveThingSpeak.aggiorna, lives)))
+
+    def _interroga(self):
+        nuovi = self.aggiorna_canali()
+        stato = {
+            'leader_pid': os.getpid(),
+            'metriche_client': self.live.client.metriche(),
+            'canali': {
+                canale: {
+                    'ultimo_entry_id': live.ultimo_entry_id,
+                    'ultimo_successo': live.ultimo_successo,
+                    'ultimo_errore': live.ultimo_errore,
+                    'circuito': live.client.stato_circuito(live.channel_id),
+                }
+                for canale, live in self.lives.items()
+            },
+        }
+        aggiornati = {}
+        for canale, live in self.lives.items():
+            if nuovi[canale] or self._df[canale].empty:
+                df = live.df()
+                if not df.empty:
+                    salva_frame(self.chiave_store(canale), df)
+                aggiornati[canale] = df
+        self._scrivi_atomico(self.percorso_stato, json.dumps(stato).encode('utf-8'))
+        with self._lock:
+            self._df.update(aggiornati)
+            self._stato = stato
+            if aggiornati:
+                self._dati_nuovi.notify_all()
+
+    @staticmethod
+    def _scrivi_atomico(percorso, contenuto):
+        tmp = f"{percorso}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(contenuto)
+        os.replace(tmp, percorso)
+
+    # --- Follower: rimappa i dati dello store quando cambiano ---
+
+    def _leggi_snapshot(self):
+        aggiornati = {}
+        for canale in self.lives:
+            chiave = self.chiave_store(canale)
+            versione = versione_frame(chiave)
+            if versione is not None and versione != self._versioni_dati.get(canale):
+                aggiornati[canale], self._versioni_dati[canale] = leggi_frame(chiave)
+        try:
+            with open(self.percorso_stato, 'rb') as f:
+                stato = json.loads(f.read())
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._df.update({canale: df for canale, df in aggiornati.items() if df is not None})
+            self._stato = stato
+            if aggiornati:
+                self._dati_nuovi.notify_all()
+
+    # --- Lettura per le callback ---
+
+    def _eta(self, stato_canale):
+        ultimo_successo = stato_canale['ultimo_successo']
+        eta = time.time() - ultimo_successo if ultimo_successo else None
+        return eta, eta is None or eta > FATTORE_STANTIO * self.intervallo
+
+    def snapshot(self, canale=None):
+        """
+        Restituisce l'ultimo snapshot di un canale, quello predefinito se
+        canale è None (avviando il poller se serve).
+
+        Restituisce:
+            dict: 'df' (DataFrame da non modificare), 'canale', 'nome',
+            'ultimo_entry_id', 'ultimo_successo', 'ultimo_errore', 'circuito'
+            (circuit breaker del canale), 'leader_pid',
+            'metriche_client' (metriche del client HTTP del leader), 'eta'
+            (secondi dall'ultima risposta valida di ThingSpeak, None se mai
+            ricevuta) e 'stantio' (True se i dati non sono aggiornati da
+            FATTORE_STANTIO intervalli). KeyError se il canale non è configurato.
+        """
+        canale = self.live.channel_id if canale is None else str(canale)
+        live = self.lives[canale]
+        self.avvia()
+        with self._lock:
+            stato_canale = self._stato['canali'].get(canale) or self._stato_vuoto()
+            snapshot = dict(
+                stato_canale, df=self._df[canale], canale=canale, nome=live.nome,
+                leader_pid=self._stato['leader_pid'], metriche_client=self._stato['metriche_client'],
+            )
+        snapshot['eta'], snapshot['stantio'] = self._eta(stato_canale)
+        return snapshot
+
+    def attendi_dati(self, canale, entry_id, timeout):
+        """
+        Attende, senza consumare CPU, che il canale abbia entry successive a
+        entry_id, al massimo per timeout secondi.
+
+        Restituisce:
+            pandas.DataFrame: Le righe dello snapshot con entry_id maggiore di
+            quello indicato (vuoto allo scadere del timeout).
+        """
+        canale = str(canale)
+        self.avvia()
+        scadenza = time.monotonic() + timeout
+        with self._dati_nuovi:
+            while True:
+                df = self._df[canale]
+                if len(df) and df['entry_id'].iat[-1] > entry_id:
+                    break
+                resto = scadenza - time.monotonic()
+                if resto <= 0:
+                    return df.iloc[0:0]
+                self._dati_nuovi.wait(resto)
+        return df.iloc[df['entry_id'].searchsorted(entry_id, side='right'):]
+
+    def ultimi_valori(self):
+        """
+        Ultima entry ricevuta da ogni canale, senza interrogare ThingSpeak.
+
+        Restituisce:
+            pandas.DataFrame: Una riga per canale (nell'ordine della
+            configurazione) con 'canale', 'nome', 'created_at', 'entry_id', i
+            campi fieldN, 'eta' e 'stantio'; created_at è NaT se il canale non ha dati.
+        """
+        self.avvia()
+        with self._lock:
+            stati = dict(self._stato['canali'])
+            ultime = {canale: df.iloc[-1:] for canale, df in self._df.items()}
+        righe = []
+        for canale, live in self.lives.items():
+            eta, stantio = self._eta(stati.get(canale) or self._stato_vuoto())
+            riga = {'canale': canale, 'nome': live.nome}
+            if len(ultime[canale]):
+                riga.update(ultime[canale].iloc[0].to_dict())
+            righe.append(dict(riga, eta=eta, stantio=stantio))
+        df = pd.DataFrame(righe)
+        campi = sorted((c for c in df.columns if c.startswith('field') and c[5:].isdigit()), key=lambda c: int(c[5:]))
+        colonne = ['canale', 'nome', 'created_at', 'entry_id', *campi, 'eta', 'stantio']
+        return df.reindex(columns=colonne)
+
+
+# Canali configurati (il primo è quello predefinito)
+canali_thingspeak = carica_canali()
+
+# Flusso di ogni canale, condiviso dalle callback del processo
+lives_thingspeak = [LiveThingSpeak(c['id'], c['api_key'], nome=c['nome']) for c in canali_thingspeak]
+
+# Flusso del canale predefinito
+live_thingspeak = lives_thingspeak[0]
+
+# Poller condiviso di tutti i canali
+poller_thingspeak = PollerThingSpeak(lives_thingspeak)
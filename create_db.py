@@ -1,55 +1,16 @@
-import sqlite3
 import os
-from GUI.db_utils import DB_PATH
+import sys
 
-def create_tables():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Tabella degli utenti
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        role TEXT DEFAULT 'user',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
+# I moduli della GUI si importano come fa l'app, dalla cartella GUI
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'GUI'))
 
-    # Tabella delle segnalazioni specializzate
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS reports (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        sensor_id TEXT,
-        issue_type TEXT NOT NULL,
-        description TEXT,
-        priority INTEGER DEFAULT 1,
-        status TEXT DEFAULT 'open',
-        timestamp TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
+from database import DB_PATH, inizializza_database
 
-    # Tabella delle segnalazioni generiche
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS general_reports (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT,
-        first_name TEXT,
-        last_name TEXT,
-        province TEXT,
-        city TEXT,
-        address TEXT,
-        problem_description TEXT,
-        image_path TEXT
-    )
-    ''')
-
-    conn.commit()
-    conn.close()
+def create_tables():
+    # Le tabelle (users, reports, general_reports) sono definite una sola volta
+    # nel livello di accesso al database, usato anche dall'app
+    inizializza_database()
+    print(f"Database pronto: {DB_PATH}")
 
 if __name__ == '__main__':
     create_tables()